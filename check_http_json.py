@@ -1,15 +1,31 @@
 #!/usr/bin/env python3
 
-import urllib.request, urllib.error, urllib.parse
 import base64
+import codecs
+import collections
+import copy
+import functools
+import io
+import itertools
 import json
 import argparse
+import math
+import os
+import queue
+import random
+import re
+import select
+import shlex
+import string
+import stat
 import sys
-import ssl
-import traceback
-from urllib.error import HTTPError
-from urllib.error import URLError
-from datetime import datetime, timedelta, timezone
+import threading
+import time
+import zlib
+# Modules that only some checks need and that take milliseconds to import,
+# such as urllib (about 30ms alone), ssl, hashlib, datetime or cProfile, are
+# imported where they are used, with import-outside-toplevel disabled on
+# those lines. preload imports all of them for the daemon.
 
 plugin_description = \
 """
@@ -28,9 +44,100 @@ UNKNOWN_CODE = 3
 __version__ = '2.3.1'
 __version_date__ = '2026-02-25'
 
+# Name of the Unix socket of the daemon, see default_socket
+SOCKET_NAME = 'check_http_json.sock'
+# Directory of the response cache in the temporary directory, followed by the user id
+CACHE_DIR_NAME = 'check_http_json-cache'
+# Cached responses older than this are evicted, whatever TTL they were stored for
+CACHE_MAX_AGE = 3600
+# Seconds the daemon waits for a client to send its request
+REQUEST_TIMEOUT = 1
+
+NOT_FOUND = (None, 'not_found')
+# Key path token standing for every element of an array, see _compileKey
+ARRAY_WILDCARD = object()
+# Separates the document name from the key when checking several paths
+NAMESPACE_SEPARATOR = ':'
+# Response bodies are read in chunks of this size
+BODY_CHUNK_SIZE = 65536
+# Default of --max-decompressed-size, guards against decompression bombs
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+# Returned instead of the document when a conditional request was not modified
+NOT_MODIFIED = object()
+# Rules relative to the current time, evaluated even if the response was not modified
+TIME_RULES = ('key_time_list', 'key_time_list_critical')
+# Aggregate function around a key with (*) wildcards, such as max(nodes(*).latency)
+_AGGREGATE = re.compile(r'^(count|min|max|sum|avg|p(?:100|\d{1,2}(?:\.\d+)?))\((.*\((?:\*|\?[^)]*)\).*)\)$')
+# The (*) wildcards and (?...) predicates of a key
+_WILDCARDS = re.compile(r'\(\*\)|\(\?[^)]*\)')
+# Comparison of a predicate such as state!=ok, without one it checks the existence
+_PREDICATE = re.compile(r'^(.*?)(==|!=|<|>)(.*)$')
+# Numeric timestamps from this value on are epoch milliseconds, it is
+# March 1973 in milliseconds but the year 5138 in seconds
+EPOCH_MILLISECONDS = 10 ** 11
+# First backoff of --retries in seconds, doubled with every retry
+RETRY_BACKOFF = 0.1
+# Failed keys listed in the summary of an output over --max-output-length
+SUMMARY_FAILURES = 5
+# A label and value of the performance data, labels may be quoted with '' as escaped quote
+_PERFORMANCE_DATA = re.compile(r"(?:'(?:[^']|'')*'|[^'\s])\S*")
+class RuleFailure:
+    """
+    A key that failed a rule, rendered as its reason
+    """
+    __slots__ = ('state', 'key', 'alias', 'value', 'reason')
+
+    def __init__(self, state, key, alias, value, reason):
+        self.state = state
+        self.key = key
+        self.alias = alias
+        self.value = value
+        self.reason = reason
+
+    def __str__(self):
+        return ' ' + self.reason
+
+    def __repr__(self):
+        return 'RuleFailure(%r, %r, %r, %r, %r)' % (self.state, self.key, self.alias, self.value, self.reason)
+
+
+def renderMessages(messages):
+    """
+    The text of a list of messages and RuleFailures, without the | that
+    separates the performance data
+    """
+    return ''.join([' ' + message.reason if message.__class__ is RuleFailure else message
+                    for message in messages]).replace('|', ' ')
+
+
+def _messages(code):
+    """
+    The rendered messages of a state, set as a single message
+    """
+    def get(self):
+        return renderMessages(self.messages[code])
+
+    def level_set(self, message):
+        self.messages[code] = [message] if message else []
+
+    return property(get, level_set)
+
+
+def perfLabel(label):
+    """
+    Quote a performance data label, the quote and = are not allowed in it
+    """
+    label = str(label)
+    if "'" in label or '=' in label or '|' in label:
+        label = label.replace("'", "''").replace('=', '_').replace('|', ' ')
+    return "'%s'" % label
+
+
 class NagiosHelper:
     """
     Help with Nagios specific status string formatting.
+    The messages of every state are collected as strings or RuleFailures
+    and only rendered by getMessage.
     """
 
     message_prefixes = {OK_CODE: 'OK',
@@ -38,47 +145,93 @@ class NagiosHelper:
                         CRITICAL_CODE: 'CRITICAL',
                         UNKNOWN_CODE: 'UNKNOWN'}
     performance_data = ''
-    warning_message = ''
-    critical_message = ''
-    unknown_message = ''
+    # Shown in front of the other messages, append_message ignores OK messages
+    ok_message = ''
+    warning_message = _messages(WARNING_CODE)
+    critical_message = _messages(CRITICAL_CODE)
+    unknown_message = _messages(UNKNOWN_CODE)
+
+    def __init__(self):
+        self.messages = {WARNING_CODE: [], CRITICAL_CODE: [], UNKNOWN_CODE: []}
 
-    def getMessage(self, message=''):
+    def getMessage(self, message='', max_length=0):
         """
         Build a status-prefixed message with optional performance data
-        generated externally
+        generated externally. An output longer than max_length is shortened,
+        the performance data is only cut between its values.
         """
-
-        message += self.warning_message
-        message += self.critical_message
-        message += self.unknown_message
+        messages = self.messages[WARNING_CODE] + self.messages[CRITICAL_CODE] + self.messages[UNKNOWN_CODE]
         code = self.message_prefixes[self.getCode()]
-        output = "{code}: Status {code}. {message}".format(code=code, message=message.strip())
-        if self.performance_data:
-            output = "{code}: {perf_data} Status {code}. {message}|{perf_data}".format(
-                code=code,
-                message=message.strip(),
-                perf_data=self.performance_data)
-        return output.strip()
+        message += self.ok_message.replace('|', ' ')
+        text = message + renderMessages(messages)
+        output = self.formatMessage(code, text, self.performance_data, True)
+        if not max_length or len(output) <= max_length:
+            return output
+
+        # The performance data in front of the status is a copy, drop it first
+        output = self.formatMessage(code, text, self.performance_data, False)
+        if len(output) <= max_length:
+            return output
+
+        # Summarize the failed keys, the most severe first
+        failures = sorted((m for m in messages if isinstance(m, RuleFailure)), key=lambda m: -m.state)
+        if len(failures) > SUMMARY_FAILURES:
+            message += ''.join(m for m in messages if not isinstance(m, RuleFailure))
+            message += " %d keys failed, first %d:" % (len(failures), SUMMARY_FAILURES)
+            message += renderMessages(failures[:SUMMARY_FAILURES])
+        else:
+            message = text
+
+        # Then drop performance data values from the end
+        performance_data = _PERFORMANCE_DATA.findall(self.performance_data)
+        available = max_length - len(self.formatMessage(code, message, '-', False)) + 1
+        length = -1
+        for count, value in enumerate(performance_data):
+            length += len(value) + 1
+            if length > available:
+                del performance_data[count:]
+                break
+        output = self.formatMessage(code, message, ' '.join(performance_data), False)
+
+        # And cut the message
+        if len(output) > max_length:
+            message = message.strip()
+            message = message[:max(len(message) - (len(output) - max_length) - 3, 0)] + '...'
+            output = self.formatMessage(code, message, '', False)[:max_length]
+        return output
+
+    @staticmethod
+    def formatMessage(code, message, performance_data, repeat_performance_data):
+        output = "{code}: Status {code}. {message}"
+        if performance_data and repeat_performance_data:
+            output = "{code}: {perf_data} Status {code}. {message}|{perf_data}"
+        elif performance_data:
+            output = "{code}: Status {code}. {message}|{perf_data}"
+        return output.format(code=code, message=message.strip(), perf_data=performance_data).strip()
 
     def getCode(self):
         code = OK_CODE
-        if (self.warning_message != ''):
+        if self.messages[WARNING_CODE]:
             code = WARNING_CODE
-        if (self.critical_message != ''):
+        if self.messages[CRITICAL_CODE]:
             code = CRITICAL_CODE
-        if (self.unknown_message != ''):
+        if self.messages[UNKNOWN_CODE]:
             code = UNKNOWN_CODE
         return code
 
     def append_message(self, code, msg):
-        # Just to be sure that the | char is not included
-        msg = msg.replace('|', ' ')
+        """
+        Add a message or a list of RuleFailures to the messages of a state
+        """
+        if not msg or code == OK_CODE:
+            return
+        if isinstance(msg, str):
+            # Just to be sure that the | char is not included, the
+            # reasons of RuleFailures are only cleaned up when rendered
+            msg = [msg.replace('|', ' ')]
         if code > 2 or code < 0:
-            self.unknown_message += msg
-        if code == 1:
-            self.warning_message += msg
-        if code == 2:
-            self.critical_message += msg
+            code = UNKNOWN_CODE
+        self.messages[code].extend(msg)
 
     def append_metrics(self, metrics):
         (performance_data, warning_message, critical_message) = metrics
@@ -87,6 +240,16 @@ class NagiosHelper:
         self.append_message(CRITICAL_CODE, critical_message)
 
 
+class CheckAbort(Exception):
+    """
+    Ends a check early, carries the NagiosHelper with its final status
+    """
+
+    def __init__(self, nagios):
+        super().__init__(nagios.getMessage())
+        self.nagios = nagios
+
+
 class JsonHelper:
     """
     Perform simple comparison operations against values in a given
@@ -97,54 +260,43 @@ class JsonHelper:
         self.data = json_data
         self.separator = separator
         self.value_separator = value_separator
-        self.arrayOpener = '('
-        self.arrayCloser = ')'
-
-    def getSubElement(self, key, data):
-        separatorIndex = key.find(self.separator)
-        partialKey = key[:separatorIndex]
-        remainingKey = key[separatorIndex + 1:]
-        if partialKey in data:
-            return self.get(remainingKey, data[partialKey])
-        return (None, 'not_found')
-
-    def getSubArrayElement(self, key, data):
-        subElemKey = key[:key.find(self.arrayOpener)]
-        index = int(key[key.find(self.arrayOpener) + 1:key.find(self.arrayCloser)])
-        remainingKey = key[key.find(self.arrayCloser + self.separator) + 2:]
-
-        if key.find(self.arrayCloser + self.separator) == -1:
-            remainingKey = key[key.find(self.arrayCloser) + 1:]
-        if subElemKey in data:
-            if index < len(data[subElemKey]):
-                return self.get(remainingKey, data[subElemKey][index])
-            else:
-                return (None, 'not_found')
-        if index >= len(data):
-            return (None, 'not_found')
-        else:
-            if not subElemKey:
-                return self.get(remainingKey, data[index])
-            else:
-                return (None, 'not_found')
+        self.namespaced = isinstance(json_data, NamespacedDocuments)
+        # Resolved values per key, the document is not modified during a run
+        self.values = {}
+        # Resolved values per compiled key path, see extract()
+        self.paths = {}
 
     def equals(self, key, value):
-        return self.exists(key) and str(self.get(key)) in value.split(self.value_separator)
+        value_found = self.get(key)
+        return value_found is not NOT_FOUND and str(value_found) in _allowedValues(value, self.value_separator)
 
     def lte(self, key, value):
-        return self.exists(key) and float(self.get(key)) <= float(value)
+        value_found = self.get(key)
+        return value_found is not NOT_FOUND and float(value_found) <= float(value)
 
     def lt(self, key, value):
-        return self.exists(key) and float(self.get(key)) < float(value)
+        value_found = self.get(key)
+        return value_found is not NOT_FOUND and float(value_found) < float(value)
 
     def gte(self, key, value):
-        return self.exists(key) and float(self.get(key)) >= float(value)
+        value_found = self.get(key)
+        return value_found is not NOT_FOUND and float(value_found) >= float(value)
 
     def gt(self, key, value):
-        return self.exists(key) and float(self.get(key)) > float(value)
+        value_found = self.get(key)
+        return value_found is not NOT_FOUND and float(value_found) > float(value)
 
     def exists(self, key):
-        return (self.get(key) != (None, 'not_found'))
+        return (self.get(key) is not NOT_FOUND)
+
+    def compileKey(self, key):
+        """
+        Turn a key string into an immutable tuple of path tokens
+        """
+        if self.namespaced:
+            namespace, _, key = key.partition(NAMESPACE_SEPARATOR)
+            return (namespace,) + _compileKey(key, self.separator)
+        return _compileKey(key, self.separator)
 
     def get(self, key, temp_data=''):
         """
@@ -152,76 +304,585 @@ class JsonHelper:
         (Element.Key.NestedKey). Returns (None, 'not_found') if not found
         """
         if temp_data != '':
-            data = temp_data
+            return self.resolve(self.compileKey(key), temp_data)
+
+        try:
+            return self.values[key]
+        except KeyError:
+            value = self.values[key] = self.lookup(self.compileKey(key))
+            return value
+
+    def lookup(self, path):
+        """
+        The value at a compiled key path, extracted or resolved once
+        """
+        try:
+            return self.paths[path]
+        except KeyError:
+            value = self.paths[path] = self.resolve(path, self.data)
+            return value
+
+    def extract(self, selection):
+        """
+        Resolve all key paths of a KeySelection in one walk of the document
+        """
+        selection.extract(self.data, self.paths)
+
+    @staticmethod
+    def resolve(path, data):
+        """
+        Walk the data along a compiled key path.
+        Returns (None, 'not_found') if not found
+        """
+        for token in path:
+            if token.__class__ is int:
+                if not isinstance(data, list) or token >= len(data):
+                    return NOT_FOUND
+            elif not isinstance(data, dict) or token not in data:
+                return NOT_FOUND
+            data = data[token]
+        return data
+
+    def expandKey(self, key):
+        """
+        Lazily expand the (*) wildcards of a key while walking the arrays.
+        Yields (value, key) pairs, with the wildcards of the key replaced
+        by the element indexes. Keys without wildcards yield one pair.
+        """
+        path = self.compileKey(key)
+        position = _wildcardPosition(path)
+        if position == -1:
+            yield self.get(key), key
+            return
+
+        parts = _WILDCARDS.split(key)
+        wildcards = _WILDCARDS.findall(key)
+        if len(wildcards) != sum(1 for token in path if _isWildcard(token)):
+            # Some (*) are part of a key name, keep the key as it is
+            parts = None
+        for value, indexes in self._walkWildcards(self.lookup(path[:position]), path, position, ()):
+            if parts is None:
+                yield value, key
+                continue
+            expanded = [parts[0]]
+            for position, part in enumerate(parts[1:]):
+                if position < len(indexes):
+                    expanded.append('(%d)' % indexes[position])
+                else:
+                    expanded.append(wildcards[position])
+                expanded.append(part)
+            yield value, ''.join(expanded)
+
+    def aggregate(self, function, key):
+        """
+        Compute count, min, max, sum, avg or the percentile pNN of the
+        values of a key with (*) wildcards, in one pass over the arrays and
+        without expanding the keys. Elements without the key are skipped,
+        returns (None, 'not_found') if no value was found except for count
+        and sum.
+        """
+        try:
+            return self.values[function, key]
+        except KeyError:
+            pass
+
+        path = self.compileKey(key)
+        position = _wildcardPosition(path)
+        values = (value for value in self._walkValues(self.lookup(path[:position]), path[position:])
+                  if value is not NOT_FOUND)
+        if function == 'count':
+            result = sum(1 for _ in values)
+        elif function == 'sum':
+            result = sum(map(_number, values))
+        elif function == 'min':
+            result = min(map(_number, values), default=NOT_FOUND)
+        elif function == 'max':
+            result = max(map(_number, values), default=NOT_FOUND)
+        elif function == 'avg':
+            count = total = 0
+            for number in map(_number, values):
+                count += 1
+                total += number
+            result = total / count if count else NOT_FOUND
+        else:
+            # Nearest rank percentile
+            numbers = sorted(map(_number, values))
+            rank = math.ceil(float(function[1:]) / 100 * len(numbers))
+            result = numbers[max(rank, 1) - 1] if numbers else NOT_FOUND
+        self.values[function, key] = result
+        return result
+
+    def _walkValues(self, data, path):
+        """
+        Yield the values matched by a compiled key path with wildcards,
+        (None, 'not_found') for the elements without the key
+        """
+        position = _wildcardPosition(path)
+        data = self.resolve(path[:position], data)
+        if not isinstance(data, list):
+            yield NOT_FOUND
+            return
+        token = path[position]
+        if token is not ARRAY_WILDCARD:
+            data = filter(token.matches, data)
+        path = path[position + 1:]
+        if _wildcardPosition(path) != -1:
+            for element in data:
+                yield from self._walkValues(element, path)
         else:
-            data = self.data
+            resolve = self.resolve
+            for element in data:
+                yield resolve(path, element)
+
+    def _walkWildcards(self, data, path, start, indexes):
+        for position in range(start, len(path)):
+            token = path[position]
+            if token is ARRAY_WILDCARD or token.__class__ is KeyPredicate:
+                if not isinstance(data, list):
+                    yield NOT_FOUND, indexes
+                    return
+                for index, element in enumerate(data):
+                    # Only the elements matching a predicate are walked
+                    if token is ARRAY_WILDCARD or token.matches(element):
+                        yield from self._walkWildcards(element, path, position + 1, indexes + (index,))
+                return
+            if token.__class__ is int:
+                found = isinstance(data, list) and token < len(data)
+            else:
+                found = isinstance(data, dict) and token in data
+            if not found:
+                yield NOT_FOUND, indexes
+                return
+            data = data[token]
+        yield data, indexes
+
+
+class NamespacedDocuments(dict):
+    """
+    The JSON documents of several paths by name, their keys are
+    prefixed with the document name (name:key)
+    """
 
-        if len(key) <= 0:
-            return data
 
-        if key.find(self.separator) != -1 and key.find(self.arrayOpener) != -1:
-            if key.find(self.separator) < key.find(self.arrayOpener):
-                return self.getSubElement(key, data)
+@functools.lru_cache(maxsize=4096)
+def _compileKey(key, separator):
+    """
+    Compile a key such as a.b(3).c into the tokens ('a', 'b', 3, 'c').
+    Array indexes become ints, (*) becomes ARRAY_WILDCARD and (?...)
+    a KeyPredicate, parentheses not holding an index, * or a predicate
+    are kept as part of the key name.
+    """
+    if not key:
+        return ()
+    segments = _splitKey(key, separator)
+    # A trailing separator selects the element itself
+    if len(segments) > 1 and segments[-1] == '':
+        segments.pop()
+    path = []
+    for segment in segments:
+        indexes = []
+        while segment.endswith(')'):
+            opener = segment.rfind('(')
+            inner = segment[opener + 1:-1]
+            if opener == -1 or not (inner == '*' or inner.isdecimal() or inner.startswith('?')):
+                break
+            if inner == '*':
+                indexes.append(ARRAY_WILDCARD)
+            elif inner.startswith('?'):
+                indexes.append(KeyPredicate(inner[1:], separator))
             else:
-                return self.getSubArrayElement(key, data)
-
-        if key.find(self.separator) != -1:
-            return self.getSubElement(key, data)
-
-        if key.find(self.arrayOpener) != -1:
-            # If we got an arrayOpener but it's not ([0-9*]) then it might just be a string
-            if key[key.find(self.arrayOpener)+1].isnumeric() or key[key.find(self.arrayOpener)+1] == "*":
-                return self.getSubArrayElement(key, data)
-            elif key in data:
-                return data[key]
-
-        if isinstance(data, dict) and key in data:
-            return data[key]
-
-        return (None, 'not_found')
-
-    def expandKey(self, key, keys):
-        if '(*)' not in key:
-            keys.append(key)
-            return keys
-        subElemKey = ''
-        if key.find('(*)') > 0:
-            subElemKey = key[:key.find('(*)')-1]
-        remainingKey = key[key.find('(*)')+3:]
-        elemData = self.get(subElemKey)
-        if elemData == (None, 'not_found'):
-            keys.append(key)
-            return keys
-        if subElemKey != '':
-            subElemKey = subElemKey + '.'
-        for i in range(len(elemData)):
-            newKey = subElemKey + '(' + str(i) + ')' + remainingKey
-            newKeys = self.expandKey(newKey, [])
-            for j in newKeys:
-                keys.append(j)
-
-        return keys
+                indexes.append(int(inner))
+            segment = segment[:opener]
+        if segment or not indexes:
+            path.append(segment)
+        path.extend(reversed(indexes))
+    return tuple(path)
+
+
+def _splitKey(key, separator):
+    """
+    Split a key at the separator, except inside (?...) predicates
+    """
+    if '(?' not in key:
+        return key.split(separator)
+    parts = []
+    start = position = 0
+    while True:
+        found = key.find(separator, position)
+        if found == -1:
+            break
+        predicate = key.find('(?', position, found)
+        if predicate != -1:
+            end = key.find(')', predicate)
+            if end > found:
+                position = end
+                continue
+        parts.append(key[start:found])
+        start = position = found + len(separator)
+    parts.append(key[start:])
+    return parts
+
+
+class KeyPredicate:
+    """
+    Key path token selecting the array elements matching a predicate:
+    (?key) if the element has the key, (?key==value), (?key!=value),
+    (?key<number) or (?key>number). Elements without the key never match.
+    """
+
+    __slots__ = ('text', 'path', 'operator', 'value')
+
+    def __init__(self, text, separator):
+        self.text = text
+        match = _PREDICATE.match(text)
+        key, self.operator, self.value = match.groups() if match else (text, None, None)
+        self.path = _compileKey(key, separator)
+        if not key or any(_isWildcard(token) for token in self.path):
+            raise ValueError("invalid predicate (?%s)" % text)
+        if self.operator in ('<', '>'):
+            try:
+                self.value = float(self.value)
+            except ValueError:
+                raise ValueError("invalid predicate (?%s)" % text) from None
+
+    def __eq__(self, other):
+        return other.__class__ is KeyPredicate and other.text == self.text and other.path == self.path
+
+    def __hash__(self):
+        return hash((self.text, self.path))
+
+    def __repr__(self):
+        return '(?%s)' % self.text
+
+    def matches(self, element):
+        value = JsonHelper.resolve(self.path, element)
+        if value is NOT_FOUND:
+            return False
+        if self.operator is None:
+            return True
+        if self.operator == '==':
+            return str(value) == self.value
+        if self.operator == '!=':
+            return str(value) != self.value
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return False
+        return number < self.value if self.operator == '<' else number > self.value
+
+
+def _isWildcard(token):
+    return token is ARRAY_WILDCARD or token.__class__ is KeyPredicate
+
+
+def _wildcardPosition(path):
+    """
+    The position of the first (*) or predicate in a compiled key path,
+    or -1 if it has none
+    """
+    for position, token in enumerate(path):
+        if token is ARRAY_WILDCARD or token.__class__ is KeyPredicate:
+            return position
+    return -1
+
+
+def _aggregateKey(key):
+    """
+    The (function, key) of an aggregate key such as max(nodes(*).latency),
+    or None for other keys
+    """
+    match = _AGGREGATE.match(key)
+    return match.groups() if match else None
+
+
+def _number(value):
+    """
+    A JSON value as number for the aggregate functions
+    """
+    if value.__class__ is int or value.__class__ is float:
+        return value
+    return float(value)
 
 
 def _getKeyAlias(original_key):
     key = original_key
     alias = original_key
     if '>' in original_key:
-        keys = original_key.split('>')
+        keys = _splitKey(original_key, '>')
         if len(keys) == 2:
             key, alias = keys
     return key, alias
 
 
+def compileRuleKey(original_key, compileKey):
+    """
+    Compile a rule key such as nodes(*).load>load into its key, alias,
+    aggregate function, the key path its values are resolved with and
+    whether the path has (*) wildcards or predicates
+    """
+    key, alias = _getKeyAlias(original_key)
+    aggregate = _aggregateKey(key)
+    path = compileKey(key if aggregate is None else aggregate[1])
+    return key, alias, aggregate, path, _wildcardPosition(path) != -1
+
+
+def rule_paths(rule_sets):
+    """
+    The compiled key paths all rules of the rule sets refer to
+    """
+    paths = set()
+    for rules in rule_sets:
+        separator = rules.separator or '.'
+        keys = []
+        for name in ('key_list', 'key_list_critical'):
+            keys.extend(getattr(rules, name, None) or [])
+        for name in ('key_threshold_warning', 'key_threshold_critical',
+                     'key_value_list', 'key_value_list_critical', 'key_value_list_unknown',
+                     'key_value_list_not', 'key_value_list_not_critical',
+                     'key_time_list', 'key_time_list_critical', 'metric_list'):
+            keys.extend(rule.split(',')[0] for rule in getattr(rules, name, None) or [])
+        for key in keys:
+            key = _getKeyAlias(key)[0]
+            aggregate = _aggregateKey(key)
+            if aggregate is not None:
+                key = aggregate[1]
+            paths.add(_compileKey(key, separator))
+    return paths
+
+
+# A range is parsed once and only asked to check values
+class NagiosRange: # pylint: disable=too-few-public-methods
+    """
+    A compiled Nagios range such as 10, 10:, ~:10, 10:20 or @10:20
+    """
+
+    __slots__ = ('invert', 'start', 'end', 'low', 'high')
+
+    def __init__(self, text):
+        self.invert = text.startswith('@')
+        if self.invert:
+            text = text[1:]
+        self.start = 0
+        self.end = 'infinity'
+        vals = text.split(':')
+        if len(vals) == 1:
+            self.end = vals[0]
+        elif len(vals) == 2:
+            self.start = vals[0]
+            if vals[1] != '':
+                self.end = vals[1]
+        else:
+            raise ValueError("invalid range %s" % text)
+        try:
+            self.low = None if self.start == '~' else float(self.start)
+            self.high = float(self.end)
+        except ValueError:
+            raise ValueError("invalid range %s" % text) from None
+
+    def check(self, value, alias):
+        """
+        The reason the value is outside the range, or '' if it is not
+        """
+        if value is NOT_FOUND:
+            return ''
+        number = float(value)
+        if self.low is None:
+            if self.invert and number <= self.high:
+                return "Value (%s) for key %s was less than or equal to %s." % (value, alias, self.end)
+            if not self.invert and number > self.high:
+                return "Value (%s) for key %s was greater than %s." % (value, alias, self.end)
+        elif self.end == 'infinity':
+            if self.invert and number >= self.low:
+                return "Value (%s) for key %s was greater than or equal to %s." % (value, alias, self.start)
+            if not self.invert and number < self.low:
+                return "Value (%s) for key %s was less than %s." % (value, alias, self.start)
+        elif self.invert:
+            if self.low <= number <= self.high:
+                return "Value (%s) for key %s was inside the range %s:%s." % (value, alias, self.start, self.end)
+        elif number < self.low or number > self.high:
+            return "Value (%s) for key %s was outside the range %s:%s." % (value, alias, self.start, self.end)
+        return ''
+
+
+@functools.lru_cache(maxsize=1024)
+def parseRange(text):
+    return NagiosRange(text)
+
+
+# A duration is parsed once and only asked to check ages
+class TimeDuration: # pylint: disable=too-few-public-methods
+    """
+    A compiled duration of a timestamp rule such as 30m, -2h or @1d
+    """
+
+    __slots__ = ('invert', 'negative', 'duration', 'unit', 'seconds')
+
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+    def __init__(self, text):
+        self.invert = text.startswith('@')
+        r = text[1:] if self.invert else text
+        self.negative = r.startswith('-')
+        if self.negative:
+            r = r[1:]
+        self.unit = r[-1:]
+        if self.unit not in self.units or not r[:-1].isdecimal():
+            raise ValueError("invalid duration %s" % text)
+        self.duration = int(r[:-1])
+        self.seconds = self.duration * self.units[self.unit]
+
+    def check(self, age, value, alias):
+        """
+        The reason a timestamp of the age in seconds fails the duration,
+        or '' if it does not
+        """
+        if not self.negative:
+            if age > self.seconds and not self.invert:
+                return "Value (%s) for key %s is older than now-%s%s." % (value, alias, self.duration, self.unit)
+            if not age > self.seconds and self.invert:
+                return "Value (%s) for key %s is newer than now-%s%s." % (value, alias, self.duration, self.unit)
+        else:
+            if age < -self.seconds and not self.invert:
+                return "Value (%s) for key %s is newer than now+%s%s." % (value, alias, self.duration, self.unit)
+            if not age < -self.seconds and self.invert:
+                return "Value (%s) for key %s is older than now+%s%s.." % (value, alias, self.duration, self.unit)
+        return ''
+
+
+@functools.lru_cache(maxsize=1024)
+def parseDuration(text):
+    return TimeDuration(text)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parseTimestamp(value):
+    """
+    The epoch seconds of an ISO 8601 timestamp, naive timestamps are UTC.
+    Arrays of records often repeat the same timestamps.
+    """
+    from datetime import datetime, timezone # pylint: disable=import-outside-toplevel
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+@functools.lru_cache(maxsize=1024)
+def _allowedValues(values, value_separator):
+    """
+    The set of values of an equality rule such as ok:up
+    """
+    return frozenset(values.split(value_separator))
+
+
+MetricSpec = collections.namedtuple('MetricSpec', ('key', 'ranges', 'suffix'))
+
+
+def parseMetric(metric):
+    """
+    Compile a metric key[,UnitOfMeasure[,WarnRange,CriticalRange[,Min,Max]]]
+    into a MetricSpec
+    """
+    key = metric
+    uom = ''
+    limits = ()
+    if ',' in metric:
+        vals = metric.split(',')
+        if len(vals) not in (2, 4, 6):
+            raise ValueError("expected key[,UnitOfMeasure[,WarnRange,CriticalRange[,Min,Max]]]")
+        key, uom = vals[:2]
+        limits = vals[2:]
+    # The unit and ranges are the same for every value of the key, an
+    # empty range is only passed on to the performance data
+    return MetricSpec(key, [(state, parseRange(r % data)) for (state, r), data in zip((
+        (WARNING_CODE, '%s'),
+        (CRITICAL_CODE, '%s'),
+        (CRITICAL_CODE, '%s:'),
+        (CRITICAL_CODE, '~:%s')), limits) if data != ''], uom + ''.join(';%s' % data for data in limits))
+
+
+class RulePlan:
+    """
+    The rules of a check compiled once before any document is evaluated.
+    Every option holds (rule, key, spec) tuples, or None if not given.
+    Raises a ValueError naming the first invalid rule.
+    """
+
+    # Rule options with their flag and the kind of spec after the key
+    options = (
+        ('key_threshold_warning', '-w', 'range'),
+        ('key_threshold_critical', '-c', 'range'),
+        ('key_value_list', '-q', 'values'),
+        ('key_value_list_critical', '-Q', 'values'),
+        ('key_value_list_unknown', '-u', 'values'),
+        ('key_value_list_not', '-y', 'values'),
+        ('key_value_list_not_critical', '-Y', 'values'),
+        ('key_time_list', '--key_time', 'time'),
+        ('key_time_list_critical', '--key_time_critical', 'time'),
+        ('key_list', '-e', 'key'),
+        ('key_list_critical', '-E', 'key'),
+        ('metric_list', '-m', 'metric'),
+    )
+
+    def __init__(self, rules):
+        value_separator = getattr(rules, 'value_separator', None) or ':'
+        separator = getattr(rules, 'separator', None) or '.'
+        for name, option, kind in self.options:
+            compiled = None
+            if getattr(rules, name, None) is not None:
+                compiled = []
+                for rule in getattr(rules, name):
+                    try:
+                        compiled.append(self.compileRule(kind, rule, value_separator))
+                        # Invalid predicates of the key are reported with the rule
+                        compileRuleKey(compiled[-1][1], lambda key: _compileKey(key, separator))
+                    except ValueError as e:
+                        raise ValueError("%s %s: %s" % (option, rule, e)) from None
+            setattr(self, name, compiled)
+        self.value_mapping = dict(getattr(rules, 'metric_value_mapping', None) or {})
+        # The keys of all rules, their values are extracted in one walk of the document
+        self.keys = {key for name, _, _ in self.options for _, key, _ in getattr(self, name) or ()}
+        self.compiled = {}
+
+    def compileKeys(self, helper):
+        """
+        The keys of all rules compiled like the helper compiles keys, by
+        rule key, and the KeySelection of their key paths
+        """
+        kind = (helper.separator, helper.namespaced)
+        if kind not in self.compiled:
+            keys = {key: compileRuleKey(key, helper.compileKey) for key in self.keys}
+            self.compiled[kind] = (keys, KeySelection({path for _, _, _, path, _ in keys.values()}))
+        return self.compiled[kind]
+
+    @staticmethod
+    def compileRule(kind, rule, value_separator):
+        if kind == 'key':
+            return (rule, rule, None)
+        if kind == 'metric':
+            spec = parseMetric(rule)
+            return (rule, spec.key, spec)
+        vals = rule.split(',')
+        if len(vals) != 2:
+            raise ValueError("expected key,%s" % ('value' if kind == 'values' else kind))
+        key, spec = vals
+        if kind == 'range':
+            return (rule, key, parseRange(spec))
+        if kind == 'values':
+            return (rule, key, (spec, _allowedValues(spec, value_separator)))
+        return (rule, key, parseDuration(spec))
+
+
 class JsonRuleProcessor:
     """
     Perform checks and gather values from a JSON dict given rules
     and metrics definitions
     """
 
-    def __init__(self, json_data, rules_args):
+    def __init__(self, json_data, rules_args, metric_prefix=''):
         self.data = json_data
         self.rules = rules_args
+        self.metric_prefix = metric_prefix
         separator = '.'
         value_separator = ':'
         if self.rules.separator:
@@ -229,241 +890,244 @@ class JsonRuleProcessor:
         if self.rules.value_separator:
             value_separator = self.rules.value_separator
         self.helper = JsonHelper(self.data, separator, value_separator)
+        self.profiler = getattr(rules_args, 'profiler', None)
+        # The plan compiled before fetching, or the rules compiled now
+        self.plan = getattr(rules_args, 'plan', None) or RulePlan(rules_args)
+        # The timestamp rules of a run compare against the same time
+        self.now = time.time()
+        # The values of all rule keys are resolved in one walk of the document
+        self.keys, selection = self.plan.compileKeys(self.helper)
+        self.helper.extract(selection)
         debugPrint(rules_args.debug, "rules: %s" % rules_args)
         debugPrint(rules_args.debug, "separator: %s" % separator)
         debugPrint(rules_args.debug, "value_separator: %s" % value_separator)
-        self.metric_list = self.expandKeys(self.rules.metric_list)
-        self.key_threshold_warning = self.expandKeys(self.rules.key_threshold_warning)
-        self.key_threshold_critical = self.expandKeys(self.rules.key_threshold_critical)
-        self.key_value_list = self.expandKeys(self.rules.key_value_list)
-        self.key_value_list_not = self.expandKeys(self.rules.key_value_list_not)
-        self.key_time_list = self.expandKeys(self.rules.key_time_list)
-        self.key_list = self.expandKeys(self.rules.key_list)
-        self.key_value_list_critical = self.expandKeys(self.rules.key_value_list_critical)
-        self.key_value_list_not_critical = self.expandKeys(self.rules.key_value_list_not_critical)
-        self.key_time_list_critical = self.expandKeys(self.rules.key_time_list_critical)
-        self.key_list_critical = self.expandKeys(self.rules.key_list_critical)
-        self.key_value_list_unknown = self.expandKeys(self.rules.key_value_list_unknown)
-
-    def expandKeys(self, src):
-        if src is None:
-            return []
-        dest = []
-        for key in src:
-            newKeys = self.helper.expandKey(key, [])
-            for k in newKeys:
-                dest.append(k)
-        return dest
-
-    def checkExists(self, exists_list):
-        failure = ''
-        for k in exists_list:
-            key, alias = _getKeyAlias(k)
-            if (self.helper.exists(key) is False):
-                failure += " Key %s did not exist." % alias
-        return failure
-
-    def checkEquality(self, equality_list):
-        failure = ''
-        for kv in equality_list:
-            k, v = kv.split(',')
-            key, alias = _getKeyAlias(k)
-            if not self.helper.equals(key, v):
-                failure += " Key %s mismatch. %s != %s" % (alias, v, self.helper.get(key))
-        return failure
-
-    def checkNonEquality(self, equality_list):
-        failure = ''
-        for kv in equality_list:
-            k, v = kv.split(',')
-            key, alias = _getKeyAlias(k)
-            if self.helper.equals(key, v):
-                failure += " Key %s match found. %s == %s" % (alias, v, self.helper.get(key))
-        return failure
-
-    def checkThreshold(self, key, alias, r):
-        failure = ''
-        invert = False
-        start = 0
-        end = 'infinity'
-        if r.startswith('@'):
-            invert = True
-            r = r[1:]
-        vals = r.split(':')
-        if len(vals) == 1:
-            end = vals[0]
-        if len(vals) == 2:
-            start = vals[0]
-            if vals[1] != '':
-                end = vals[1]
-        if(start == '~'):
-            if (invert and self.helper.lte(key, end)):
-                failure += " Value (%s) for key %s was less than or equal to %s." % (self.helper.get(key), alias, end)
-            elif (not invert and self.helper.gt(key, end)):
-                failure += " Value (%s) for key %s was greater than %s." % (self.helper.get(key), alias, end)
-        elif(end == 'infinity'):
-            if (invert and self.helper.gte(key, start)):
-                failure += " Value (%s) for key %s was greater than or equal to %s." % (self.helper.get(key), alias, start)
-            elif (not invert and self.helper.lt(key, start)):
-                failure += " Value (%s) for key %s was less than %s." % (self.helper.get(key), alias, start)
-        else:
-            if (invert and self.helper.gte(key, start) and self.helper.lte(key, end)):
-                failure += " Value (%s) for key %s was inside the range %s:%s." % (self.helper.get(key), alias, start, end)
-            elif (not invert and (self.helper.lt(key, start) or self.helper.gt(key, end))):
-                failure += " Value (%s) for key %s was outside the range %s:%s." % (self.helper.get(key), alias, start, end)
-
-        return failure
-
-    def checkThresholds(self, threshold_list):
-        failure = ''
-        for threshold in threshold_list:
-            k, r = threshold.split(',')
-            key, alias = _getKeyAlias(k)
-            failure += self.checkThreshold(key, alias, r)
-        return failure
-
-    def checkTimestamp(self, key, alias, r):
-        failure = ''
-        invert = False
-        negative = False
-        if r.startswith('@'):
-            invert = True
-            r = r[1:]
-        if r.startswith('-'):
-            negative = True
-            r = r[1:]
-        duration = int(r[:-1])
-        unit = r[-1]
-
-        if unit == 's':
-            tiemduration = timedelta(seconds=duration)
-        elif unit == 'm':
-            tiemduration = timedelta(minutes=duration)
-        elif unit == 'h':
-            tiemduration = timedelta(hours=duration)
-        elif unit == 'd':
-            tiemduration = timedelta(days=duration)
-        else:
-            return " Value (%s) is not a vaild timeduration." % (r)
-
-        if not self.helper.exists(key):
-            return " Key (%s) for key %s not Exists." % (key, alias)
 
+    def expandKeys(self, original_key):
+        """
+        Yield (value, key, alias) for every element matched by a key,
+        expanding (*) wildcards and predicates on the fly. Aggregate keys
+        yield their result.
+        """
         try:
-            timestamp = datetime.fromisoformat(self.helper.get(key))
-        except ValueError as ve:
-            return " Value (%s) for key %s is not a Date in ISO format. %s" % (self.helper.get(key), alias, ve)
+            key, alias, aggregate, path, wildcard = self.keys[original_key]
+        except KeyError:
+            key, alias, aggregate, path, wildcard = compileRuleKey(original_key, self.helper.compileKey)
+        if aggregate is not None:
+            yield self.helper.aggregate(*aggregate), key, alias
+            return
+        if not wildcard:
+            yield self.helper.lookup(path), key, alias
+            return
+        for value, expanded_key in self.helper.expandKey(key):
+            yield value, expanded_key, alias if alias != key else expanded_key
+
+    def checkExists(self, exists_list, state):
+        failures = []
+        for _, k, _ in exists_list:
+            for value, key, alias in self.expandKeys(k):
+                if value is NOT_FOUND:
+                    failures.append(RuleFailure(state, key, alias, None, "Key %s did not exist." % alias))
+        return failures
+
+    def checkEquality(self, equality_list, state):
+        failures = []
+        for _, k, (v, allowed) in equality_list:
+            for value, key, alias in self.expandKeys(k):
+                if value is NOT_FOUND or str(value) not in allowed:
+                    failures.append(RuleFailure(state, key, alias, value, "Key %s mismatch. %s != %s" % (alias, v, value)))
+        return failures
+
+    def checkNonEquality(self, equality_list, state):
+        failures = []
+        for _, k, (v, allowed) in equality_list:
+            for value, key, alias in self.expandKeys(k):
+                if value is not NOT_FOUND and str(value) in allowed:
+                    failures.append(RuleFailure(state, key, alias, value, "Key %s match found. %s == %s" % (alias, v, value)))
+        return failures
+
+    @staticmethod
+    def checkThreshold(value, alias, r):
+        """
+        The reason the value is outside the range r, or '' if it is not
+        """
+        return parseRange(r).check(value, alias)
+
+    def checkThresholds(self, threshold_list, state):
+        failures = []
+        for _, k, limits in threshold_list:
+            for value, key, alias in self.expandKeys(k):
+                reason = limits.check(value, alias)
+                if reason:
+                    failures.append(RuleFailure(state, key, alias, value, reason))
+        return failures
+
+    def checkTimestamp(self, value, key, alias, duration):
+        """
+        The reason the timestamp value fails the TimeDuration, or '' if
+        it does not. Numbers are epoch seconds or milliseconds.
+        """
+        if value is NOT_FOUND:
+            return "Key (%s) for key %s not Exists." % (key, alias)
 
-        now = datetime.now(timezone.utc)
+        cls = value.__class__
+        if cls is int or cls is float:
+            timestamp = value / 1000 if abs(value) >= EPOCH_MILLISECONDS else value
+        elif cls is str:
+            try:
+                timestamp = _parseTimestamp(value)
+            except ValueError as ve:
+                return "Value (%s) for key %s is not a Date in ISO format. %s" % (value, alias, ve)
+        else:
+            return "Value (%s) for key %s is not a Date in ISO format or epoch." % (value, alias)
 
-        if timestamp.tzinfo is None:
-            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return duration.check(self.now - timestamp, value, alias)
 
-        age = now - timestamp
+    def checkTimestamps(self, threshold_list, state):
+        failures = []
+        for _, k, duration in threshold_list:
+            for value, key, alias in self.expandKeys(k):
+                reason = self.checkTimestamp(value, key, alias, duration)
+                if reason:
+                    failures.append(RuleFailure(state, key, alias, value, reason))
+        return failures
 
-        if not negative:
-            if age > tiemduration and not invert:
-                failure += " Value (%s) for key %s is older than now-%s%s." % (self.helper.get(key), alias, duration, unit)
-            if not age > tiemduration and invert:
-                failure += " Value (%s) for key %s is newer than now-%s%s." % (self.helper.get(key), alias, duration, unit)
-        else:
-            if age < -tiemduration and not invert:
-                failure += " Value (%s) for key %s is newer than now+%s%s." % (self.helper.get(key), alias, duration, unit)
-            if not age < -tiemduration and invert:
-                failure += " Value (%s) for key %s is older than now+%s%s.." % (self.helper.get(key), alias, duration, unit)
+    def checkRules(self, check, rule_list, option, state):
+        """
+        Apply the rules of one option, with --profile every rule is timed
+        """
+        if self.profiler is None:
+            return check(rule_list, state)
+        failures = []
+        for rule in rule_list:
+            start = Profile.now()
+            failures.extend(check([rule], state))
+            self.profiler.rule('%s%s %s' % (self.metric_prefix, option, rule[0]), start)
+        return failures
+
+    def warningFailures(self):
+        """
+        The RuleFailures of the warning rules
+        """
+        failures = []
+        if self.plan.key_threshold_warning is not None:
+            failures += self.checkRules(self.checkThresholds, self.plan.key_threshold_warning, '-w', WARNING_CODE)
+        if self.plan.key_value_list is not None:
+            failures += self.checkRules(self.checkEquality, self.plan.key_value_list, '-q', WARNING_CODE)
+        if self.plan.key_value_list_not is not None:
+            failures += self.checkRules(self.checkNonEquality, self.plan.key_value_list_not, '-y', WARNING_CODE)
+        if self.plan.key_time_list is not None:
+            failures += self.checkRules(self.checkTimestamps, self.plan.key_time_list, '--key_time', WARNING_CODE)
+        if self.plan.key_list is not None:
+            failures += self.checkRules(self.checkExists, self.plan.key_list, '-e', WARNING_CODE)
+        return failures
+
+    def criticalFailures(self):
+        """
+        The RuleFailures of the critical rules
+        """
+        failures = []
+        if not self.data:
+            failures.append(RuleFailure(CRITICAL_CODE, None, None, self.data, "Empty JSON data."))
+        if self.plan.key_threshold_critical is not None:
+            failures += self.checkRules(self.checkThresholds, self.plan.key_threshold_critical, '-c', CRITICAL_CODE)
+        if self.plan.key_value_list_critical is not None:
+            failures += self.checkRules(self.checkEquality, self.plan.key_value_list_critical, '-Q', CRITICAL_CODE)
+        if self.plan.key_value_list_not_critical is not None:
+            failures += self.checkRules(self.checkNonEquality, self.plan.key_value_list_not_critical, '-Y', CRITICAL_CODE)
+        if self.plan.key_time_list_critical is not None:
+            failures += self.checkRules(self.checkTimestamps, self.plan.key_time_list_critical, '--key_time_critical', CRITICAL_CODE)
+        if self.plan.key_list_critical is not None:
+            failures += self.checkRules(self.checkExists, self.plan.key_list_critical, '-E', CRITICAL_CODE)
+        return failures
+
+    def unknownFailures(self):
+        """
+        The RuleFailures of the unknown rules
+        """
+        failures = []
+        if self.plan.key_value_list_unknown is not None:
+            failures += self.checkRules(self.checkEquality, self.plan.key_value_list_unknown, '-u', UNKNOWN_CODE)
+        return failures
+
+    def metricFailures(self):
+        """
+        Return a Nagios specific performance metrics string given keys
+        and parameter definitions, and the warning and critical
+        RuleFailures of their ranges
+        """
+        metrics = []
+        warning = []
+        critical = []
 
-        return failure
+        kv = self.plan.value_mapping
 
-    def checkTimestamps(self, threshold_list):
-        failure = ''
-        for threshold in threshold_list:
-            k, r = threshold.split(',')
-            key, alias = _getKeyAlias(k)
-            failure += self.checkTimestamp(key, alias, r)
-        return failure
+        if self.plan.metric_list is not None:
+            for metric, _, spec in self.plan.metric_list:
+                start = Profile.now()
+                self.checkMetric(spec, kv, metrics, warning, critical)
+                if self.profiler is not None:
+                    self.profiler.rule('%s-m %s' % (self.metric_prefix, metric), start)
+        return (''.join(metrics), warning, critical)
 
     def checkWarning(self):
-        failure = ''
-        if self.key_threshold_warning is not None:
-            failure += self.checkThresholds(self.key_threshold_warning)
-        if self.key_value_list is not None:
-            failure += self.checkEquality(self.key_value_list)
-        if self.key_value_list_not is not None:
-            failure += self.checkNonEquality(self.key_value_list_not)
-        if self.key_time_list is not None:
-            failure += self.checkTimestamps(self.key_time_list)
-        if self.key_list is not None:
-            failure += self.checkExists(self.key_list)
-        return failure
+        """
+        The warning messages as a string, see warningFailures
+        """
+        return ''.join(map(str, self.warningFailures()))
 
     def checkCritical(self):
-        failure = ''
-        if not self.data:
-            failure = " Empty JSON data."
-        if self.key_threshold_critical is not None:
-            failure += self.checkThresholds(self.key_threshold_critical)
-        if self.key_value_list_critical is not None:
-            failure += self.checkEquality(self.key_value_list_critical)
-        if self.key_value_list_not_critical is not None:
-            failure += self.checkNonEquality(self.key_value_list_not_critical)
-        if self.key_time_list_critical is not None:
-            failure += self.checkTimestamps(self.key_time_list_critical)
-        if self.key_list_critical is not None:
-            failure += self.checkExists(self.key_list_critical)
-        return failure
+        """
+        The critical messages as a string, see criticalFailures
+        """
+        return ''.join(map(str, self.criticalFailures()))
 
     def checkUnknown(self):
-        unknown = ''
-        if self.key_value_list_unknown is not None:
-            unknown += self.checkEquality(self.key_value_list_unknown)
-        return unknown
+        """
+        The unknown messages as a string, see unknownFailures
+        """
+        return ''.join(map(str, self.unknownFailures()))
 
     def checkMetrics(self):
         """
         Return a Nagios specific performance metrics string given keys
-        and parameter definitions
-        """
-        metrics = ''
-        warning = ''
-        critical = ''
-
-        kv = dict(self.rules.metric_value_mapping) if hasattr(self.rules, 'metric_value_mapping') else {}
-
-        if self.metric_list is not None:
-            for metric in self.metric_list:
-                key = metric
-                minimum = maximum = warn_range = crit_range = None
-                uom = ''
-                if ',' in metric:
-                    vals = metric.split(',')
-                    if len(vals) == 2:
-                        key, uom = vals
-                    if len(vals) == 4:
-                        key, uom, warn_range, crit_range = vals
-                    if len(vals) == 6:
-                        key, uom, warn_range, crit_range, minimum, maximum = vals
-                key, alias = _getKeyAlias(key)
-                if self.helper.exists(key):
-                    value = self.helper.get(key)
-                    # Apply the value mapping if it exists
-                    v = kv.get(str(value), value)
-                    metrics += "'%s'=%s" % (alias, v)
-                    if uom:
-                        metrics += uom
-                    if warn_range is not None:
-                        warning += self.checkThreshold(key, alias, warn_range)
-                        metrics += ";%s" % warn_range
-                    if crit_range is not None:
-                        critical += self.checkThreshold(key, alias, crit_range)
-                        metrics += ";%s" % crit_range
-                    if minimum is not None:
-                        critical += self.checkThreshold(key, alias, minimum + ':')
-                        metrics += ";%s" % minimum
-                    if maximum is not None:
-                        critical += self.checkThreshold(key, alias, '~:' + maximum)
-                        metrics += ";%s" % maximum
-                metrics += ' '
-        return ("%s" % metrics, warning, critical)
+        and parameter definitions, and the warning and critical messages
+        of their ranges
+        """
+        (metrics, warning, critical) = self.metricFailures()
+        return (metrics, ''.join(map(str, warning)), ''.join(map(str, critical)))
+
+    def checkMetric(self, spec, kv, metrics, warning, critical):
+        """
+        Add the performance data of one MetricSpec to metrics and the
+        RuleFailures of its ranges to warning and critical
+        """
+        for value, expanded_key, alias in self.expandKeys(spec.key):
+            if value is not NOT_FOUND:
+                # Apply the value mapping if it exists
+                v = kv.get(str(value), value)
+                metrics.append("%s=%s%s" % (perfLabel(self.metric_prefix + alias), v, spec.suffix))
+                for state, limits in spec.ranges:
+                    reason = limits.check(value, alias)
+                    if reason:
+                        (warning if state == WARNING_CODE else critical).append(
+                            RuleFailure(state, expanded_key, alias, value, reason))
+            metrics.append(' ')
+
+class ArgumentError(ValueError):
+    """
+    Invalid arguments found by a RuleArgumentParser
+    """
+
+
+class RuleArgumentParser(argparse.ArgumentParser):
+    """
+    Parser of the arguments of a rule set in a batch file, raises an
+    ArgumentError instead of printing the usage and exiting
+    """
+
+    def error(self, message):
+        raise ArgumentError(message)
+
 
 def parseArgs(args):
     """
@@ -479,24 +1143,134 @@ def parseArgs(args):
     parser.add_argument('-d', '--debug', action='store_true', help='Debug mode')
     parser.add_argument('-v', '--verbose', action='count', default=0, help='Verbose mode. Multiple -v options increase the verbosity')
     parser.add_argument('-s', '--ssl', action='store_true', help='Use TLS to connect to remote host')
-    parser.add_argument('-H', '--host', dest='host', required=not ('-V' in args or '--version' in args), help='Remote host to query')
+    parser.add_argument('-H', '--host', dest='host', required=not any(arg in args for arg in ('-V', '--version', '--daemon', '--hosts-file')),
+                        help='Remote host to query. Multiple hosts can be delimited with comma (host1,host2:port)')
+    parser.add_argument('--hosts-file', dest='hosts_file',
+                        help='File with the remote hosts to query, one per line')
+    parser.add_argument('--max-concurrency', dest='max_concurrency', type=positive_int, default=10,
+                        help='Maximum number of hosts queried at the same time (default: 10)')
+    parser.add_argument('--quorum-warning', dest='quorum_warning', type=int, default=0,
+                        help='With multiple hosts, return warning if more than this many hosts are not OK (default: 0)')
+    parser.add_argument('--quorum-critical', dest='quorum_critical', type=int, default=0,
+                        help='With multiple hosts, return critical if more than this many hosts are critical or unknown (default: 0)')
     parser.add_argument('-k', '--insecure', action='store_true', help='Do not check server SSL certificate')
     parser.add_argument('-X', '--request', dest='method', default='GET', choices=['GET', 'POST'],
                         help='Specifies a custom request method to use when communicating  with  the HTTP server')
     parser.add_argument('-V', '--version', action='store_true', help='Print version of this plugin')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Run as a daemon executing the checks sent by check_http_json_client.py on the --socket')
+    parser.add_argument('--socket', dest='socket', default=default_socket(),
+                        help='''Unix socket the daemon listens on (default: %s in $XDG_RUNTIME_DIR,
+                        or in a check_http_json-<uid> directory in the temporary directory)''' % SOCKET_NAME)
+    parser.add_argument('--batch', dest='batch',
+                        help='''File with named rule sets, one per line as
+                        "name rule arguments" (ex.: health -q status,ok).
+                        Every rule set is evaluated against the same response
+                        and one result per rule set is printed.''')
+    parser.add_argument('--stream', action='store_true',
+                        help='''Parse the response while it is received and only keep
+                        the values the rules refer to. The connection is closed
+                        as soon as all of them were seen, the rest of the
+                        document is not read nor validated.''')
     parser.add_argument('--cacert', dest='cacert', help='SSL CA certificate')
     parser.add_argument('--cert', dest='cert', help='SSL client certificate')
     parser.add_argument('--key', dest='key', help='SSL client key ( if not bundled into the cert )')
     parser.add_argument('-P', '--port', dest='port', help='TCP port')
-    parser.add_argument('-p', '--path', dest='path', help='Path')
+    parser.add_argument('-p', '--path', dest='path', action='append',
+                        help='''Path. Can be given multiple times as [name:]path
+                        to check several paths over one connection, keys are then
+                        prefixed with the name of their document (name:key).
+                        The name defaults to the last element of the path.''')
     parser.add_argument('-t', '--timeout', type=int, help='Connection timeout (seconds)', default=10)
+    parser.add_argument('--retries', type=int, default=0,
+                        help='''Retry a request that failed to connect up to this many times,
+                        after a random backoff of up to 0.1 seconds doubling with every
+                        retry, as long as the --timeout is not exceeded (default: 0)''')
+    parser.add_argument('--hedge-after', dest='hedge_after', type=int, default=0,
+                        help='''Send a GET request a second time in parallel if its response
+                        headers did not arrive after this many milliseconds, the
+                        first response is used and the other one closed
+                        (default: 0, no second request)''')
     parser.add_argument('--unreachable-state', type=int, default=3,
                         help='Exit with specified code when the URL is unreachable. Examples: 1 for Warning, 2 for Critical, 3 for Unknown (default: 3)')
     parser.add_argument('--invalid-json-state', type=int, default=3,
                         help='Exit with specified code when no valid JSON is returned. Examples: 1 for Warning, 2 for Critical, 3 for Unknown (default: 3)')
+    parser.add_argument('--timing', action='store_true',
+                        help='''Add the total time of the check, the time to connect, for the TLS
+                        handshake, until the first byte of the response, to download,
+                        parse and evaluate it (seconds) and the size of the response
+                        body to the performance data''')
+    parser.add_argument('--timing-warning', dest='timing_warning',
+                        help='Warning threshold of the total time with --timing (seconds, WarnRange format)')
+    parser.add_argument('--timing-critical', dest='timing_critical',
+                        help='Critical threshold of the total time with --timing (seconds, CriticalRange format)')
+    parser.add_argument('--profile', action='store_true',
+                        help='''Print the wall and CPU time of the phases of the check and
+                        of its slowest rules to stderr''')
+    parser.add_argument('--profile-top', dest='profile_top', type=int, default=10,
+                        help='Number of the slowest rules printed by --profile (default: 10)')
+    parser.add_argument('--profile-file', dest='profile_file',
+                        help='Write cProfile statistics of the check to this file, to be read with pstats')
+    parser.add_argument('--max-output-length', dest='max_output_length', type=int, default=0,
+                        help='''Maximum length of the output in characters, longer outputs
+                        summarize the failed keys and drop performance data values from
+                        the end (default: 0, no limit; Nagios keeps 8192)''')
+    parser.add_argument('--max-body-size', dest='max_body_size', type=int, default=0,
+                        help='''Maximum size of the response body in bytes, larger bodies
+                        exit with --invalid-json-state (default: 0, no limit)''')
+    parser.add_argument('--max-decompressed-size', dest='max_decompressed_size', type=int, default=MAX_DECOMPRESSED_SIZE,
+                        help='''Maximum size of a gzip or deflate compressed response body
+                        once decompressed in bytes, larger bodies exit with
+                        --invalid-json-state (default: %d, 0 for no limit)''' % MAX_DECOMPRESSED_SIZE)
+    parser.add_argument('--checkresults-dir', dest='checkresults_dir',
+                        help='''Also submit the results as passive check results, written
+                        into this checkresults spool directory of Nagios or Icinga
+                        (check_result_path). With --batch one result per rule set
+                        is submitted, with multiple hosts one result per host.''')
+    parser.add_argument('--command-file', dest='command_file',
+                        help='''Also submit the results as passive check results, written
+                        as PROCESS_SERVICE_CHECK_RESULT commands to this external
+                        command file of Nagios or Icinga''')
+    parser.add_argument('--passive-service', dest='passive_service',
+                        help='Service description of the passive results, the rule set names with --batch')
+    parser.add_argument('--passive-host', dest='passive_host',
+                        help='Host name of the passive results (default: the queried host without its port)')
+    parser.add_argument('--state-file', dest='state_file',
+                        help='''File keeping the ETag/Last-Modified of the last response and
+                        its result between runs of this check. The next request is
+                        conditional and if the response was not modified its result
+                        is reused, only --key_time rules are applied again.''')
+    parser.add_argument('--cache-ttl', dest='cache_ttl', type=int, default=0,
+                        help='''Reuse a response of the same request made by another
+                        check within this many seconds (default: 0, no caching).
+                        Concurrent checks of the same request wait for the one
+                        performing it instead of sending their own.''')
+    parser.add_argument('--cache-dir', dest='cache_dir',
+                        help='Directory of the response cache, only used if no other user can access it (default: %s-<uid> in the temporary directory)' % CACHE_DIR_NAME)
+    parser.add_argument('--cache-max-size', dest='cache_max_size', type=int, default=64,
+                        help='Maximum size of the response cache in MB, oldest responses are evicted first (default: 64)')
     parser.add_argument('-B', '--basic-auth', dest='auth', help='Basic auth string "username:password"')
     parser.add_argument('-D', '--data', dest='data', help='The HTTP payload to send as a POST')
     parser.add_argument('-A', '--headers', dest='headers', help='The HTTP headers in JSON format.')
+    add_rule_arguments(parser)
+    # Set by the check for --timing and --profile
+    parser.set_defaults(timings=None, profiler=None, plan=None, passive=None)
+
+    parsed = parser.parse_args(args)
+    if parsed.path and len(parsed.path) > 1:
+        names = [name for name, _ in split_paths(parsed.path)]
+        for name in names:
+            if names.count(name) > 1:
+                parser.error('argument -p/--path: the document name %s is given more than once, '
+                             'name the paths as name:path' % name)
+    return parsed
+
+
+def add_rule_arguments(parser):
+    """
+    The rule options, given on the command line or in the rule sets of a
+    batch file
+    """
     parser.add_argument('-f', '--field_separator', dest='separator',
                         help='''JSON Field separator, defaults to "."; Select element in an array with "(" ")"''')
     parser.add_argument('-F', '--value_separator', dest='value_separator', help='''JSON Value separator, defaults to ":"''')
@@ -558,6 +1332,14 @@ def parseArgs(args):
                         This can be used to map non-numeric values to numeric values, e.g. -M Up=1. Can used multiple times.
                         This flag is meant to be used with the -m flag.''')
 
+
+def parseRuleArgs(args):
+    """
+    Parse the rules of a rule set of a batch file. Only rule options are
+    accepted, the request options and -h are usage errors.
+    """
+    parser = RuleArgumentParser(prog='rule set', add_help=False)
+    add_rule_arguments(parser)
     return parser.parse_args(args)
 
 
@@ -570,6 +1352,18 @@ def key_value_pair(value):
         raise argparse.ArgumentTypeError('invalid format %s. Expected key=value' % (value))
     return (parts[0], parts[1])
 
+def positive_int(value):
+    """
+    Argument type of counts that must be at least 1
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError('invalid value %s. Expected a number of at least 1' % value)
+    return number
+
 def debugPrint(debug_flag, message):
     """
     Print debug messages if -d is set.
@@ -579,6 +1373,16 @@ def debugPrint(debug_flag, message):
 
     print(message)
 
+def debugTraceback(debug_flag):
+    """
+    Print the traceback of the exception being handled if -d is set.
+    """
+    if not debug_flag:
+        return
+
+    import traceback # pylint: disable=import-outside-toplevel
+    print(traceback.format_exc())
+
 def verbosePrint(verbose_flag, when, message):
     """
     Print verbose messages if -v is set.
@@ -589,13 +1393,88 @@ def verbosePrint(verbose_flag, when, message):
     if verbose_flag >= when:
         print(message)
 
+@functools.lru_cache(maxsize=None)
+def _sslClasses():
+    """
+    The TLS socket and context classes, ssl is only imported for -s
+    """
+    import ssl # pylint: disable=import-outside-toplevel
+
+    # dup(), recvmsg() and the like are not implemented by ssl.SSLSocket either
+    class CheckSSLSocket(ssl.SSLSocket): # pylint: disable=abstract-method
+        """
+        Hands its TLS session back to the context when it is closed, with
+        TLS 1.3 the resumable session ticket only arrives with the data
+        read after the handshake
+        """
+
+        session_key = None
+        handshake_time = 0.0
+
+        def close(self):
+            if self.session_key is not None:
+                session = self.session
+                if session is not None:
+                    self.context.sessions[self.session_key] = session
+                self.session_key = None
+            super().close()
+
+
+    class CheckSSLContext(ssl.SSLContext):
+        """
+        SSLContext resuming the TLS sessions of earlier connections to the
+        same host and port, and reporting the handshakes in debug mode.
+        The sessions are kept by the process, the checks forked by the
+        daemon start without sessions.
+        """
+
+        sslsocket_class = CheckSSLSocket
+
+        def __init__(self, *args, **kwargs): # pylint: disable=unused-argument
+            super().__init__()
+            self.sessions = {}
+            self.debug = False
+
+        def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs): # pylint: disable=arguments-differ
+            try:
+                key = '%s:%s' % (server_hostname, sock.getpeername()[1])
+            except OSError:
+                key = server_hostname
+            if session is None:
+                session = self.sessions.get(key)
+            start = time.monotonic()
+            ssl_sock = super().wrap_socket(sock, *args, server_hostname=server_hostname, session=session, **kwargs)
+            ssl_sock.handshake_time = time.monotonic() - start
+            debugPrint(self.debug, "TLS handshake: %s %s %s in %.1f ms" % (
+                key, ssl_sock.version(), 'resumed' if ssl_sock.session_reused else 'full',
+                ssl_sock.handshake_time * 1000))
+            if ssl_sock.session is not None:
+                self.sessions[key] = ssl_sock.session
+            ssl_sock.session_key = key
+            return ssl_sock
+
+    return CheckSSLSocket, CheckSSLContext
+
+
+# TLS contexts of this process by their settings, see prepare_context
+_ssl_contexts = {}
+
+
 def prepare_context(args):
     """
-    Prepare TLS Context
+    Prepare TLS Context, contexts are reused for the same TLS settings
     """
+    # Relative paths are resolved, the daemon builds contexts for clients in other directories
+    settings = (args.insecure,) + tuple(path and os.path.abspath(path) for path in (args.cacert, args.cert, args.key))
+    context = _ssl_contexts.get(settings)
+    if context is not None:
+        context.debug = args.debug
+        return context
+
+    import ssl # pylint: disable=import-outside-toplevel
     nagios = NagiosHelper()
 
-    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context = _sslClasses()[1](ssl.PROTOCOL_TLS_CLIENT)
     context.options |= ssl.OP_NO_SSLv2
     context.options |= ssl.OP_NO_SSLv3
 
@@ -620,114 +1499,2124 @@ def prepare_context(args):
                     nagios.append_message(UNKNOWN_CODE, 'Error loading SSL cert. Make sure "%s" contains the key as well!' % (args.cert))
 
     if nagios.getCode() != OK_CODE:
-        print(nagios.getMessage())
-        sys.exit(nagios.getCode())
+        raise CheckAbort(nagios)
 
+    context.debug = args.debug
+    _ssl_contexts[settings] = context
     return context
 
 
-def make_request(args, url, context):
+def request_headers(args):
     """
-    Performs the actual request to the given URL
+    HTTP headers to send with the requests
     """
-    req = urllib.request.Request(url, method=args.method)
-    req.add_header("User-Agent", "check_http_json")
+    headers = {"User-Agent": "check_http_json", "Accept-Encoding": "gzip, deflate"}
     if args.auth:
         authbytes = str(args.auth).encode()
         base64str = base64.encodebytes(authbytes).decode().replace('\n', '')
-        req.add_header('Authorization', 'Basic %s' % base64str)
+        headers['Authorization'] = 'Basic %s' % base64str
     if args.headers:
-        headers = json.loads(args.headers)
-        debugPrint(args.debug, "Headers:\n %s" % headers)
-        for header in headers:
-            req.add_header(header, headers[header])
+        custom_headers = json.loads(args.headers)
+        debugPrint(args.debug, "Headers:\n %s" % custom_headers)
+        headers.update(custom_headers)
+    if args.state_file:
+        headers.update(args.state.headers())
+    return headers
+
 
+def open_request(args, url, context):
+    """
+    Performs the actual request to the given URL, returns the response.
+    Requests failing to connect are retried --retries times within the
+    --timeout.
+    """
+    import urllib.error as urllib_error # pylint: disable=import-outside-toplevel
+    deadline = time.monotonic() + args.timeout
+    numbers = itertools.count(1)
+    retry = 0
+    while True:
+        try:
+            response = hedged_urlopen(args, url, context, deadline, numbers)
+            break
+        except TimeoutError as e:
+            nagios = NagiosHelper()
+            nagios.append_message(args.unreachable_state, "  %s socket timeout after %s seconds" % (url, args.timeout))
+            raise CheckAbort(nagios) from e
+        except urllib_error.HTTPError:
+            raise
+        except urllib_error.URLError:
+            # Full jitter, the retries of many checks do not hit a host at once
+            backoff = random.uniform(0, RETRY_BACKOFF * 2 ** retry)
+            if retry >= args.retries or time.monotonic() + backoff >= deadline:
+                raise
+            retry += 1
+            debugPrint(args.debug, "request: retry %d of %d in %.3fs" % (retry, args.retries, backoff))
+            time.sleep(backoff)
+
+    if args.state_file:
+        args.state.update(response.headers)
+    return decode_response(args, response)
+
+
+def hedged_urlopen(args, url, context, deadline, numbers):
+    """
+    Open the URL, with --hedge-after a GET whose response headers did not
+    arrive in time is sent a second time in parallel. The first response
+    is returned and the slower one closed once it arrives, an attempt
+    that cannot be interrupted does not delay the exit as its thread is
+    a daemon. Raises the error of the last attempt if all fail. The
+    attempts are numbered by the numbers iterator in the debug output.
+    """
+    if not args.hedge_after or args.method != 'GET':
+        timings = None if args.timings is None else Timings()
+        try:
+            return attempt_urlopen(args, url, context, deadline=deadline, number=next(numbers), timings=timings,
+                                   log=functools.partial(debugPrint, args.debug))
+        finally:
+            if timings is not None:
+                args.timings.add(timings)
+
+    import urllib.error as urllib_error # pylint: disable=import-outside-toplevel
+    results = queue.Queue()
+    lock = threading.Lock()
+    answered = []
+    done = threading.Event()
+
+    def log(message):
+        # An attempt that ends after the check returned stays silent
+        if not done.is_set():
+            debugPrint(args.debug, message)
+
+    def attempt(number):
+        timings = None if args.timings is None else Timings()
+        try:
+            response, error = attempt_urlopen(args, url, context, deadline=deadline, number=number,
+                                              timings=timings, log=log), None
+        except urllib_error.HTTPError as e:
+            # An error status is a response as well
+            response, error = None, e
+        except Exception as e: # pylint: disable=broad-exception-caught
+            results.put((None, e, None))
+            return
+        with lock:
+            if answered:
+                log("request: attempt %d closed, attempt %d was faster" % (number, answered[0]))
+                (response or error).close()
+                return
+            answered.append(number)
+        results.put((response, error, timings))
+
+    threading.Thread(target=attempt, args=(next(numbers),), daemon=True).start()
+    attempts = failures = 1
+    hedge = time.monotonic() + args.hedge_after / 1000
+    try:
+        while True:
+            try:
+                wait = min(hedge, deadline) if attempts == 1 else deadline
+                response, error, timings = results.get(timeout=max(wait - time.monotonic(), 0))
+            except queue.Empty:
+                if attempts == 1 and time.monotonic() < deadline:
+                    number = next(numbers)
+                    log("request: no response headers after %dms, sending attempt %d" % (args.hedge_after, number))
+                    threading.Thread(target=attempt, args=(number,), daemon=True).start()
+                    attempts = 2
+                    continue
+                raise TimeoutError('timed out') from None
+            if timings is not None:
+                args.timings.add(timings)
+            if error is None:
+                return response
+            if isinstance(error, urllib_error.HTTPError) or failures == attempts:
+                raise error
+            failures += 1
+    finally:
+        done.set()
+
+
+def attempt_urlopen(args, url, context, *, deadline, number, timings, log):
+    """
+    One attempt of a request, within the rest of the timeout. The debug
+    messages of the attempt are passed to log.
+    """
+    import urllib.request as urllib_request # pylint: disable=import-outside-toplevel
+    req = urllib_request.Request(url, method=args.method)
+    for header, value in request_headers(args).items():
+        req.add_header(header, value)
+    databytes = str(args.data).encode() if args.data else None
+
+    timeout = deadline - time.monotonic()
+    if timeout <= 0:
+        raise TimeoutError('timed out')
+    start = time.monotonic()
     try:
-        if args.data:
-            databytes = str(args.data).encode()
-            response = urllib.request.urlopen(req, data=databytes, timeout=args.timeout, context=context)
+        if timings is not None:
+            response = timed_urlopen(timings, req, context, data=databytes, timeout=timeout)
         else:
             # pylint: disable=consider-using-with
-            response = urllib.request.urlopen(req, timeout=args.timeout, context=context)
-    except TimeoutError:
-        nagios = NagiosHelper()
-        nagios.append_message(args.unreachable_state, "  %s socket timeout after %s seconds" % (url, args.timeout))
-        print(nagios.getMessage())
-        sys.exit(nagios.getCode())
-
-    return response.read()
+            response = urllib_request.urlopen(req, data=databytes, timeout=timeout, context=context)
+    except Exception as e:
+        log("request: attempt %d failed after %.3fs: %s" % (number, time.monotonic() - start, e))
+        raise
+    if timings is not None:
+        log("request: attempt %d received the response headers after %.3fs"
+            " (connect %.3fs, tls %.3fs, first byte %.3fs)" % (
+                number, time.monotonic() - start, timings.connect, timings.tls, timings.firstbyte))
+    else:
+        log("request: attempt %d received the response headers after %.3fs" % (number, time.monotonic() - start))
+    return response
 
 
-def main(cliargs):
+class Timings:
     """
-    Main entrypoint for CLI
+    Durations of the phases of a check in seconds and the size of its
+    response body, for --timing
     """
+    __slots__ = ('start', 'connect', 'tls', 'firstbyte', 'download', 'parse', 'eval', 'size')
 
-    args = parseArgs(cliargs)
-    nagios = NagiosHelper()
-    context = None
+    phases = ('connect', 'tls', 'firstbyte', 'download', 'parse', 'eval')
 
-    if args.version:
-        print('Version: %s - Date: %s' % (__version__, __version_date__))
-        sys.exit(0)
+    def __init__(self):
+        self.start = time.monotonic()
+        for phase in self.phases:
+            setattr(self, phase, 0.0)
+        self.size = 0
 
-    if args.ssl:
-        url = "https://%s" % args.host
-        context = prepare_context(args)
+    def add(self, other):
+        """
+        Add the phases of the request of another Timings
+        """
+        for phase in ('connect', 'tls', 'firstbyte'):
+            setattr(self, phase, getattr(self, phase) + getattr(other, phase))
+
+    def getPerformanceData(self, total, warning, critical):
+        performance_data = "'time'=%.6fs;%s;%s;0 " % (total, warning or '', critical or '')
+        for phase in self.phases:
+            performance_data += "'time_%s'=%.6fs;;;0 " % (phase, getattr(self, phase))
+        performance_data += "'size'=%dB;;;0 " % self.size
+        return performance_data
+
+
+class Profile:
+    """
+    Wall and CPU time of the phases of a check and of its rules,
+    reported on stderr for --profile
+    """
+
+    def __init__(self, start, top):
+        self.start = self.mark = start
+        self.top = top
+        self.phases = []
+        self.rules = []
+
+    @staticmethod
+    def now():
+        return time.perf_counter(), time.process_time()
+
+    def phase(self, name):
+        """
+        Record a phase that began at the end of the last one
+        """
+        end = self.now()
+        self.phases.append((name, end[0] - self.mark[0], end[1] - self.mark[1]))
+        self.mark = end
+
+    def rule(self, name, start):
+        end = self.now()
+        self.rules.append((name, end[0] - start[0], end[1] - start[1]))
+
+    def report(self, timings=None):
+        """
+        The phases, the fetch phases of the Timings and the slowest rules
+        in milliseconds
+        """
+        lines = ['profile: %-40s %10s %10s' % ('phase', 'wall ms', 'cpu ms')]
+        for name, wall, cpu in self.phases:
+            lines.append('profile: %-40s %10.3f %10.3f' % (name, wall * 1000, cpu * 1000))
+        end = self.now()
+        lines.append('profile: %-40s %10.3f %10.3f' % (
+            'total', (end[0] - self.start[0]) * 1000, (end[1] - self.start[1]) * 1000))
+
+        if timings is not None:
+            lines.append('profile: %-40s %10s' % ('fetch phase', 'wall ms'))
+            for phase in ('connect', 'tls', 'firstbyte', 'download', 'parse'):
+                lines.append('profile: %-40s %10.3f' % (phase, getattr(timings, phase) * 1000))
+
+        if self.rules:
+            slowest = sorted(self.rules, key=lambda rule: rule[1], reverse=True)[:self.top]
+            lines.append('profile: %-40s %10s %10s' % (
+                'slowest %d of %d rules' % (len(slowest), len(self.rules)), 'wall ms', 'cpu ms'))
+            for name, wall, cpu in slowest:
+                lines.append('profile: %-40s %10.3f %10.3f' % (name, wall * 1000, cpu * 1000))
+        return '\n'.join(lines)
+
+
+def profile_phase(args, name):
+    """
+    Record the end of a phase with --profile
+    """
+    if args.profiler is not None:
+        args.profiler.phase(name)
+
+
+@functools.lru_cache(maxsize=None)
+def _timedHandlers():
+    """
+    urllib handlers whose connections add the time of connecting, of the
+    TLS handshake and until the first byte of the response to a Timings
+    """
+    import http.client as http_client # pylint: disable=import-outside-toplevel
+    import urllib.request as urllib_request # pylint: disable=import-outside-toplevel
+
+    class TimedHTTPConnection(http_client.HTTPConnection):
+        """
+        Adds the time of connecting and until the first byte to the Timings
+        """
+
+        def __init__(self, *args, timings=None, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.timings = timings
+
+        def connect(self):
+            start = time.monotonic()
+            super().connect()
+            # The handshake time of a CheckSSLSocket, plain sockets have none
+            tls = getattr(self.sock, 'handshake_time', 0.0)
+            self.timings.connect += time.monotonic() - start - tls
+            self.timings.tls += tls
+
+        def getresponse(self):
+            start = time.monotonic()
+            response = super().getresponse()
+            self.timings.firstbyte += time.monotonic() - start
+            return response
+
+    class TimedHTTPSConnection(TimedHTTPConnection, http_client.HTTPSConnection):
+        """
+        The TimedHTTPConnection over TLS, its connect() times the
+        connect() of the HTTPSConnection including the handshake
+        """
+
+    class TimedHTTPHandler(urllib_request.HTTPHandler):
+        """
+        Opens http URLs over a TimedHTTPConnection
+        """
+
+        def __init__(self, timings):
+            super().__init__()
+            self.timings = timings
+
+        def http_open(self, req):
+            return self.do_open(functools.partial(TimedHTTPConnection, timings=self.timings), req)
+
+    class TimedHTTPSHandler(urllib_request.HTTPSHandler):
+        """
+        Opens https URLs over a TimedHTTPSConnection
+        """
+
+        def __init__(self, timings, context):
+            super().__init__(context=context)
+            self.timings = timings
+
+        def https_open(self, req):
+            return self.do_open(functools.partial(TimedHTTPSConnection, timings=self.timings), req, context=self._context)
+
+    return TimedHTTPHandler, TimedHTTPSHandler
+
+
+def timed_urlopen(timings, req, context, data=None, timeout=None):
+    """
+    urlopen recording the phases of the request in the Timings
+    """
+    http_handler, https_handler = _timedHandlers()
+    import urllib.request as urllib_request # pylint: disable=import-outside-toplevel
+    opener = urllib_request.build_opener(http_handler(timings), https_handler(timings, context))
+    return opener.open(req, data=data, timeout=timeout)
+
+
+def make_request(args, url, context):
+    """
+    Performs the actual request to the given URL, returns its body
+    """
+    return read_body(args, open_request(args, url, context), url)
+
+
+def body_too_large(args, url, size, announced=False):
+    """
+    The CheckAbort of a response body exceeding --max-body-size, size is
+    the Content-Length of the response if announced, else the bytes received
+    """
+    nagios = NagiosHelper()
+    nagios.append_message(args.invalid_json_state, " Response body exceeds %d bytes (%d bytes %s), url:%s" % (
+        args.max_body_size, size, 'announced by Content-Length' if announced else 'received', url))
+    return CheckAbort(nagios)
+
+
+def read_body(args, response, url):
+    """
+    Read the body of a response. With --max-body-size it is read in chunks
+    into a preallocated buffer and the check aborts once it exceeds the limit.
+    """
+    if args.timings is None:
+        return _read_body(args, response, url)
+
+    start = time.monotonic()
+    body = _read_body(args, response, url)
+    args.timings.download += time.monotonic() - start
+    args.timings.size += len(body)
+    return body
+
+
+def _read_body(args, response, url):
+    try:
+        if not args.max_body_size:
+            body = response.read()
+            debugPrint(args.debug, "body: %s received" % body_size(response, len(body)))
+            return body
+
+        # Content-Length is the size of a compressed body
+        length = response.headers.get('Content-Length')
+        if length and length.isdecimal() and int(length) > args.max_body_size and not isinstance(response, DecodedResponse):
+            raise body_too_large(args, url, int(length), announced=True)
+
+        body = bytearray()
+        chunk = memoryview(bytearray(BODY_CHUNK_SIZE))
+        while True:
+            count = response.readinto(chunk)
+            if not count:
+                break
+            body += chunk[:count]
+            if len(body) > args.max_body_size:
+                raise body_too_large(args, url, len(body))
+    except zlib.error as e:
+        nagios = NagiosHelper()
+        nagios.append_message(args.invalid_json_state, " Could not decompress the response body: %s, url:%s" % (str(e), url))
+        raise CheckAbort(nagios) from e
+    debugPrint(args.debug, "body: %s received" % body_size(response, len(body)))
+    return body
+
+
+class DecodedResponse:
+    """
+    Response with a gzip or deflate Content-Encoding, decompressed while
+    it is read. A read never returns more than the size asked for, so
+    --max-body-size limits the decompressed size of the body. Without it
+    max_size (--max-decompressed-size) still limits it, a small response
+    could otherwise decompress into gigabytes.
+    """
+
+    def __init__(self, response, encoding, max_size=0):
+        self.response = response
+        self.headers = response.headers
+        self.encoding = encoding
+        self.max_size = max_size
+        self.decompressor = None
+        self.compressed = 0
+        self.size = 0
+        self.eof = False
+
+    def decompressed(self, chunk):
+        """
+        Count the decompressed data, raises zlib.error over max_size
+        """
+        self.size += len(chunk)
+        if self.max_size and self.size > self.max_size:
+            raise zlib.error("decompressed body exceeds %d bytes" % self.max_size)
+        return chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(BODY_CHUNK_SIZE), b''))
+
+        while True:
+            data = b''
+            if self.decompressor is not None:
+                data = self.decompressor.unconsumed_tail
+                if self.decompressor.eof:
+                    return b''
+            if not data:
+                data = self.response.read(BODY_CHUNK_SIZE)
+                self.compressed += len(data)
+                if not data:
+                    if self.eof or self.decompressor is None:
+                        return b''
+                    self.eof = True
+                    return self.decompressed(self.decompressor.flush())
+            if self.decompressor is None:
+                self.decompressor = zlib.decompressobj(self.windowBits(data))
+            chunk = self.decompressor.decompress(data, size)
+            if chunk:
+                return self.decompressed(chunk)
+
+    def windowBits(self, data):
+        """
+        Format of the compressed data, deflate is meant to be zlib
+        wrapped but some servers send raw deflate data
+        """
+        if self.encoding != 'deflate':
+            return 16 + zlib.MAX_WBITS
+        if len(data) >= 2 and data[0] & 0x0f == 8 and (data[0] * 256 + data[1]) % 31 == 0:
+            return zlib.MAX_WBITS
+        return -zlib.MAX_WBITS
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.response.close()
+
+
+def decode_response(args, response):
+    """
+    Decompress the response while it is read if it is compressed
+    """
+    encoding = (response.headers.get('Content-Encoding') or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+        return DecodedResponse(response, encoding, args.max_decompressed_size)
+    return response
+
+
+def body_size(response, size):
+    """
+    Size of a body for debug output, with its compressed size
+    """
+    if isinstance(response, DecodedResponse):
+        return "%d bytes (%d bytes %s)" % (size, response.compressed, response.encoding)
+    return "%d bytes" % size
+
+
+class ResponseCache:
+    """
+    On-disk response cache shared by the plugin processes of a user.
+    Concurrent requests for the same entry are coalesced with a file lock,
+    only the first process performs the request and the others reuse
+    its response. A directory that is not private to the user is not used,
+    others could put responses into it.
+    """
+
+    def __init__(self, directory, ttl, max_size):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+
+    @staticmethod
+    def key(args, url):
+        """
+        Cache key of a request, made of everything that is sent and the
+        TLS options the response was verified with
+        """
+        request = '\0'.join(str(part) for part in (args.method, url, args.headers, args.auth, args.data,
+                                                   args.insecure, args.cacert, args.cert, args.key))
+        import hashlib # pylint: disable=import-outside-toplevel
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def open(self):
+        """
+        Create the cache directory, raises an OSError if it is not a
+        directory of the user that only the user can access
+        """
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        status = os.lstat(self.directory)
+        if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.geteuid() or status.st_mode & 0o077:
+            raise OSError("%s is not a directory that only this user can access" % self.directory)
+
+    def read(self, path):
+        """
+        Returns the cached response if it is fresh, otherwise None
+        """
+        try:
+            age = time.time() - os.stat(path).st_mtime
+            if age > self.ttl:
+                return None
+            with open(path, 'rb') as entry:
+                return entry.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, path, body):
+        import tempfile # pylint: disable=import-outside-toplevel
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as entry:
+                entry.write(body)
+            os.replace(temp_path, path)
+        except OSError:
+            os.unlink(temp_path)
+            raise
+
+    @staticmethod
+    def lock(path, deadline):
+        """
+        Open and lock the lock file of an entry, returns None if another
+        process holds the lock until the deadline. The lock is released
+        when the file is closed.
+        """
+        import fcntl # pylint: disable=import-outside-toplevel
+        while True:
+            lock = open(path, 'ab') # pylint: disable=consider-using-with
+            current = False
+            try:
+                while True:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() >= deadline:
+                            return None
+                        time.sleep(0.01)
+                # evict may have removed the lock file before it was locked
+                try:
+                    current = os.fstat(lock.fileno()).st_ino == os.stat(path).st_ino
+                except FileNotFoundError:
+                    pass
+                if current:
+                    return lock
+            finally:
+                if not current:
+                    lock.close()
+
+    def fetch(self, args, url, request):
+        """
+        Returns the cached response or the response of request().
+        A cache directory that cannot be used does not fail the check,
+        the request is then made without the cache, as it is when the
+        request of another check takes longer than the --timeout.
+        """
+        lock = None
+        try:
+            self.open()
+            path = os.path.join(self.directory, self.key(args, url))
+            body = self.read(path)
+            if body is None:
+                lock = self.lock(path + '.lock', time.monotonic() + args.timeout)
+                if lock is None:
+                    debugPrint(args.debug, "cache: %s is still locked after %s seconds" % (path, args.timeout))
+                    return request()
+                body = self.read(path)
+        except OSError as e:
+            if lock is not None:
+                lock.close()
+            debugPrint(args.debug, "cache: not using %s: %s" % (self.directory, str(e)))
+            return request()
+
+        if lock is not None:
+            with lock:
+                if body is None:
+                    debugPrint(args.debug, "cache: miss %s" % path)
+                    body = request()
+                    try:
+                        self.write(path, body)
+                        self.evict()
+                    except OSError as e:
+                        debugPrint(args.debug, "cache: could not store %s: %s" % (path, str(e)))
+                    return body
+        debugPrint(args.debug, "cache: hit %s" % path)
+        return body
+
+    def evict(self):
+        """
+        Remove expired responses, then the oldest ones until the cache
+        fits into its maximum size. An old lock file is only removed if
+        no process holds it.
+        """
+        import fcntl # pylint: disable=import-outside-toplevel
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                status = entry.stat()
+                if now - status.st_mtime <= CACHE_MAX_AGE:
+                    if not entry.name.endswith(('.lock', '.tmp')):
+                        entries.append((status.st_mtime, status.st_size, entry.path))
+                elif entry.name.endswith('.lock'):
+                    with open(entry.path, 'ab') as lock:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        os.unlink(entry.path)
+                else:
+                    os.unlink(entry.path)
+            except (FileNotFoundError, BlockingIOError):
+                pass
+
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+
+class CheckState:
+    """
+    State of a check kept in its --state-file between runs: the validators
+    (ETag, Last-Modified) of the last response and the result of its rules,
+    which is reused as long as the response is not modified.
+    """
+
+    # NagiosHelper attributes making up a result
+    result_fields = ('warning_message', 'critical_message', 'unknown_message', 'performance_data')
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.validators = {}
+        self.result = None
+        self.times = None
+
+    @staticmethod
+    def checkKey(args):
+        """
+        Hash of the check arguments, a state is only reused by the same check
+        """
+        arguments = {name: value for name, value in vars(args).items()
+                     if name not in ('debug', 'verbose', 'stream_paths', 'state', 'timings',
+                                     'profile', 'profile_top', 'profile_file', 'profiler', 'plan', 'passive')}
+        import hashlib # pylint: disable=import-outside-toplevel
+        return hashlib.sha256(json.dumps(arguments, sort_keys=True, default=str).encode()).hexdigest()
+
+    @classmethod
+    def load(cls, args):
+        """
+        Read the state of the check, a missing, unreadable or foreign
+        state is empty
+        """
+        state = cls(args.state_file, cls.checkKey(args))
+        try:
+            with open(state.path, encoding='utf-8') as state_file:
+                saved = json.load(state_file)
+            if saved.get('key') == state.key:
+                state.validators = dict(saved['validators'])
+                state.result = {name: saved['result'][name] for name in cls.result_fields}
+                state.times = saved['times']
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, LookupError, TypeError, AttributeError) as e:
+            debugPrint(args.debug, "state: ignoring %s: %s" % (state.path, str(e)))
+            state.validators, state.result, state.times = {}, None, None
+        return state
+
+    def headers(self):
+        """
+        Conditional request headers, only sent if there is a result to reuse
+        """
+        headers = {}
+        if self.result is not None:
+            if 'ETag' in self.validators:
+                headers['If-None-Match'] = self.validators['ETag']
+            if 'Last-Modified' in self.validators:
+                headers['If-Modified-Since'] = self.validators['Last-Modified']
+        return headers
+
+    def update(self, headers):
+        """
+        Keep the validators of a response
+        """
+        self.validators = {name: headers[name] for name in ('ETag', 'Last-Modified') if headers.get(name)}
+
+    def save(self, nagios, times, debug=False):
+        """
+        Write the result and the values of the time relative rules.
+        The state is best effort, a state that cannot be written does not
+        change the result of the check.
+        """
+        self.result = {name: getattr(nagios, name) for name in self.result_fields}
+        self.times = times
+        state = {'key': self.key, 'validators': self.validators, 'result': self.result, 'times': times}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            import tempfile # pylint: disable=import-outside-toplevel
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        except OSError as e:
+            debugPrint(debug, "state: could not save %s: %s" % (self.path, str(e)))
+            return
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as state_file:
+                json.dump(state, state_file)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            debugPrint(debug, "state: could not save %s: %s" % (self.path, str(e)))
+            os.unlink(temp_path)
+
+    def restore(self):
+        """
+        The NagiosHelper of the saved result
+        """
+        nagios = NagiosHelper()
+        for name in self.result_fields:
+            setattr(nagios, name, self.result[name])
+        return nagios
+
+
+class PassiveResults:
+    """
+    Results of a run submitted as passive check results, all at once
+    after the run: as one file in the checkresults spool directory of
+    Nagios or Icinga, or as PROCESS_SERVICE_CHECK_RESULT commands
+    written to the external command file.
+    """
+
+    def __init__(self, args, services):
+        self.checkresults_dir = args.checkresults_dir
+        self.command_file = args.command_file
+        self.passive_host = args.passive_host
+        self.max_length = args.max_output_length
+        self.debug = args.debug
+        self.services = services
+        self.hosts = []
+        self.results = []
+        self.start = time.time()
+
+    def hostName(self, host):
+        """
+        Host name of the results of a queried host, without its port
+        """
+        if self.passive_host:
+            return self.passive_host
+        return re.sub(r':\d+$', '', host).strip('[]')
+
+    def add(self, host, service, nagios):
+        self.results.append((self.hostName(host), service, nagios.getCode(),
+                             nagios.getMessage(max_length=self.max_length), time.time()))
+
+    def addAll(self, nagios, services=None):
+        """
+        Add the same result for every host, of every service by default
+        """
+        for host in self.hosts:
+            for service in services or self.services:
+                self.add(host, service, nagios)
+
+    def submit(self):
+        if not self.results:
+            return
+        if self.checkresults_dir:
+            self.writeCheckResults()
+        if self.command_file:
+            self.writeCommands()
+        debugPrint(self.debug, "passive: %d results submitted" % len(self.results))
+
+    def writeCheckResults(self):
+        """
+        Write the results into one check result file. Nagios only reads
+        it once the .ok file exists, the file is complete before it is
+        renamed to a name Nagios picks up.
+        """
+        lines = ['### Passive Check Result File ###', 'file_time=%d' % self.start, '']
+        for host, service, code, output, finish in self.results:
+            lines += [
+                '### Nagios Service Check Result ###',
+                '# Time: %s' % time.ctime(finish),
+                'host_name=%s' % host,
+                'service_description=%s' % service,
+                'check_type=1',
+                'check_options=0',
+                'scheduled_check=0',
+                'reschedule_check=0',
+                'latency=0.000000',
+                'start_time=%.6f' % self.start,
+                'finish_time=%.6f' % finish,
+                'early_timeout=0',
+                'exited_ok=1',
+                'return_code=%d' % code,
+                'output=%s' % output.replace('\\', '\\\\').replace('\n', '\\n'),
+                '']
+        import tempfile # pylint: disable=import-outside-toplevel
+        fd, temp_path = tempfile.mkstemp(dir=self.checkresults_dir, prefix='.c', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as result_file:
+                result_file.write('\n'.join(lines))
+            os.chmod(temp_path, 0o644)
+            path = self.reservePath()
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        with open(path + '.ok', 'w', encoding='utf-8'):
+            pass
+
+    def reservePath(self):
+        """
+        A new check result file name, cXXXXXX as Nagios expects it
+        """
+        characters = string.ascii_letters + string.digits
+        while True:
+            path = os.path.join(self.checkresults_dir, 'c' + ''.join(random.choices(characters, k=6)))
+            try:
+                os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+                return path
+            except FileExistsError:
+                pass
+
+    def writeCommands(self):
+        """
+        Write the results to the command file, a named pipe that must
+        already exist. A write of up to PIPE_BUF bytes is not interleaved
+        with the writes of other processes, the commands are written in
+        batches of whole lines up to that size.
+        """
+        fd = os.open(self.command_file, os.O_WRONLY | os.O_APPEND | os.O_NONBLOCK)
+        try:
+            # Opening fails instead of blocking if no one reads the pipe
+            os.set_blocking(fd, True)
+            batch = b''
+            for host, service, code, output, finish in self.results:
+                line = ('[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%d;%s\n' % (
+                    finish, host, service, code, output.replace('\n', '\\n'))).encode('utf-8')
+                if batch and len(batch) + len(line) > select.PIPE_BUF:
+                    self.writeAll(fd, batch)
+                    batch = b''
+                batch += line
+            self.writeAll(fd, batch)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def writeAll(fd, data):
+        while data:
+            data = data[os.write(fd, data):]
+
+
+def make_requests(args, paths, context):
+    """
+    Performs the requests of several paths sequentially over one
+    persistent HTTP/1.1 connection.
+    Returns (status, content subtype, body) per path.
+    """
+    import http.client as http_client # pylint: disable=import-outside-toplevel
+    if args.ssl:
+        connection = http_client.HTTPSConnection(args.host, args.port, timeout=args.timeout, context=context)
     else:
-        url = "http://%s" % args.host
-    if args.port:
-        url += ":%s" % args.port
-    if args.path:
-        url += "/%s" % args.path
+        connection = http_client.HTTPConnection(args.host, args.port, timeout=args.timeout)
+    headers = request_headers(args)
+    body = None
+    if args.data:
+        body = str(args.data).encode()
+        headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+
+    responses = []
+    try:
+        for path in paths:
+            connection.request(args.method, '/' + path.lstrip('/'), body=body, headers=headers)
+            response = connection.getresponse()
+            json_data = read_body(args, decode_response(args, response), path)
+            responses.append((response.status, response.headers.get_content_subtype(), json_data))
+    finally:
+        connection.close()
+    return responses
 
-    debugPrint(args.debug, "url: %s" % url)
+
+def check_namespaces(args, plan):
+    """
+    With several paths every rule key has to start with the name of
+    its document (name:key), raises a ValueError naming the first key
+    that does not
+    """
+    if not args.path or len(args.path) < 2:
+        return
+    names = {name for name, _ in split_paths(args.path)}
+    for key in sorted(plan.keys):
+        namespace, separator, _ = compileRuleKey(key, lambda key: key.partition(NAMESPACE_SEPARATOR))[3]
+        if not separator or namespace not in names:
+            raise ValueError("key %s does not start with the name of one of the documents %s (name:key)" % (
+                key, ', '.join(sorted(names))))
+
+
+def split_paths(paths):
+    """
+    Split [name:]path arguments into (name, path)
+    """
+    named_paths = []
+    for path in paths:
+        name, separator, named_path = path.partition(NAMESPACE_SEPARATOR)
+        if separator and '/' not in name:
+            path = named_path
+        else:
+            name = path.split('?')[0].rstrip('/').rsplit('/', 1)[-1]
+        named_paths.append((name, path))
+    return named_paths
+
+
+def parse_json(args, json_data, nagios):
+    """
+    Load the JSON data, print the Nagios message and exit if it is invalid
+    """
+    try:
+        start = time.monotonic()
+        data = json.loads(json_data)
+        if args.timings is not None:
+            args.timings.parse += time.monotonic() - start
+    except ValueError as e:
+        exit_code = args.invalid_json_state
+        debugTraceback(args.debug)
+        nagios.append_message(exit_code, " JSON Parser error: %s" % str(e))
+        raise CheckAbort(nagios) from e
+    verbosePrint(args.verbose, 1, json.dumps(data, indent=2))
+    return data
+
+
+class JsonStreamError(ValueError):
+    """
+    Invalid JSON found by the JsonStreamParser
+    """
+
+
+class StreamedObject(dict):
+    """
+    JSON object built by the JsonStreamParser, it only holds the members
+    the rules refer to but is still true if the document had any
+    """
+    __slots__ = ('size',)
+
+    def __init__(self):
+        super().__init__()
+        self.size = 0
+
+    def __bool__(self):
+        return self.size > 0
+
+
+class StreamedArray(list):
+    """
+    JSON array built by the JsonStreamParser, elements the rules do not
+    refer to are None
+    """
+    __slots__ = ()
+
+
+# A trie node is only filled by KeySelection and walked by the parser
+class _SelectionNode: # pylint: disable=too-few-public-methods
+    """
+    Node of the key path trie the JsonStreamParser follows.
+    end: the whole value is needed,
+    points: key paths that are complete once this value was parsed
+    """
+    __slots__ = ('children', 'wildcard', 'end', 'points')
+
+    def __init__(self):
+        self.children = {}
+        self.wildcard = None
+        self.end = False
+        self.points = 0
+
+
+def _selectionPaths(paths):
+    """
+    The key paths with their predicates replaced by (*), and the paths
+    of the keys the predicates test
+    """
+    for path in paths:
+        selection = []
+        for token in path:
+            if token.__class__ is KeyPredicate:
+                yield tuple(selection) + (ARRAY_WILDCARD,) + token.path
+                token = ARRAY_WILDCARD
+            selection.append(token)
+        yield tuple(selection)
+
+
+class KeySelection:
+    """
+    Trie of compiled key paths, selects the parts of a document
+    the paths refer to
+    """
+
+    def __init__(self, paths):
+        self.root = self.compile(paths)
+        self.merged = {}
+
+    @staticmethod
+    def compile(paths):
+        """
+        Build the trie of the compiled key paths. A key path is complete
+        once its value, or the array of its first (*), was parsed.
+        """
+        root = _SelectionNode()
+        points = set()
+        for path in _selectionPaths(paths):
+            node = root
+            lineage = [root]
+            for token in path:
+                if token is ARRAY_WILDCARD:
+                    if node.wildcard is None:
+                        node.wildcard = _SelectionNode()
+                    node = node.wildcard
+                else:
+                    node = node.children.setdefault(token, _SelectionNode())
+                if lineage is not None:
+                    lineage.append(node)
+                    if token is ARRAY_WILDCARD:
+                        # Nothing below a wildcard is complete before its array
+                        lineage.pop()
+                        points.add(tuple(lineage))
+                        lineage = None
+            node.end = True
+            if lineage is not None:
+                points.add(tuple(lineage))
+
+        for lineage in points:
+            for node in lineage:
+                node.points += 1
+        return root
+
+    def merge(self, node, wildcard):
+        """
+        Node of an array element selected both by index and by (*)
+        """
+        key = (id(node), id(wildcard))
+        if key not in self.merged:
+            merged = _SelectionNode()
+            merged.end = node.end or wildcard.end
+            merged.points = node.points
+            merged.children = dict(wildcard.children)
+            for token, child in node.children.items():
+                if token in merged.children:
+                    child = self.merge(child, merged.children[token])
+                merged.children[token] = child
+            merged.wildcard = node.wildcard or wildcard.wildcard
+            if node.wildcard is not None and wildcard.wildcard is not None:
+                merged.wildcard = self.merge(node.wildcard, wildcard.wildcard)
+            self.merged[key] = merged
+        return self.merged[key]
+
+    def extract(self, data, values):
+        """
+        Add the values of the key paths to values by path, in one
+        depth-first walk of the data following only the branches of the
+        trie. A key path with (*) gets the array of its first wildcard,
+        its elements are walked when the key is expanded. Paths that are
+        not in the data get NOT_FOUND.
+        """
+        stack = [(self.root, data, ())]
+        while stack:
+            node, data, path = stack.pop()
+            if node.end or node.wildcard is not None:
+                values[path] = data
+            for token, child in node.children.items():
+                if token.__class__ is int:
+                    found = isinstance(data, list) and token < len(data)
+                else:
+                    found = isinstance(data, dict) and token in data
+                if found:
+                    stack.append((child, data[token], path + (token,)))
+                else:
+                    stack.append((child, NOT_FOUND, path + (token,)))
+
+    def select(self, value, node=None):
+        """
+        The parts of a decoded value the node selects,
+        by default the whole selection
+        """
+        if node is None:
+            node = self.root
+        if node.end:
+            return value
+        if isinstance(value, dict):
+            selected = StreamedObject()
+            selected.size = len(value)
+            for token, child in node.children.items():
+                if token in value:
+                    selected[token] = self.select(value[token], child)
+            return selected
+        if isinstance(value, list):
+            selected = StreamedArray()
+            for index, element in enumerate(value):
+                child = node.children.get(index)
+                if node.wildcard is not None:
+                    child = node.wildcard if child is None else self.merge(child, node.wildcard)
+                selected.append(None if child is None else self.select(element, child))
+            return selected
+        return value
+
+
+# Whitespace, end of a string body and the structural characters of JSON
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.S)
+_STRUCTURE = re.compile(r'["{}\[\]]')
+_SCALAR_END = re.compile(r'[,}\] \t\n\r]')
+_DECODER = json.JSONDecoder()
+
+
+# A parser is made for one response body and only parses it
+class JsonStreamParser: # pylint: disable=too-few-public-methods
+    """
+    Incremental JSON parser for --stream. The document is read in chunks
+    and only the values the key paths refer to are built, everything else
+    is scanned and dropped. Reading stops as soon as all key paths were seen.
+    """
+
+    def __init__(self, stream, paths, chunk_size=BODY_CHUNK_SIZE, max_size=0):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        # Start of the value being captured and its text read so far
+        self.mark = None
+        self.pieces = []
+        self.size = 0
+        self.selection = KeySelection(paths)
+        self.root = self.selection.root
+        self.pending = self.root.points
+        self.stopped = False
+
+    def parse(self):
+        """
+        Returns the document with the values of the key paths
+        """
+        if self.root.end:
+            value = self._capture()
+        else:
+            value = self._value(self.root)
+        if not self.stopped and self._peek():
+            raise JsonStreamError("Extra data at byte %d" % self.size)
+        return value
+
+    def _read(self):
+        """
+        Append the next chunk to the buffer, returns False at the end
+        """
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        self.size += len(chunk)
+        if self.max_size and self.size > self.max_size:
+            raise JsonStreamError("Response body exceeds %d bytes" % self.max_size)
+        self.eof = not chunk
+        if self.mark is not None:
+            self.pieces.append(self.buffer[self.mark:self.pos])
+            self.mark = 0
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(chunk, final=self.eof)
+        self.pos = 0
+        return not self.eof or self.pos < len(self.buffer)
+
+    def _peek(self):
+        """
+        Next non-whitespace character, empty at the end of the document
+        """
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                return ''
+
+    def _expect(self, expected):
+        char = self._peek()
+        if char not in expected:
+            raise JsonStreamError("Expecting one of '%s' at byte %d, got '%s'" % (expected, self.size, char))
+        self.pos += 1
+        return char
+
+    def _string(self):
+        """
+        Skip the string at the current position, returns its JSON text
+        """
+        start = self.pos
+        while True:
+            end = _STRING_BODY.match(self.buffer, self.pos + 1).end()
+            if end < len(self.buffer) and self.buffer[end] == '"':
+                self.pos = end + 1
+                return self.buffer[start:self.pos]
+            # The string goes on in the next chunk, do not rescan its start
+            scanned = end - 1 - start
+            self.pos = start
+            if not self._read():
+                raise JsonStreamError("Unterminated string at byte %d" % self.size)
+            start = self.pos
+            self.pos = start + scanned
+
+    def _skip(self):
+        """
+        Skip the value at the current position
+        """
+        char = self._peek()
+        if char == '"':
+            self._string()
+        elif char in ('{', '['):
+            depth = 0
+            while True:
+                match = _STRUCTURE.search(self.buffer, self.pos)
+                if match is None:
+                    self.pos = len(self.buffer)
+                    if not self._read():
+                        raise JsonStreamError("Unterminated container at byte %d" % self.size)
+                    continue
+                self.pos = match.start()
+                char = match.group()
+                if char == '"':
+                    self._string()
+                    continue
+                self.pos += 1
+                depth += 1 if char in '{[' else -1
+                if depth == 0:
+                    return
+        elif char == '':
+            raise JsonStreamError("Expecting value at byte %d" % self.size)
+        else:
+            while True:
+                match = _SCALAR_END.search(self.buffer, self.pos)
+                if match is not None:
+                    self.pos = match.start()
+                    return
+                self.pos = len(self.buffer)
+                if not self._read():
+                    return
+
+    def _capture(self):
+        """
+        Build the value at the current position
+        """
+        self._peek()
+        self.mark = self.pos
+        self.pieces = []
+        try:
+            self._skip()
+            text = ''.join(self.pieces) + self.buffer[self.mark:self.pos]
+        finally:
+            self.mark = None
+        return json.loads(text)
+
+    def _value(self, node):
+        """
+        Build the parts of the value at the current position the node
+        selects. Returns early once all key paths are complete.
+        """
+        pending = self.pending
+        if node.end:
+            value = self._capture()
+        else:
+            char = self._peek()
+            if char not in ('{', '['):
+                value = self._capture()
+            else:
+                try:
+                    # Containers held by the buffer are decoded at once
+                    value, self.pos = _DECODER.raw_decode(self.buffer, self.pos)
+                except ValueError:
+                    value = self._object(node) if char == '{' else self._array(node)
+                else:
+                    value = self.selection.select(value, node)
+        if self.pending:
+            # Key paths not found below this value do not exist
+            self.pending = pending - node.points
+        return value
+
+    def _object(self, node):
+        container = StreamedObject()
+        self.pos += 1
+        if self._peek() == '}':
+            self.pos += 1
+            return container
+        while True:
+            if self._peek() != '"':
+                raise JsonStreamError("Expecting property name at byte %d" % self.size)
+            key = self._string()
+            key = json.loads(key) if '\\' in key else key[1:-1]
+            self._expect(':')
+            container.size += 1
+            child = node.children.get(key)
+            if child is None:
+                self._skip()
+            else:
+                container[key] = self._value(child)
+                if not self.pending:
+                    self.stopped = True
+                    return container
+            if self._expect(',}') == '}':
+                return container
+
+    def _array(self, node):
+        container = StreamedArray()
+        self.pos += 1
+        if self._peek() == ']':
+            self.pos += 1
+            return container
+        index = 0
+        while True:
+            child = node.children.get(index)
+            if node.wildcard is not None:
+                child = node.wildcard if child is None else self.selection.merge(child, node.wildcard)
+            if child is None:
+                self._skip()
+                container.append(None)
+            else:
+                container.append(self._value(child))
+                if not self.pending:
+                    self.stopped = True
+                    return container
+            index += 1
+            if self._expect(',]') == ']':
+                return container
+
+
+def stream_document(args, url, context, nagios):
+    """
+    Request the URL and only load the parts of its JSON document
+    the rules refer to, see JsonStreamParser
+    """
+    response = open_request(args, url, context)
+    parser = JsonStreamParser(response, args.stream_paths, max_size=args.max_body_size)
+    try:
+        start = time.monotonic()
+        data = parser.parse()
+        if args.timings is not None:
+            # Reading and parsing are interleaved, both count as download
+            args.timings.download += time.monotonic() - start
+            args.timings.size += parser.size
+    except (ValueError, zlib.error) as e:
+        if parser.max_size and parser.size > parser.max_size:
+            raise body_too_large(args, url, parser.size) from e
+        exit_code = args.invalid_json_state
+        debugTraceback(args.debug)
+        nagios.append_message(exit_code, " JSON Parser error: %s" % str(e))
+        raise CheckAbort(nagios) from e
+    finally:
+        response.close()
+
+    debugPrint(args.debug, "stream: read %s%s" % (body_size(response, parser.size), ', stopped early' if parser.stopped else ''))
+    verbosePrint(args.verbose, 1, json.dumps(data, indent=2))
+    return data
+
+
+def fetch_document(args, url, context, nagios):
+    """
+    Request the URL and load its JSON document
+    """
+    import urllib.error as urllib_error # pylint: disable=import-outside-toplevel
     json_data = ''
 
     try:
         # Requesting the data from the URL
-        json_data = make_request(args, url, context)
-    except HTTPError as e:
+        if args.cache_ttl > 0:
+            cache_dir = args.cache_dir
+            if not cache_dir:
+                import tempfile # pylint: disable=import-outside-toplevel
+                cache_dir = os.path.join(tempfile.gettempdir(), '%s-%d' % (CACHE_DIR_NAME, os.geteuid()))
+            cache = ResponseCache(cache_dir, args.cache_ttl, args.cache_max_size * 1024 * 1024)
+            json_data = cache.fetch(args, url, lambda: make_request(args, url, context))
+            if args.timings is not None:
+                # A cached response was not read by this check
+                args.timings.size = len(json_data)
+        elif args.stream:
+            return stream_document(args, url, context, nagios)
+        else:
+            json_data = make_request(args, url, context)
+    except urllib_error.HTTPError as e:
+        if args.state_file:
+            if e.code == 304 and args.state.result is not None:
+                return NOT_MODIFIED
+            args.state.update(e.headers)
         # Try to recover from HTTP Error, if there is JSON in the response
         if "json" in e.info().get_content_subtype():
-            json_data = e.read()
+            json_data = read_body(args, decode_response(args, e), url)
         else:
             exit_code = args.invalid_json_state
             nagios.append_message(exit_code, " Could not find JSON in HTTP body. HTTPError[%s], url:%s" % (str(e.code), url))
-    except URLError as e:
+    except urllib_error.URLError as e:
         # Some users might prefer another exit code if the URL wasn't reached
         exit_code = args.unreachable_state
         nagios.append_message(exit_code, " URLError[%s], url:%s" % (str(e.reason), url))
         # Since we don't got any data, we can simply exit
-        print(nagios.getMessage())
-        sys.exit(nagios.getCode())
+        raise CheckAbort(nagios) from e
+
+    # Loading the JSON data from the request
+    return parse_json(args, json_data, nagios)
+
 
+def fetch_documents(args, url, context, nagios):
+    """
+    Request several paths over one connection and load their JSON
+    documents into a NamespacedDocuments
+    """
+    import http.client as http_client # pylint: disable=import-outside-toplevel
+    import urllib.request as urllib_request # pylint: disable=import-outside-toplevel
+    data = NamespacedDocuments()
+    paths = split_paths(args.path)
+    if ('https' if args.ssl else 'http') in urllib_request.getproxies() and not urllib_request.proxy_bypass(args.host):
+        # The connection of make_requests does not go through the proxy
+        debugPrint(args.debug, "proxy: requesting every path on its own")
+        for name, path in paths:
+            data[name] = fetch_document(args, "%s/%s" % (url, path.lstrip('/')), context, nagios)
+        return data
     try:
-        # Loading the JSON data from the request
-        data = json.loads(json_data)
-    except ValueError as e:
-        exit_code = args.invalid_json_state
-        debugPrint(args.debug, traceback.format_exc())
-        nagios.append_message(exit_code, " JSON Parser error: %s" % str(e))
-        print(nagios.getMessage())
-        sys.exit(nagios.getCode())
+        responses = make_requests(args, [path for _, path in paths], context)
+    except TimeoutError as e:
+        nagios.append_message(args.unreachable_state, "  %s socket timeout after %s seconds" % (url, args.timeout))
+        raise CheckAbort(nagios) from e
+    except (OSError, http_client.HTTPException) as e:
+        nagios.append_message(args.unreachable_state, " URLError[%s], url:%s" % (str(e), url))
+        raise CheckAbort(nagios) from e
+
+    for (name, path), (status, content_subtype, json_data) in zip(paths, responses):
+        debugPrint(args.debug, "path: %s (%s) status: %s" % (path, name, status))
+        if status >= 400 and "json" not in content_subtype:
+            json_data = ''
+            nagios.append_message(args.invalid_json_state, " Could not find JSON in HTTP body. HTTPError[%s], url:%s/%s" % (status, url, path.lstrip('/')))
+        data[name] = parse_json(args, json_data, nagios)
+    return data
+
+
+def fetch(args, context, nagios):
+    """
+    Request the document of args.host, or the documents of all its paths
+    """
+    if args.ssl:
+        url = "https://%s" % args.host
     else:
-        verbosePrint(args.verbose, 1, json.dumps(data, indent=2))
+        url = "http://%s" % args.host
+    if args.port:
+        url += ":%s" % args.port
+
+    if args.path and len(args.path) > 1:
+        debugPrint(args.debug, "url: %s" % url)
+        return fetch_documents(args, url, context, nagios)
+
+    if args.path:
+        url += "/%s" % args.path[0]
+    debugPrint(args.debug, "url: %s" % url)
+    return fetch_document(args, url, context, nagios)
+
+
+class HostDocuments(list):
+    """
+    The (host, document) of every host of a multi-host check,
+    the document is a CheckAbort if the host failed
+    """
+
+
+def fetch_hosts(args, hosts, context):
+    """
+    Request the documents of all hosts concurrently, at most
+    --max-concurrency at a time
+    """
+    from concurrent import futures # pylint: disable=import-outside-toplevel
+
+    def fetch_host(host):
+        host_args = copy.copy(args)
+        host_args.host = host
+        try:
+            return host, fetch(host_args, context, NagiosHelper())
+        except CheckAbort as e:
+            return host, e
+
+    with futures.ThreadPoolExecutor(max_workers=min(args.max_concurrency, len(hosts))) as executor:
+        return HostDocuments(executor.map(fetch_host, hosts))
+
+
+def read_hosts(args):
+    """
+    Hosts of -H (comma separated) and --hosts-file
+    """
+    hosts = []
+    if args.host:
+        hosts = [host.strip() for host in args.host.split(',') if host.strip()]
+    if args.hosts_file:
+        try:
+            with open(args.hosts_file, encoding='utf-8') as hosts_file:
+                for line in hosts_file:
+                    host = line.split('#', 1)[0].strip()
+                    if host:
+                        hosts.append(host)
+        except OSError as e:
+            nagios = NagiosHelper()
+            nagios.append_message(UNKNOWN_CODE, " Could not read hosts file %s: %s" % (args.hosts_file, str(e)))
+            raise CheckAbort(nagios) from e
+    if not hosts:
+        nagios = NagiosHelper()
+        nagios.append_message(UNKNOWN_CODE, " No host to query.")
+        raise CheckAbort(nagios)
+    return hosts
+
+
+def main(cliargs):
+    """
+    Main entrypoint for CLI
+    """
+
+    start = Profile.now()
+    args = parseArgs(cliargs)
+
+    if args.version:
+        print('Version: %s - Date: %s' % (__version__, __version_date__))
+        sys.exit(0)
+
+    if args.daemon:
+        serve(args)
+        sys.exit(0)
+
+    if args.profile:
+        args.profiler = Profile(start, args.profile_top)
+        args.profiler.phase('arguments')
+    profiler = None
+    if args.profile_file:
+        import cProfile # pylint: disable=import-outside-toplevel
+        profiler = cProfile.Profile()
+        profiler.enable()
 
     try:
-        # Applying rules to returned JSON data
-        processor = JsonRuleProcessor(data, args)
-        nagios.append_message(WARNING_CODE, processor.checkWarning())
-        nagios.append_message(CRITICAL_CODE, processor.checkCritical())
-        nagios.append_metrics(processor.checkMetrics())
-        nagios.append_message(UNKNOWN_CODE, processor.checkUnknown())
+        code = check(args)
+    except CheckAbort as e:
+        # Print Nagios specific string of a failed check
+        print(e.nagios.getMessage(max_length=args.max_output_length))
+        code = e.nagios.getCode()
+        if args.passive is not None and not args.passive.results:
+            # The services of the hosts are not checked, submit why
+            args.passive.addAll(e.nagios)
+            try:
+                args.passive.submit()
+            except OSError as error:
+                print("Could not submit passive results: %s" % str(error), file=sys.stderr)
+        profile_phase(args, 'abort')
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile_file)
+    if args.profiler is not None:
+        print(args.profiler.report(args.timings), file=sys.stderr)
+
+    sys.exit(code)
+
+
+def check(args):
+    """
+    Request the data, apply the rules and print the results.
+    Returns the exit code.
+    """
+    if args.timing or args.profile:
+        args.timings = Timings()
+    for option, text in (('--timing-warning', args.timing_warning), ('--timing-critical', args.timing_critical)):
+        try:
+            if text is not None:
+                parseRange(text)
+        except ValueError as e:
+            nagios = NagiosHelper()
+            nagios.append_message(UNKNOWN_CODE, " Invalid threshold %s %s: %s" % (option, text, str(e)))
+            raise CheckAbort(nagios) from e
+
+    rule_sets = None
+    if args.batch:
+        check_batch_options(args)
+        try:
+            rule_sets = parse_rule_sets(args, read_batch(args.batch))
+        except (OSError, ValueError) as e:
+            nagios = NagiosHelper()
+            nagios.append_message(UNKNOWN_CODE, " Could not read batch file %s: %s" % (args.batch, str(e)))
+            raise CheckAbort(nagios) from e
+        if not rule_sets:
+            nagios = NagiosHelper()
+            nagios.append_message(UNKNOWN_CODE, " No rule set in batch file %s." % args.batch)
+            raise CheckAbort(nagios)
+    else:
+        # Invalid rules are reported before any request is made
+        try:
+            args.plan = RulePlan(args)
+            check_namespaces(args, args.plan)
+        except ValueError as e:
+            nagios = NagiosHelper()
+            nagios.append_message(UNKNOWN_CODE, " Invalid rule %s" % str(e))
+            raise CheckAbort(nagios) from e
+
+    if args.checkresults_dir or args.command_file:
+        if rule_sets is None and not args.passive_service:
+            nagios = NagiosHelper()
+            nagios.append_message(UNKNOWN_CODE, " --passive-service is required to submit passive results without --batch.")
+            raise CheckAbort(nagios)
+        services = [args.passive_service] if rule_sets is None else [name for name, _, _ in rule_sets]
+        args.passive = PassiveResults(args, services)
+
+    if args.stream:
+        if args.cache_ttl > 0:
+            nagios = NagiosHelper()
+            nagios.append_message(UNKNOWN_CODE, " --stream does not apply to cached responses (--cache-ttl).")
+            raise CheckAbort(nagios)
+        if rule_sets is None:
+            args.stream_paths = rule_paths([args])
+        else:
+            args.stream_paths = rule_paths([rules for _, _, rules in rule_sets if rules is not None])
+
+    hosts = read_hosts(args)
+    if args.passive is not None:
+        if args.passive_host and len(hosts) > 1:
+            nagios = NagiosHelper()
+            nagios.append_message(UNKNOWN_CODE, " --passive-host only applies to a single host.")
+            raise CheckAbort(nagios)
+        args.passive.hosts = hosts
+    context = None
+    if args.ssl:
+        context = prepare_context(args)
+
+    if rule_sets is not None or len(hosts) > 1 or (args.path and len(args.path) > 1):
+        for option, enabled in (('--state-file', args.state_file), ('--timing', args.timing)):
+            if enabled:
+                nagios = NagiosHelper()
+                nagios.append_message(UNKNOWN_CODE, " %s only applies to a single host and path without --batch." % option)
+                raise CheckAbort(nagios)
+        # The phases of several requests are not profiled
+        args.timings = None
+    if args.path and len(args.path) > 1:
+        for option, enabled in (('--retries', args.retries), ('--hedge-after', args.hedge_after),
+                                ('--stream', args.stream), ('--cache-ttl', args.cache_ttl)):
+            if enabled:
+                nagios = NagiosHelper()
+                nagios.append_message(UNKNOWN_CODE, " %s does not apply to multiple paths." % option)
+                raise CheckAbort(nagios)
+
+    if args.state_file:
+        args.host = hosts[0]
+        args.state = CheckState.load(args)
+    profile_phase(args, 'setup')
+
+    if len(hosts) > 1:
+        data = fetch_hosts(args, hosts, context)
+    else:
+        args.host = hosts[0]
+        data = fetch(args, context, NagiosHelper())
+    profile_phase(args, 'fetch')
+
+    if rule_sets is not None:
+        code = check_batch(args, data, rule_sets)
+        submit_passive(args)
+        profile_phase(args, 'evaluate and output')
+        return code
+
+    # Applying rules to returned JSON data
+    start = time.monotonic()
+    if args.state_file:
+        nagios = evaluate_conditional(args, data)
+    else:
+        nagios = evaluate(args, args, data)
+
+    if args.timing:
+        args.timings.eval = time.monotonic() - start
+        check_timings(args, nagios)
+    profile_phase(args, 'evaluate')
+
+    if args.passive is not None and not isinstance(data, HostDocuments):
+        args.passive.add(args.host, args.passive_service, nagios)
+    submit_passive(args)
+
+    # Print Nagios specific string
+    print(nagios.getMessage(max_length=args.max_output_length))
+    profile_phase(args, 'output')
+    return nagios.getCode()
+
+
+def submit_passive(args):
+    """
+    Submit the passive results of the run, if any
+    """
+    if args.passive is None:
+        return
+    try:
+        args.passive.submit()
+    except OSError as e:
+        nagios = NagiosHelper()
+        nagios.append_message(UNKNOWN_CODE, " Could not submit passive results: %s" % str(e))
+        raise CheckAbort(nagios) from e
+
+
+def check_timings(args, nagios):
+    """
+    Add the performance data of --timing and apply the thresholds
+    of the total time
+    """
+    total = time.monotonic() - args.timings.start
+    for state, r in ((WARNING_CODE, args.timing_warning), (CRITICAL_CODE, args.timing_critical)):
+        reason = r and JsonRuleProcessor.checkThreshold(round(total, 6), 'time', r)
+        if reason:
+            nagios.append_message(state, [RuleFailure(state, 'time', 'time', round(total, 6), reason)])
+    nagios.performance_data += args.timings.getPerformanceData(total, args.timing_warning, args.timing_critical)
+
+
+def evaluate(args, rules, data, service=None):
+    """
+    Apply the rules to the data of a single or a multi-host check,
+    returns the NagiosHelper with the results
+    """
+    if isinstance(data, HostDocuments):
+        return check_quorum(args, rules, data, service or args.passive_service)
+    return apply_rules(data, rules, NagiosHelper())
+
+
+def evaluate_conditional(args, data):
+    """
+    Apply the rules of a check with a --state-file. The result of all but
+    the time relative rules is saved and reused while the response is not
+    modified, the time relative rules are applied on every run.
+    """
+    if data is NOT_MODIFIED:
+        debugPrint(args.debug, "state: not modified, reusing the last result")
+        nagios = args.state.restore()
+        times = args.state.times
+    else:
+        rules = copy.copy(args)
+        rules.plan = copy.copy(args.plan)
+        for name in TIME_RULES:
+            setattr(rules, name, None)
+            setattr(rules.plan, name, None)
+        nagios = apply_rules(data, rules, NagiosHelper())
+        times = None
+        if args.key_time_list is not None or args.key_time_list_critical is not None:
+            time_rules = argparse.Namespace(separator=args.separator, **{name: getattr(args, name) for name in TIME_RULES})
+            times = KeySelection(rule_paths([time_rules])).select(data)
+        args.state.save(nagios, times, args.debug)
+    return check_times(times, args, nagios)
+
+
+def check_times(data, rules, nagios):
+    """
+    Apply the time relative rules to the JSON data
+    """
+    if rules.key_time_list is None and rules.key_time_list_critical is None:
+        return nagios
+    try:
+        processor = JsonRuleProcessor(data, rules)
+        if processor.plan.key_time_list is not None:
+            nagios.append_message(WARNING_CODE, processor.checkTimestamps(processor.plan.key_time_list, WARNING_CODE))
+        if processor.plan.key_time_list_critical is not None:
+            nagios.append_message(CRITICAL_CODE, processor.checkTimestamps(processor.plan.key_time_list_critical, CRITICAL_CODE))
+    except Exception as e: # pylint: disable=broad-exception-caught
+        debugTraceback(rules.debug)
+        nagios.append_message(UNKNOWN_CODE, " Rule Parser error: %s" % str(e))
+    return nagios
+
+
+def check_quorum(args, rules, documents, service=None):
+    """
+    Apply the rules to the document of every host, the state is decided
+    by how many hosts are in which state:
+    CRITICAL if more than --quorum-critical hosts are CRITICAL or UNKNOWN
+    (UNKNOWN if none of them is CRITICAL), otherwise WARNING if more than
+    --quorum-warning hosts are not OK.
+    """
+    counts = dict.fromkeys(NagiosHelper.message_prefixes, 0)
+    details = ''
+    performance_data = ''
+    for host, data in documents:
+        if isinstance(data, CheckAbort):
+            host_nagios = data.nagios
+        else:
+            host_nagios = apply_rules(data, rules, NagiosHelper(), metric_prefix='%s:' % host)
+        if args.passive is not None:
+            args.passive.add(host, service, host_nagios)
+        host_code = host_nagios.getCode()
+        counts[host_code] += 1
+        performance_data += host_nagios.performance_data
+        if host_code != OK_CODE:
+            message = host_nagios.warning_message + host_nagios.critical_message + host_nagios.unknown_message
+            details += " [%s] %s" % (host, message.strip())
+
+    failed = counts[CRITICAL_CODE] + counts[UNKNOWN_CODE]
+    code = OK_CODE
+    if failed > args.quorum_critical:
+        code = CRITICAL_CODE if counts[CRITICAL_CODE] else UNKNOWN_CODE
+    elif failed + counts[WARNING_CODE] > args.quorum_warning:
+        code = WARNING_CODE
+
+    nagios = NagiosHelper()
+    for state, count in counts.items():
+        nagios.performance_data += "'hosts_%s'=%d;;;0;%d " % (
+            NagiosHelper.message_prefixes[state].lower(), count, len(documents))
+    nagios.performance_data += performance_data
+    message = " %d of %d hosts not OK (%d WARNING, %d CRITICAL, %d UNKNOWN).%s" % (
+        len(documents) - counts[OK_CODE], len(documents),
+        counts[WARNING_CODE], counts[CRITICAL_CODE], counts[UNKNOWN_CODE], details)
+    if code == OK_CODE:
+        # The hosts that are not OK are still reported within the quorum
+        if details:
+            nagios.ok_message = message
+    else:
+        nagios.append_message(code, message)
+    return nagios
+
+
+def apply_rules(data, rules, nagios, metric_prefix=''):
+    """
+    Apply the rules to the JSON data and add the results to the NagiosHelper
+    """
+    try:
+        processor = JsonRuleProcessor(data, rules, metric_prefix)
+        nagios.append_message(WARNING_CODE, processor.warningFailures())
+        nagios.append_message(CRITICAL_CODE, processor.criticalFailures())
+        nagios.append_metrics(processor.metricFailures())
+        nagios.append_message(UNKNOWN_CODE, processor.unknownFailures())
     except Exception as e: # pylint: disable=broad-exception-caught
-        debugPrint(args.debug, traceback.format_exc())
+        debugTraceback(rules.debug)
         nagios.append_message(UNKNOWN_CODE, " Rule Parser error: %s" % str(e))
+    return nagios
+
+
+def read_batch(path):
+    """
+    Read the named rule sets of a batch file.
+    Empty lines and comments starting with # are skipped.
+    """
+    rule_sets = []
+    with open(path, encoding='utf-8') as batch_file:
+        for line in batch_file:
+            tokens = shlex.split(line, comments=True)
+            if tokens:
+                rule_sets.append((tokens[0], tokens[1:]))
+    return rule_sets
+
+
+def check_batch_options(args):
+    """
+    Rules only apply with --batch if they are part of a rule set,
+    rule options on the command line are an error
+    """
+    options = [option for name, option, _ in RulePlan.options if getattr(args, name) is not None]
+    options += [option for name, option in (('metric_value_mapping', '-M'), ('separator', '-f'), ('value_separator', '-F'))
+                if getattr(args, name)]
+    if options:
+        nagios = NagiosHelper()
+        nagios.append_message(UNKNOWN_CODE, " %s only apply to the rule sets of the batch file with --batch." % ', '.join(options))
+        raise CheckAbort(nagios)
+
+
+def parse_rule_sets(args, rule_sets):
+    """
+    Parse the arguments of the named rule sets into (name, error, rules),
+    the rules of an invalid rule set are None and its error the reason
+    """
+    parsed = []
+    for name, rule_args in rule_sets:
+        try:
+            rules = parseRuleArgs(rule_args)
+        except ArgumentError as e:
+            parsed.append((name, "Invalid rule arguments %s: %s" % (' '.join(rule_args), str(e)), None))
+            continue
+        try:
+            rules.plan = RulePlan(rules)
+            check_namespaces(args, rules.plan)
+        except ValueError as e:
+            parsed.append((name, "Invalid rule %s" % str(e), None))
+            continue
+        rules.debug = args.debug
+        rules.profiler = args.profiler
+        parsed.append((name, None, rules))
+    return parsed
+
+
+def check_batch(args, data, rule_sets):
+    """
+    Evaluate every parsed rule set against the same JSON data and print
+    one result per rule set. Returns the worst exit code.
+    """
+    code = OK_CODE
+    for name, error, rules in rule_sets:
+        nagios = NagiosHelper()
+        if rules is None:
+            nagios.append_message(UNKNOWN_CODE, " %s" % error)
+            if args.passive is not None:
+                args.passive.addAll(nagios, [name])
+        else:
+            nagios = evaluate(args, rules, data, name)
+            if args.passive is not None and not isinstance(data, HostDocuments):
+                args.passive.add(args.host, name, nagios)
+        print("%s: %s" % (name, nagios.getMessage(max_length=args.max_output_length)))
+        code = max(code, nagios.getCode())
+    return code
+
+
+def run_check(cliargs):
+    """
+    Run a check in this process, returns its exit code, stdout and stderr
+    """
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = io.StringIO(), io.StringIO()
+    code = 0
+    try:
+        main(cliargs)
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except Exception: # pylint: disable=broad-exception-caught
+        import traceback # pylint: disable=import-outside-toplevel
+        traceback.print_exc()
+        code = 1
+    finally:
+        output = (sys.stdout.getvalue(), sys.stderr.getvalue())
+        sys.stdout, sys.stderr = stdout, stderr
+    return (code,) + output
+
+
+def run_request(request):
+    """
+    Run the check of a request of the client in the working directory and
+    environment of the client, so that relative paths and proxy variables
+    resolve as if the check was run directly. Only called in the process
+    forked for the request.
+    """
+    try:
+        request = json.loads(request)
+        cliargs, cwd, environment = list(request['args']), request['cwd'], dict(request['env'])
+    except (ValueError, LookupError, TypeError) as e:
+        return UNKNOWN_CODE, 'UNKNOWN: Status UNKNOWN. Invalid request: %s\n' % str(e), ''
+    if '--daemon' in cliargs:
+        return UNKNOWN_CODE, 'UNKNOWN: Status UNKNOWN. Already running as daemon.\n', ''
+    try:
+        os.chdir(cwd)
+    except OSError as e:
+        return UNKNOWN_CODE, 'UNKNOWN: Status UNKNOWN. Could not change to the directory %s: %s\n' % (cwd, str(e)), ''
+    os.environ.clear()
+    os.environ.update(environment)
+    return run_check(cliargs)
+
+
+def prepare_request_context(request):
+    """
+    Build the TLS context of the TLS options of a request in the daemon,
+    the checks forked later for requests with the same options reuse it.
+    Invalid requests and options are left to the check to report.
+    """
+    import contextlib # pylint: disable=import-outside-toplevel
+    try:
+        request = json.loads(request)
+        cwd = request['cwd']
+        with contextlib.redirect_stderr(io.StringIO()), contextlib.redirect_stdout(io.StringIO()):
+            args = parseArgs(list(request['args']))
+    except (ValueError, LookupError, TypeError, SystemExit):
+        return
+    if not args.ssl or not isinstance(cwd, str):
+        return
+    for option in ('cacert', 'cert', 'key'):
+        if getattr(args, option):
+            setattr(args, option, os.path.join(cwd, getattr(args, option)))
+    args.debug = False
+    try:
+        prepare_context(args)
+    except (CheckAbort, OSError):
+        pass
+
+
+@functools.lru_cache(maxsize=None)
+def _serverClasses():
+    """
+    The request handler and server classes of the daemon
+    """
+    import socketserver # pylint: disable=import-outside-toplevel
+
+    class CheckRequestHandler(socketserver.StreamRequestHandler):
+        """
+        Execute one check request received from check_http_json_client.py.
+
+        The request is a JSON object with the arguments (args), working
+        directory (cwd) and environment (env) of the client, the response is
+        "<exit code> <stdout length>\n" followed by stdout and stderr.
+        """
+
+        def handle(self):
+            code, stdout, stderr = run_request(self.server.request_data)
+            stdout, stderr = stdout.encode(), stderr.encode()
+            self.wfile.write(b'%d %d\n' % (code, len(stdout)) + stdout + stderr)
+
+
+    class CheckServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+        """
+        Forks a child per check request, the child already has every module
+        imported so no interpreter startup is paid per check
+        """
+
+        request_data = b''
+
+        def process_request(self, request, client_address):
+            # The request is read before forking, so that the TLS context
+            # of its options is built once for the later checks
+            chunks = []
+            request.settimeout(REQUEST_TIMEOUT)
+            try:
+                while True:
+                    chunk = request.recv(65536)
+                    if not chunk:
+                        break
+                    chunks.append(chunk)
+            except OSError:
+                self.shutdown_request(request)
+                return
+            request.settimeout(None)
+            self.request_data = b''.join(chunks)
+            prepare_request_context(self.request_data)
+            super().process_request(request, client_address)
+
+    return CheckRequestHandler, CheckServer
+
+
+def __getattr__(name):
+    """
+    The classes built on modules imported on first use
+    """
+    if name in ('CheckSSLSocket', 'CheckSSLContext'):
+        return dict(zip(('CheckSSLSocket', 'CheckSSLContext'), _sslClasses()))[name]
+    if name in ('CheckRequestHandler', 'CheckServer'):
+        return dict(zip(('CheckRequestHandler', 'CheckServer'), _serverClasses()))[name]
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+def preload():
+    """
+    Import everything a check may use, the checks forked by the daemon
+    then start with all modules loaded
+    """
+    # pylint: disable=import-outside-toplevel,unused-import
+    import concurrent.futures, cProfile, hashlib, http.client, tempfile, traceback, urllib.error, urllib.request
+    from datetime import datetime, timezone
+    _sslClasses()
+
+
+def default_socket():
+    """
+    The socket of the daemon in the runtime directory of the user, or in
+    a directory of the user in the temporary directory, never directly in
+    a directory others can create a socket in
+    """
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, SOCKET_NAME)
+    return os.path.join(os.environ.get('TMPDIR') or '/tmp', 'check_http_json-%d' % os.getuid(), SOCKET_NAME)
+
+
+def serve(args):
+    """
+    Listen on the Unix socket and execute check requests concurrently
+    """
+    directory = os.path.dirname(os.path.abspath(args.socket))
+    if not os.path.isdir(directory):
+        os.makedirs(directory, mode=0o700)
+    try:
+        status = os.lstat(args.socket)
+    except FileNotFoundError:
+        pass
+    else:
+        # Only the socket of an earlier daemon of this user is replaced
+        if not stat.S_ISSOCK(status.st_mode) or status.st_uid != os.getuid():
+            sys.exit('%s is not a socket of this user, it is not replaced' % args.socket)
+        os.unlink(args.socket)
+    debugPrint(args.debug, "socket: %s" % args.socket)
+    preload()
+    # Build the TLS context once, the checks forked with the same TLS settings reuse it
+    prepare_context(args)
+    handler_class, server_class = _serverClasses()
+    with server_class(args.socket, handler_class) as server:
+        os.chmod(args.socket, 0o600)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(args.socket)
 
-    # Print Nagios specific string and exit appropriately
-    print(nagios.getMessage())
-    sys.exit(nagios.getCode())
 
 if __name__ == "__main__":
     # Program entry point
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+Client for check_http_json.py --daemon
+
+Forwards its arguments, working directory and environment to the daemon
+and reproduces the stdout, stderr and exit code of check_http_json.py.
+When no daemon is listening, the check is executed by check_http_json.py
+directly.
+
+The socket can be changed with the CHECK_HTTP_JSON_SOCKET environment
+variable. Only a socket of the user running the client is used.
+"""
+
+import json
+import os
+import socket
+import stat
+import sys
+
+SOCKET_NAME = 'check_http_json.sock'
+
+
+def default_socket():
+    """
+    The socket of the daemon, see default_socket of check_http_json.py
+    """
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, SOCKET_NAME)
+    return os.path.join(os.environ.get('TMPDIR') or '/tmp', 'check_http_json-%d' % os.getuid(), SOCKET_NAME)
+
+
+def unknown(message):
+    print('UNKNOWN: Status UNKNOWN. %s' % message)
+    sys.exit(3)
+
+
+def main(cliargs):
+    """
+    Main entrypoint for CLI
+    """
+    path = os.environ.get('CHECK_HTTP_JSON_SOCKET') or default_socket()
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        status = os.stat(path)
+        # The arguments may hold credentials, they are only sent to a daemon of this user
+        if stat.S_ISSOCK(status.st_mode) and status.st_uid != os.getuid():
+            unknown('Socket %s of the check_http_json daemon is not owned by this user' % path)
+        client.connect(path)
+    except OSError:
+        client.close()
+        plugin = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'check_http_json.py')
+        os.execv(sys.executable, [sys.executable, plugin] + cliargs)
+
+    request = {'args': cliargs, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+    with client:
+        client.sendall(json.dumps(request).encode())
+        client.shutdown(socket.SHUT_WR)
+        response = bytearray()
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+
+    header, _, body = bytes(response).partition(b'\n')
+    if not header:
+        unknown('No response from check_http_json daemon on %s' % path)
+    try:
+        code, length = (int(field) for field in header.split())
+        if not 0 <= length <= len(body):
+            raise ValueError(length)
+        stdout, stderr = body[:length].decode(), body[length:].decode()
+    except ValueError:
+        unknown('Invalid response from check_http_json daemon on %s' % path)
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    # Program entry point
+    main(sys.argv[1:])
+
+#EOF
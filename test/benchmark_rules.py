@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks of JsonHelper and JsonRuleProcessor
+
+Generates synthetic documents (deep nesting, wide objects and arrays of
+10^3 to 10^6 elements) and times key lookups, wildcard expansion, each rule
+type and full rule processor runs on them. Reports the operations per
+second and the peak memory of an operation, and compares the time of an
+operation with a stored baseline. Exits with 1 if a benchmark is slower than
+its baseline by more than the tolerance.
+
+The baseline holds the times relative to a fixed pure Python calibration
+workload timed in the same run, not absolute timings, so that it can be
+compared on other machines.
+
+Runs offline, the documents are built in memory. The arrays of 10^6
+elements take minutes and are only generated with --max-size 1000000.
+
+Usage: python3 test/benchmark_rules.py [--max-size N] [--tolerance X]
+                                       [--filter TEXT] [--save-baseline]
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from check_http_json import JsonHelper, JsonRuleProcessor, RulePlan, parseArgs # pylint: disable=wrong-import-position
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+ARRAY_SIZES = (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6)
+CALIBRATION_ITEMS = [{'id': index, 'value': index % 100} for index in range(1000)]
+
+
+def deep_document(depth):
+    """
+    {"level": {"level": ... {"value": 1}}} nested depth times
+    """
+    document = {'value': 1, 'status': 'ok'}
+    for _ in range(depth):
+        document = {'level': document}
+    return document
+
+
+def wide_document(width):
+    """
+    An object with width keys key0 ... keyN
+    """
+    return {'key%d' % index: index for index in range(width)}
+
+
+def array_document(size):
+    """
+    {"items": [{"id": 0, "value": 0, "status": "ok", "updated": ...}, ...]}
+    """
+    return {'items': [{'id': index, 'value': index % 100, 'status': 'ok',
+                       'updated': '2000-01-01T00:00:00+00:00'} for index in range(size)],
+            'count': size}
+
+
+def cluster_document(nodes, metrics):
+    """
+    {"cluster": {"nodes": [{"stats": {"metric0": 0, ...}}, ...]}}, many keys under a deep prefix
+    """
+    return {'cluster': {'name': 'c1', 'nodes': [
+        {'stats': {'metric%d' % metric: metric for metric in range(metrics)}} for _ in range(nodes)]}}
+
+
+def rules(*args):
+    """
+    Parsed rules with their plan compiled, as check() does before fetching
+    """
+    rule_args = parseArgs(['-H', 'localhost'] + list(args))
+    rule_args.plan = RulePlan(rule_args)
+    return rule_args
+
+
+def helper(document):
+    return JsonHelper(document, '.', ':')
+
+
+def processor_run(document, rule_args):
+    """
+    A full run of the rule processor as evaluate() performs it
+    """
+    processor = JsonRuleProcessor(document, rule_args)
+    return (processor.warningFailures(), processor.criticalFailures(),
+            processor.unknownFailures(), processor.metricFailures())
+
+
+def benchmarks(max_size):
+    """
+    Yield (name, operation) of all benchmarks on documents up to max_size.
+    The rules are parsed up front, an operation times the processor only.
+    """
+    deep_key = '.'.join(['level'] * 100) + '.value'
+    deep = deep_document(100)
+    yield 'get deep 100', lambda: helper(deep).get(deep_key)
+
+    for width in (10 ** 3, 10 ** 5):
+        if width > max_size:
+            continue
+        wide = wide_document(width)
+        yield 'get wide %d' % width, lambda wide=wide, width=width: helper(wide).get('key%d' % (width - 1))
+
+    # Rule types on scalar keys, without an array walk
+    small = array_document(10)
+    for name, rule_args in (
+            ('exists', rules('-e', 'count', '-E', 'items(0).id')),
+            ('equality', rules('-q', 'items(0).status,ok', '-Q', 'items(1).status,ok:up')),
+            ('non-equality', rules('-y', 'items(0).status,down', '-Y', 'items(1).status,failed')),
+            ('threshold', rules('-w', 'count,100', '-c', 'items(0).value,@10:20')),
+            ('timestamp', rules('--key_time', 'items(0).updated,1d')),
+            ('metrics', rules('-m', 'count', 'items(0).value,,10,20,0,100'))):
+        yield 'rule %s' % name, lambda rule_args=rule_args: processor_run(small, rule_args)
+
+    # Hundreds of keys sharing the prefix cluster.nodes(N).stats
+    cluster = cluster_document(10, 30)
+    keys = ['cluster.nodes(%d).stats.metric%d' % (node, metric) for node in range(10) for metric in range(30)]
+    cluster_rules = rules('-w', *['%s,0:100' % key for key in keys[0::3]],
+                          '-q', *['%s,%s' % (key, key.rsplit('metric', 1)[1]) for key in keys[1::3]],
+                          '-m', *keys[2::3])
+    yield 'processor 300 prefixed keys', lambda: processor_run(cluster, cluster_rules)
+
+    yield 'checkThreshold', lambda: JsonRuleProcessor.checkThreshold(50, 'value', '@10:20')
+
+    for size in ARRAY_SIZES:
+        if size > max_size:
+            continue
+        document = array_document(size)
+        yield 'get index %d' % size, lambda document=document, size=size: helper(document).get('items(%d).value' % (size - 1))
+        yield 'expandKey (*) %d' % size, lambda document=document: sum(1 for _ in helper(document).expandKey('items(*).value'))
+        for name, rule_args in (
+                ('rule threshold (*)', rules('-w', 'items(*).value,0:100')),
+                ('rule equality (*)', rules('-q', 'items(*).status,ok')),
+                ('rule equality (?)', rules('-q', 'items(?status!=ok).status,ok')),
+                ('rule metrics (*)', rules('-m', 'items(*).value,,50,90')),
+                ('processor', rules('-e', 'count', '-q', 'items(0).status,ok', '-c', 'count,@0',
+                                    '-w', 'items(*).value,0:100', '-m', 'count', 'items(%d).value' % (size - 1)))):
+            yield '%s %d' % (name, size), lambda document=document, rule_args=rule_args: processor_run(document, rule_args)
+
+
+def calibration():
+    """
+    A fixed pure Python workload of dictionary lookups, comparisons and
+    string formatting like the rules perform. Its time is the unit of the
+    baseline.
+    """
+    return ''.join(['%d ' % item['id'] for item in CALIBRATION_ITEMS if 10 <= item['value'] <= 90])
+
+
+def measure(operation, repeat):
+    """
+    The time of an operation in seconds, the best of repeat batches of
+    runs taking at least 0.2 seconds each. The best batch is the least
+    disturbed by other processes.
+    """
+    timer = timeit.Timer(operation)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def peak_memory(operation):
+    """
+    The peak memory allocated during one run of an operation in bytes
+    """
+    tracemalloc.start()
+    try:
+        operation()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def load_baseline():
+    if not os.path.exists(BASELINE):
+        return {}
+    with open(BASELINE, encoding='utf-8') as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get('python') != platform.python_version():
+        print('Baseline was recorded with Python %s, running %s' % (baseline.get('python'), platform.python_version()))
+    return baseline.get('relative', {})
+
+
+def save_baseline(results, unit):
+    baseline = {
+        'python': platform.python_version(),
+        'unit': 'calibration',
+        'relative': {name: round(1 / ops / unit, 4) for name, ops, _ in results},
+    }
+    with open(BASELINE, 'w', encoding='utf-8') as baseline_file:
+        json.dump(baseline, baseline_file, indent=2)
+        baseline_file.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of JsonHelper and JsonRuleProcessor')
+    parser.add_argument('--max-size', type=int, default=10 ** 5,
+                        help='Largest generated array or object, up to %d (default: 100000)' % max(ARRAY_SIZES))
+    parser.add_argument('--repeat', type=int, default=5, help='Timed batches per benchmark (default: 5)')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed slowdown against the baseline, 0.25 for 25%% fewer ops/sec (default: 0.25)')
+    parser.add_argument('--filter', help='Only run the benchmarks whose name contains this text')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store the results as the new baseline instead of comparing with it')
+    options = parser.parse_args()
+
+    baseline = {} if options.save_baseline else load_baseline()
+    unit = measure(calibration, options.repeat)
+    results = []
+    regressed = False
+    print('%-28s %14s %14s %10s' % ('benchmark', 'ops/sec', 'peak memory', 'baseline'))
+    for name, operation in benchmarks(options.max_size):
+        if options.filter and options.filter not in name:
+            continue
+        ops = 1 / measure(operation, options.repeat)
+        memory = peak_memory(operation)
+        results.append((name, ops, memory))
+
+        comparison = ''
+        if name in baseline:
+            change = baseline[name] / (1 / ops / unit) - 1
+            comparison = '%+6.1f%%' % (change * 100)
+            if change < -options.tolerance:
+                comparison += ' REGRESSION'
+                regressed = True
+        print('%-28s %14.1f %11.1f KB %10s' % (name, ops, memory / 1024, comparison))
+
+    if options.save_baseline:
+        save_baseline(results, unit)
+        print('Baseline saved to %s' % BASELINE)
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
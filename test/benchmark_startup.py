@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark of check_http_json.py
+
+Runs representative invocations of the plugin in fresh interpreters and
+reports the median time from interpreter start to exit, along with the
+slowest imports of python -X importtime. Exits with 1 if the median of an
+invocation exceeds its budget.
+
+Usage: python3 test/benchmark_startup.py [--runs N] [--budget-scale X]
+"""
+
+import argparse
+import http.server
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN = os.path.join(ROOT, 'check_http_json.py')
+TLS = os.path.join(ROOT, 'test', 'tls')
+
+# Name, plugin arguments and budget of the median startup time in ms
+INVOCATIONS = (
+    ('version', ['-V'], 100),
+    ('http', ['-H', '{http}', '-q', 'status,ok', '-m', 'depth'], 200),
+    ('https', ['-H', '{https}', '-s', '-k', '-q', 'status,ok', '-m', 'depth'], 250),
+    ('key_time', ['-H', '{http}', '-q', 'status,ok', '--key_time', 'updated,1d'], 200),
+)
+
+
+class JsonHandler(http.server.BaseHTTPRequestHandler):
+    body = b'{"status": "ok", "depth": 5, "updated": "2000-01-01T00:00:00"}'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+
+def start_server(tls=False):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), JsonHandler)
+    if tls:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(os.path.join(TLS, 'cert.pem'), os.path.join(TLS, 'key.pem'))
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, '127.0.0.1:%d' % server.server_address[1]
+
+
+def run(args, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [PLUGIN] + args
+    start = time.perf_counter()
+    process = subprocess.run(command, capture_output=True, text=True, check=False)
+    return (time.perf_counter() - start) * 1000, process
+
+
+def slowest_imports(stderr, count):
+    """
+    The top level imports with the longest cumulative time in ms
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            imports.append((int(cumulative) / 1000, name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup benchmark of check_http_json.py')
+    parser.add_argument('--runs', type=int, default=20, help='Runs per invocation (default: 20)')
+    parser.add_argument('--imports', type=int, default=5, help='Slowest imports shown per invocation (default: 5)')
+    parser.add_argument('--budget-scale', type=float, default=1.0,
+                        help='Multiply the budgets, for slower machines (default: 1.0)')
+    options = parser.parse_args()
+
+    http_server, http_host = start_server()
+    https_server, https_host = start_server(tls=True)
+    over_budget = False
+    try:
+        for name, args, budget in INVOCATIONS:
+            args = [arg.format(http=http_host, https=https_host) for arg in args]
+            # Warm up the caches of the imported modules
+            run(args)
+            timings = [run(args)[0] for _ in range(options.runs)]
+            median = statistics.median(timings)
+            budget *= options.budget_scale
+            status = 'ok' if median <= budget else 'OVER BUDGET'
+            over_budget = over_budget or median > budget
+            print('%-10s median %6.1f ms  min %6.1f ms  budget %6.1f ms  %s' % (
+                name, median, min(timings), budget, status))
+
+            _, process = run(args, importtime=True)
+            for cumulative, module in slowest_imports(process.stderr, options.imports):
+                print('%10s %8.1f ms  %s' % ('', cumulative, module))
+    finally:
+        http_server.shutdown()
+        https_server.shutdown()
+
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Fixtures shared by the tests: a mocked urlopen response, a quiet JSON
+request handler and a test case serving it on a local port.
+"""
+
+import http.server
+import io
+import threading
+import unittest
+import unittest.mock as mock
+import sys
+
+sys.path.append('..')
+
+from check_http_json import main # pylint: disable=wrong-import-position
+
+
+class MockResponse(io.BytesIO):
+    """
+    Response of a mocked urllib.request.urlopen, with a Content-Length
+    header if length is given
+    """
+
+    def __init__(self, content=b'{"foo": "bar"}', length=None):
+        super().__init__(content.encode() if isinstance(content, str) else content)
+        self.headers = {}
+        if length is not None:
+            self.headers['Content-Length'] = str(length)
+
+
+class JsonHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the document of the handler class and does not log the requests
+    """
+    protocol_version = 'HTTP/1.1'
+    document = b'{}'
+
+    def do_GET(self):
+        self.send_body(self.document)
+
+    def send_body(self, body, status=200, headers=(), content_type='application/json'):
+        """
+        Send a complete response with the body and extra headers
+        """
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for header, value in headers:
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+
+class ServerTestCase(unittest.TestCase):
+    """
+    Serves the handler of the test class on a local port during each
+    test, self.host is its address. Without a handler the tests start
+    their servers with start_server.
+    """
+    handler = JsonHandler
+
+    def setUp(self):
+        if self.handler is not None:
+            self.server = self.start_server(self.handler)
+            self.host = '127.0.0.1:%d' % self.server.server_address[1]
+
+    def start_server(self, handler, context=None):
+        """
+        Serve a handler until the end of the test, over TLS with a context
+        """
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.daemon_threads = True
+        if context is not None:
+            server.socket = context.wrap_socket(server.socket, server_side=True)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.addCleanup(stop)
+        return server
+
+    def run_check(self, args):
+        """
+        Run the check, returns its exit code and the mocked print
+        """
+        with mock.patch('builtins.print') as mock_print:
+            with self.assertRaises(SystemExit) as test:
+                main(args)
+        return test.exception.code, mock_print
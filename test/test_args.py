@@ -2,6 +2,7 @@
 
 
 import unittest
+import unittest.mock as mock
 import sys
 
 sys.path.append('..')
@@ -36,3 +37,9 @@ class ArgsTest(unittest.TestCase):
     def test_parser_with_value_mapping(self):
         parser = parseArgs(['-H', 'foobar', '-M', 'key=value'])
         self.assertEqual(parser.metric_value_mapping, [('key', 'value')])
+
+    def test_parser_with_max_concurrency(self):
+        self.assertEqual(parseArgs(['-H', 'foobar', '--max-concurrency', '4']).max_concurrency, 4)
+        for value in ('0', '-1', 'x'):
+            with mock.patch('sys.stderr'), self.assertRaises(SystemExit):
+                parseArgs(['-H', 'foobar', '--max-concurrency', value])
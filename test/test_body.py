@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+
+import unittest
+import unittest.mock as mock
+import sys
+
+sys.path.append('..')
+
+from check_http_json import CheckAbort, main, parseArgs, read_body
+from .helpers import MockResponse
+
+
+class BodyTest(unittest.TestCase):
+    """
+    Tests for --max-body-size
+    """
+
+    def test_read_body(self):
+        args = parseArgs(['-H', 'localhost'])
+        self.assertEqual(read_body(args, MockResponse(), 'url'), b'{"foo": "bar"}')
+
+        args = parseArgs(['-H', 'localhost', '--max-body-size', '14'])
+        self.assertEqual(read_body(args, MockResponse(), 'url'), b'{"foo": "bar"}')
+
+        content = b'[' + b'1,' * 100000 + b'1]'
+        args = parseArgs(['-H', 'localhost', '--max-body-size', str(len(content))])
+        self.assertEqual(read_body(args, MockResponse(content), 'url'), content)
+
+    def test_read_body_too_large(self):
+        args = parseArgs(['-H', 'localhost', '--max-body-size', '13'])
+        with self.assertRaises(CheckAbort) as abort:
+            read_body(args, MockResponse(), 'url')
+        self.assertEqual(abort.exception.nagios.getCode(), 3)
+        self.assertIn('14 bytes received', abort.exception.nagios.getMessage())
+
+        # Rejected without reading the body
+        args = parseArgs(['-H', 'localhost', '--max-body-size', '100', '--invalid-json-state', '2'])
+        response = MockResponse(b'{}', length=1000)
+        with self.assertRaises(CheckAbort) as abort:
+            read_body(args, response, 'url')
+        self.assertEqual(abort.exception.nagios.getCode(), 2)
+        self.assertIn('exceeds 100 bytes (1000 bytes announced by Content-Length)', abort.exception.nagios.getMessage())
+        self.assertEqual(response.tell(), 0)
+
+    @mock.patch('builtins.print')
+    @mock.patch('urllib.request.urlopen')
+    def test_main_with_max_body_size(self, mock_request, mock_print):
+        content = b'{"status": "ok", "padding": "' + b'x' * 200000 + b'"}'
+
+        for stream in ([], ['--stream']):
+            mock_request.return_value = MockResponse(content)
+            with self.assertRaises(SystemExit) as test:
+                main(['-H', 'localhost', '--max-body-size', '100000', '-E', 'padding'] + stream)
+            self.assertEqual(test.exception.code, 3)
+            self.assertIn('Response body exceeds 100000 bytes', mock_print.call_args[0][0])
+
+            mock_request.return_value = MockResponse(content)
+            with self.assertRaises(SystemExit) as test:
+                main(['-H', 'localhost', '--max-body-size', '300000', '-E', 'padding'] + stream)
+            self.assertEqual(test.exception.code, 0)
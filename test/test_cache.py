@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+
+import fcntl
+import os
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock as mock
+import sys
+
+sys.path.append('..')
+
+from check_http_json import ResponseCache, main, parseArgs
+from .helpers import MockResponse
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """
+    Tests for the ResponseCache
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.args = parseArgs(['-H', 'localhost'])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_cache_key(self):
+        url = 'http://localhost'
+        key = ResponseCache.key(self.args, url)
+        self.assertEqual(key, ResponseCache.key(parseArgs(['-H', 'localhost']), url))
+        self.assertNotEqual(key, ResponseCache.key(parseArgs(['-H', 'localhost', '-X', 'POST']), url))
+        self.assertNotEqual(key, ResponseCache.key(parseArgs(['-H', 'localhost', '-A', '{"a": "b"}']), url))
+        self.assertNotEqual(key, ResponseCache.key(self.args, url + '/path'))
+        self.assertNotEqual(key, ResponseCache.key(parseArgs(['-H', 'localhost', '-k']), url))
+        self.assertNotEqual(key, ResponseCache.key(parseArgs(['-H', 'localhost', '--cacert', 'ca.pem']), url))
+
+    def test_cache_ttl(self):
+        cache = ResponseCache(self.directory.name, 10, 1024)
+        request = mock.Mock(return_value=b'{}')
+
+        self.assertEqual(cache.fetch(self.args, 'http://localhost', request), b'{}')
+        self.assertEqual(cache.fetch(self.args, 'http://localhost', request), b'{}')
+        self.assertEqual(request.call_count, 1)
+
+        path = os.path.join(self.directory.name, ResponseCache.key(self.args, 'http://localhost'))
+        expired = time.time() - 11
+        os.utime(path, (expired, expired))
+        cache.fetch(self.args, 'http://localhost', request)
+        self.assertEqual(request.call_count, 2)
+
+    def test_cache_coalescing(self):
+        cache = ResponseCache(self.directory.name, 10, 1024)
+
+        def request():
+            time.sleep(0.2)
+            return b'{}'
+
+        request = mock.Mock(side_effect=request)
+        threads = [threading.Thread(target=cache.fetch, args=(self.args, 'http://localhost', request))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(request.call_count, 1)
+
+    def test_cache_eviction(self):
+        cache = ResponseCache(self.directory.name, 10, 10)
+
+        cache.fetch(self.args, 'http://localhost/old', lambda: b'012345')
+        old = os.path.join(self.directory.name, ResponseCache.key(self.args, 'http://localhost/old'))
+        os.utime(old, (time.time() - 5, time.time() - 5))
+        cache.fetch(self.args, 'http://localhost/new', lambda: b'012345')
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, ResponseCache.key(self.args, 'http://localhost/new'))))
+
+    def test_cache_unusable(self):
+        # A file where the cache directory should be
+        directory = os.path.join(self.directory.name, 'file')
+        open(directory, 'w', encoding='utf-8').close()
+        cache = ResponseCache(directory, 10, 1024)
+        request = mock.Mock(return_value=b'{}')
+
+        self.assertEqual(cache.fetch(self.args, 'http://localhost', request), b'{}')
+        self.assertEqual(cache.fetch(self.args, 'http://localhost', request), b'{}')
+        self.assertEqual(request.call_count, 2)
+
+    def test_cache_not_private(self):
+        os.chmod(self.directory.name, 0o755)
+        cache = ResponseCache(self.directory.name, 10, 1024)
+        request = mock.Mock(return_value=b'{}')
+
+        self.assertEqual(cache.fetch(self.args, 'http://localhost', request), b'{}')
+        self.assertEqual(cache.fetch(self.args, 'http://localhost', request), b'{}')
+        self.assertEqual(request.call_count, 2)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_cache_lock_timeout(self):
+        cache = ResponseCache(self.directory.name, 10, 1024)
+        path = os.path.join(self.directory.name, ResponseCache.key(self.args, 'http://localhost'))
+        request = mock.Mock(return_value=b'{}')
+
+        with open(path + '.lock', 'ab') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            args = parseArgs(['-H', 'localhost', '-t', '1'])
+            start = time.monotonic()
+            self.assertEqual(cache.fetch(args, 'http://localhost', request), b'{}')
+            self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(request.call_count, 1)
+
+    def test_cache_eviction_of_locks(self):
+        cache = ResponseCache(self.directory.name, 10, 1024)
+        held = os.path.join(self.directory.name, 'held.lock')
+        free = os.path.join(self.directory.name, 'free.lock')
+        with open(held, 'ab') as lock, open(free, 'ab'):
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            for path in (held, free):
+                os.utime(path, (time.time() - 7200, time.time() - 7200))
+            cache.evict()
+            self.assertTrue(os.path.exists(held))
+        self.assertFalse(os.path.exists(free))
+
+    @mock.patch('builtins.print')
+    @mock.patch('urllib.request.urlopen')
+    def test_main_with_cache(self, mock_request, mock_print):
+        mock_request.return_value = MockResponse()
+        args = ['-H', 'localhost', '--cache-ttl', '10', '--cache-dir', self.directory.name]
+
+        for _ in range(2):
+            with self.assertRaises(SystemExit) as test:
+                main(args)
+            self.assertEqual(test.exception.code, 0)
+
+        mock_request.assert_called_once()
@@ -2,9 +2,11 @@
 
 
 import json
+import time
 import unittest
 from unittest.mock import patch
 import sys
+from datetime import datetime, timedelta, timezone
 
 sys.path.append('..')
 
@@ -505,3 +507,203 @@ class UtilTest(unittest.TestCase):
 
         data = '[{"update (status": "failure"}]'
         self.check_data(rules.dash_q(['(*).update (status),failure']), data, WARNING_CODE)
+
+    def test_compile_key(self):
+        helper = JsonHelper({}, '.', ':')
+        self.assertEqual(helper.compileKey('a.b(3).c'), ('a', 'b', 3, 'c'))
+        self.assertEqual(helper.compileKey('company.employees.(0).role'), ('company', 'employees', 0, 'role'))
+        self.assertEqual(helper.compileKey('foo(0)(1)'), ('foo', 0, 1))
+        self.assertEqual(helper.compileKey('(*).value'), (ARRAY_WILDCARD, 'value'))
+        self.assertEqual(helper.compileKey('update (status)'), ('update (status)',))
+        self.assertEqual(helper.compileKey(''), ())
+
+        helper = JsonHelper({}, '_', ':')
+        self.assertEqual(helper.compileKey('(0)_gauges_jvm.buffers(1)_value'), (0, 'gauges', 'jvm.buffers', 1, 'value'))
+
+    def test_resolve_key(self):
+        helper = JsonHelper({'foo': [{'bar': 1}, {'bar': [2, 3]}], 'baz': 'str'}, '.', ':')
+        self.assertEqual(helper.get('foo(0).bar'), 1)
+        self.assertEqual(helper.get('foo(1).bar(1)'), 3)
+        self.assertEqual(helper.get('foo(2).bar'), (None, 'not_found'))
+        self.assertEqual(helper.get('baz.foo'), (None, 'not_found'))
+        self.assertEqual(helper.get('baz(0)'), (None, 'not_found'))
+        self.assertEqual(helper.get('foo(*).bar'), (None, 'not_found'))
+        self.assertEqual(helper.get('bar', {'bar': 4}), 4)
+
+    def test_resolve_key_once(self):
+        data = json.loads('{"metric": 5, "status": "ok"}')
+        args = RulesHelper().dash_w(['metric,1:4']).dash_c(['metric,1:3']).dash_m(['metric,,1:4,1:3,0,10'])
+
+        with patch.object(JsonHelper, 'resolve', wraps=JsonHelper.resolve) as mock_resolve:
+            processor = JsonRuleProcessor(data, args.dash_q(['status,ok', 'missing,ok']))
+            processor.checkWarning()
+            processor.checkCritical()
+            processor.checkMetrics()
+
+        # The values were extracted in one walk when the processor was created
+        self.assertEqual(mock_resolve.call_count, 0)
+        self.assertEqual(processor.helper.paths, {('metric',): 5, ('status',): 'ok', ('missing',): (None, 'not_found')})
+
+    def test_extract_keys(self):
+        data = json.loads('{"cluster": {"nodes": [{"stats": {"load": 1, "mem": 2}}, {"stats": {"load": 3}}]}, "name": "c1"}')
+        paths = [('cluster', 'nodes', 0, 'stats', 'load'), ('cluster', 'nodes', 0, 'stats', 'mem'),
+                 ('cluster', 'nodes', 1, 'stats', 'mem'), ('cluster', 'nodes', 2, 'stats'), ('cluster', 'nodes'),
+                 ('cluster', 'nodes', ARRAY_WILDCARD, 'stats', 'load'), ('name', 'first'), ('missing', 0)]
+        values = {}
+        KeySelection(paths).extract(data, values)
+        # Paths with (*) get the array of the wildcard
+        expected = {path[:path.index(ARRAY_WILDCARD)] if ARRAY_WILDCARD in path else path for path in paths}
+        self.assertEqual(values, {path: JsonHelper.resolve(path, data) for path in expected})
+
+        processor = JsonRuleProcessor(data, RulesHelper().dash_w(['cluster.nodes(*).stats.load>load,2'])
+                                      .dash_m(['cluster.nodes(0).stats.mem>mem', 'max(cluster.nodes(*).stats.load)>max']))
+        self.assertEqual(processor.checkWarning(), " Value (3) for key load was outside the range 0:2.")
+        self.assertEqual(processor.checkMetrics(), ("'mem'=2 'max'=3 ", '', ''))
+
+    def test_expand_key(self):
+        data = json.loads('{"items": [{"s": "ok"}, {"s": "fail"}], "nested": [[1, 2], [3]], "empty": []}')
+        helper = JsonHelper(data, '.', ':')
+
+        expanded = helper.expandKey('items(*).s')
+        self.assertFalse(isinstance(expanded, list))
+        self.assertEqual(list(expanded), [('ok', 'items(0).s'), ('fail', 'items(1).s')])
+        self.assertEqual(list(helper.expandKey('items.(*).s')), [('ok', 'items.(0).s'), ('fail', 'items.(1).s')])
+        self.assertEqual(list(helper.expandKey('nested(*)(*)')),
+                         [(1, 'nested(0)(0)'), (2, 'nested(0)(1)'), (3, 'nested(1)(0)')])
+        self.assertEqual(list(helper.expandKey('items(*).x')),
+                         [((None, 'not_found'), 'items(0).x'), ((None, 'not_found'), 'items(1).x')])
+        self.assertEqual(list(helper.expandKey('missing(*).s')), [((None, 'not_found'), 'missing(*).s')])
+        self.assertEqual(list(helper.expandKey('empty(*)')), [])
+        self.assertEqual(list(helper.expandKey('items(1).s')), [('fail', 'items(1).s')])
+
+    def test_wildcard_alias(self):
+        data = json.loads('{"items": [{"s": "ok"}, {"s": "fail"}]}')
+        processor = JsonRuleProcessor(data, RulesHelper().dash_q(['items(*).s,ok']))
+        self.assertEqual(processor.checkWarning(), " Key items(1).s mismatch. ok != fail")
+
+        processor = JsonRuleProcessor(data, RulesHelper().dash_q(['items(*).s>state,ok']))
+        self.assertEqual(processor.checkWarning(), " Key state mismatch. ok != fail")
+
+    def test_aggregate(self):
+        data = json.loads('{"nodes": [{"l": 5}, {"l": 1}, {"l": 10.5}, {"x": 1}, {"l": "3"}], "groups": [[1, 2], [3]], "empty": []}')
+        helper = JsonHelper(data, '.', ':')
+        for function, expected in (('count', 4), ('min', 1), ('max', 10.5), ('sum', 19.5), ('avg', 4.875),
+                                   ('p0', 1), ('p50', 3), ('p95', 10.5), ('p100', 10.5)):
+            self.assertEqual(helper.aggregate(function, 'nodes(*).l'), expected, function)
+        self.assertEqual(helper.aggregate('sum', 'groups(*)(*)'), 6)
+        self.assertEqual(helper.aggregate('count', 'empty(*)'), 0)
+        self.assertEqual(helper.aggregate('max', 'empty(*).l'), (None, 'not_found'))
+        self.assertEqual(helper.aggregate('avg', 'missing(*).l'), (None, 'not_found'))
+
+    def test_aggregate_rules(self):
+        data = json.loads('{"nodes": [{"l": 5}, {"l": 1}, {"l": 10}], "max(x)": 1, "count(3)": [0]}')
+        processor = JsonRuleProcessor(data, RulesHelper().dash_w(['max(nodes(*).l),8']).dash_c(['count(nodes(*)),2'])
+                                      .dash_m(['avg(nodes(*).l),ms', 'p50(nodes(*).l)>median', 'max(x)']))
+        self.assertEqual(processor.checkWarning(), " Value (10) for key max(nodes(*).l) was outside the range 0:8.")
+        self.assertEqual(processor.checkCritical(), " Value (3) for key count(nodes(*)) was outside the range 0:2.")
+        self.assertEqual(processor.checkMetrics(), ("'avg(nodes(*).l)'=5.333333333333333ms 'median'=5 'max(x)'=1 ", '', ''))
+        # Keys without a wildcard are not aggregated
+        self.assertEqual(list(processor.expandKeys('count(3)')), [((None, 'not_found'), 'count(3)', 'count(3)')])
+
+        self.assertEqual(rule_paths([RulesHelper().dash_w(['max(nodes(*).l),8'])]), {('nodes', ARRAY_WILDCARD, 'l')})
+
+    def test_parse_range(self):
+        for text, low, high in (('10', 0, 10), ('10:', 10, float('inf')), ('~:10', None, 10),
+                                ('10:20', 10, 20), ('@10:20', 10, 20), ('-5:5', -5, 5)):
+            limits = parseRange(text)
+            self.assertEqual((limits.low, limits.high), (low, high), text)
+        self.assertTrue(parseRange('@10:20').invert)
+        self.assertIs(parseRange('10:20'), parseRange('10:20'))
+        for text in ('1:2:3', ':5', 'abc', '10:x', '', '@'):
+            with self.assertRaises(ValueError):
+                parseRange(text)
+
+    def test_range_bounds(self):
+        # Both ends belong to the range, inverted or not
+        for value, inside in ((9.9, False), (10, True), (15, True), (20, True), (20.1, False)):
+            self.assertEqual(parseRange('@10:20').check(value, 'x') != '', inside, value)
+            self.assertEqual(parseRange('10:20').check(value, 'x') == '', inside, value)
+
+    def test_rule_plan(self):
+        plan = RulePlan(RulesHelper().dash_w(['a,10', 'b,@1:2']).dash_q(['c,ok:up']).dash_E(['d'])
+                        .dash_m(['e', 'f,ms,1,2,,10', 'g>h,B']))
+        self.assertEqual([(rule, key) for rule, key, _ in plan.key_threshold_warning], [('a,10', 'a'), ('b,@1:2', 'b')])
+        self.assertEqual(plan.key_value_list, [('c,ok:up', 'c', ('ok:up', frozenset(('ok', 'up'))))])
+        self.assertEqual(plan.key_list_critical, [('d', 'd', None)])
+        self.assertIsNone(plan.key_threshold_critical)
+        self.assertEqual([(key, spec.suffix, len(spec.ranges)) for _, key, spec in plan.metric_list],
+                         [('e', '', 0), ('f', 'ms;1;2;;10', 3), ('g>h', 'B', 0)])
+
+        for rules, message in (
+                (RulesHelper().dash_w(['a,1:2:3']), '-w a,1:2:3: invalid range 1:2:3'),
+                (RulesHelper().dash_c(['a']), '-c a: expected key,range'),
+                (RulesHelper().dash_Q(['a,b,c']), '-Q a,b,c: expected key,value'),
+                (RulesHelper().dash_m(['a,,1']), '-m a,,1: expected key[,UnitOfMeasure[,WarnRange,CriticalRange[,Min,Max]]]'),
+                (RulesHelper().dash_m(['a,,x,1']), '-m a,,x,1: invalid range x')):
+            with self.assertRaises(ValueError) as test:
+                RulePlan(rules)
+            self.assertEqual(str(test.exception), message)
+
+    def test_key_time_epoch(self):
+        now = time.time()
+        for timestamp in (int(now), now, int(now * 1000), now * 1000):
+            data = json.dumps({'timestamp': timestamp, 'old': timestamp - (7200000 if timestamp > 10 ** 11 else 7200)})
+            self.check_data(RulesHelper().dash_dash_key_time(['timestamp,30m']), data, OK_CODE)
+            self.check_data(RulesHelper().dash_dash_key_time(['timestamp,@30m']), data, WARNING_CODE)
+            self.check_data(RulesHelper().dash_dash_key_time(['old,1h']), data, WARNING_CODE)
+            self.check_data(RulesHelper().dash_dash_key_time_critical(['old,3h']), data, OK_CODE)
+        processor = JsonRuleProcessor({'a': True, 'b': 'yesterday'}, RulesHelper().dash_dash_key_time(['a,1d', 'b,1d']))
+        self.assertEqual(processor.checkWarning(),
+                         " Value (True) for key a is not a Date in ISO format or epoch."
+                         " Value (yesterday) for key b is not a Date in ISO format. Invalid isoformat string: 'yesterday'")
+
+    def test_key_time_reference(self):
+        data = {'jobs': [{'last_run': '2000-01-01T00:00:00+00:00'}] * 100}
+        processor = JsonRuleProcessor(data, RulesHelper().dash_dash_key_time(['jobs(*).last_run,10m']))
+        # All keys are compared against the time the processor was created
+        processor.now = 946684800 + 599
+        self.assertEqual(processor.checkWarning(), '')
+        processor.now += 2
+        self.assertEqual(len(processor.warningFailures()), 100)
+
+    def test_parse_duration(self):
+        for text, seconds, invert, negative in (('30s', 30, False, False), ('5m', 300, False, False),
+                                                ('@-2h', 7200, True, True), ('1d', 86400, False, False)):
+            duration = parseDuration(text)
+            self.assertEqual((duration.seconds, duration.invert, duration.negative), (seconds, invert, negative), text)
+        for text in ('30', '5x', 'm', '', '@', '-', '1.5h', '--1m'):
+            with self.assertRaises(ValueError):
+                parseDuration(text)
+        with self.assertRaises(ValueError) as test:
+            RulePlan(RulesHelper().dash_dash_key_time_critical(['updated,10y']))
+        self.assertEqual(str(test.exception), '--key_time_critical updated,10y: invalid duration 10y')
+
+    def test_predicates(self):
+        data = json.loads('{"items": [{"state": "ok", "name": "a", "load": 1}, {"state": "failed", "name": "b", "load": 9},'
+                          ' {"state": "down", "name": "c", "load": "x", "error": {"code": 500}}, 5]}')
+        helper = JsonHelper(data, '.', ':')
+        for key, expected in (
+                ('items(?state!=ok).name', [('b', 'items(1).name'), ('c', 'items(2).name')]),
+                ('items(?state==ok).name', [('a', 'items(0).name')]),
+                ('items(?load>5).name', [('b', 'items(1).name')]),
+                ('items(?load<5).name', [('a', 'items(0).name')]),
+                ('items(?error).name', [('c', 'items(2).name')]),
+                ('items(?error.code==500).state', [('down', 'items(2).state')]),
+                ('items(?state==none).name', []),
+                ('items(?state==ok)(?x)', [((None, 'not_found'), 'items(0)(?x)')]),
+                ('name(?state==ok)', [((None, 'not_found'), 'name(?state==ok)')])):
+            self.assertEqual(list(helper.expandKey(key)), expected, key)
+        self.assertEqual(helper.aggregate('count', 'items(?state!=ok)'), 2)
+        self.assertEqual(helper.aggregate('max', 'items(?state)(*)'), (None, 'not_found'))
+        self.assertEqual(helper.aggregate('sum', 'items(?load<10).load'), 10)
+
+        processor = JsonRuleProcessor(data, RulesHelper().dash_Q(['items(?state!=ok).state,ok'])
+                                      .dash_c(['count(items(?load>5)),0']).dash_w(['items(?load>5).load>load,3']))
+        self.assertEqual(processor.checkCritical(),
+                         " Value (1) for key count(items(?load>5)) was outside the range 0:0."
+                         " Key items(1).state mismatch. ok != failed Key items(2).state mismatch. ok != down")
+        self.assertEqual(processor.checkWarning(), " Value (9) for key load was outside the range 0:3.")
+
+        for key in ('items(?load<x).name', 'items(?).name', 'items(?==ok).name'):
+            with self.assertRaises(ValueError):
+                RulePlan(RulesHelper().dash_e([key]))
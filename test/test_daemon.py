@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+import unittest.mock as mock
+
+sys.path.append('..')
+
+import check_http_json_client
+from check_http_json import CheckRequestHandler, CheckServer, parseArgs, prepare_context, prepare_request_context, run_check, serve
+from .helpers import MockResponse
+
+
+class DaemonTest(unittest.TestCase):
+    """
+    Tests for the daemon mode
+    """
+
+    @mock.patch('urllib.request.urlopen')
+    def test_run_check(self, mock_request):
+        mock_request.return_value = MockResponse()
+
+        code, stdout, stderr = run_check(['-H', 'localhost', '-q', 'foo,baz'])
+
+        self.assertEqual(code, 1)
+        self.assertEqual(stdout, 'WARNING: Status WARNING. Key foo mismatch. baz != bar\n')
+        self.assertEqual(stderr, '')
+
+    def test_run_check_usage_error(self):
+        code, stdout, stderr = run_check([])
+
+        self.assertEqual(code, 2)
+        self.assertEqual(stdout, '')
+        self.assertTrue('required: -H/--host' in stderr)
+
+    def start_server(self, directory):
+        path = os.path.join(directory, 'check.sock')
+        server = CheckServer(path, CheckRequestHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+        self.addCleanup(stop)
+        return path
+
+    def test_client(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.start_server(directory)
+            env = dict(os.environ, CHECK_HTTP_JSON_SOCKET=path)
+            result = subprocess.run([sys.executable, 'check_http_json_client.py', '--version'],
+                                    env=env, capture_output=True, check=False)
+
+        self.assertEqual(result.returncode, 0)
+        self.assertTrue(result.stdout.startswith(b'Version: '))
+
+    def test_client_directory_and_environment(self):
+        client = os.path.abspath('check_http_json_client.py')
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.start_server(directory)
+            with open(os.path.join(directory, 'hosts'), 'w', encoding='utf-8') as hosts:
+                hosts.write('unresolvable.invalid\n')
+            # The relative hosts file and the proxy of the client are used
+            env = {'PATH': os.environ.get('PATH', ''), 'CHECK_HTTP_JSON_SOCKET': path, 'http_proxy': 'http://127.0.0.1:1'}
+            result = subprocess.run([sys.executable, client, '--hosts-file', 'hosts'],
+                                    cwd=directory, env=env, capture_output=True, check=False)
+
+        self.assertEqual(result.returncode, 3)
+        self.assertIn(b'Connection refused], url:http://unresolvable.invalid', result.stdout)
+
+    def test_client_foreign_socket(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.start_server(directory)
+            with mock.patch.dict(os.environ, CHECK_HTTP_JSON_SOCKET=path), \
+                 mock.patch('os.getuid', return_value=os.getuid() + 1), \
+                 mock.patch('builtins.print') as mock_print, self.assertRaises(SystemExit) as test:
+                check_http_json_client.main(['-H', 'localhost', '-B', 'user:secret'])
+
+        self.assertEqual(test.exception.code, 3)
+        self.assertIn('is not owned by this user', mock_print.call_args[0][0])
+
+    def test_serve_keeps_other_files(self):
+        with tempfile.NamedTemporaryFile() as other:
+            with self.assertRaises(SystemExit) as test:
+                serve(parseArgs(['--daemon', '--socket', other.name]))
+            self.assertIn('is not a socket of this user', test.exception.code)
+            self.assertTrue(os.path.exists(other.name))
+
+    def test_prepare_request_context(self):
+        options = ['--ssl', '--cacert', 'cert.pem', '--cert', 'cert.pem', '--key', 'key.pem']
+        request = {'args': ['-H', 'localhost'] + options, 'cwd': os.path.abspath('test/tls'), 'env': {}}
+        prepare_request_context(json.dumps(request).encode())
+
+        # The check in the directory of the client reuses the context built by the daemon
+        with mock.patch('ssl.SSLContext.load_verify_locations') as mock_load:
+            context = prepare_context(parseArgs(['-H', 'localhost', '--ssl', '--cacert', 'test/tls/cert.pem',
+                                                 '--cert', 'test/tls/cert.pem', '--key', 'test/tls/key.pem']))
+        mock_load.assert_not_called()
+        self.assertFalse(context.debug)
+
+        # Invalid requests and options are left to the check
+        with mock.patch('sys.stderr') as mock_stderr:
+            prepare_request_context(b'not JSON')
+            prepare_request_context(json.dumps(dict(request, args=['--ssl'])).encode())
+            prepare_request_context(json.dumps(dict(request, args=['-H', 'localhost', '--ssl', '--cacert', 'missing.pem'])).encode())
+        mock_stderr.write.assert_not_called()
+
+    def test_client_invalid_response(self):
+        for response in (b'garbage\n', b'0 x\nOK', b'0 100\nOK', b'0 2 1\nOK'):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'check.sock')
+                server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                server.bind(path)
+                server.listen(1)
+
+                def respond(server=server, response=response):
+                    conn, _ = server.accept()
+                    with conn:
+                        conn.recv(65536)
+                        conn.sendall(response)
+                thread = threading.Thread(target=respond)
+                thread.start()
+                with server, mock.patch.dict(os.environ, CHECK_HTTP_JSON_SOCKET=path), \
+                     mock.patch('builtins.print') as mock_print, self.assertRaises(SystemExit) as test:
+                    check_http_json_client.main(['-H', 'localhost'])
+                thread.join()
+
+            self.assertEqual(test.exception.code, 3)
+            mock_print.assert_called_once_with(
+                'UNKNOWN: Status UNKNOWN. Invalid response from check_http_json daemon on %s' % path)
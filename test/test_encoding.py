@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+
+import gzip
+import json
+import zlib
+import sys
+
+sys.path.append('..')
+
+from .helpers import JsonHandler, ServerTestCase
+
+
+DOCUMENT = json.dumps({'status': 'ok', 'padding': 'x' * 100000}).encode()
+
+
+def raw_deflate(data):
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class EncodingHandler(JsonHandler):
+    encodings = {
+        '/gzip': ('gzip', gzip.compress(DOCUMENT)),
+        '/deflate': ('deflate', zlib.compress(DOCUMENT)),
+        '/raw-deflate': ('deflate', raw_deflate(DOCUMENT)),
+        '/identity': (None, DOCUMENT),
+        '/broken': ('gzip', b'not gzip at all'),
+    }
+    accept_encoding = None
+
+    def do_GET(self):
+        EncodingHandler.accept_encoding = self.headers.get('Accept-Encoding')
+        encoding, body = self.encodings[self.path]
+        self.send_body(body, headers=[('Content-Encoding', encoding)] if encoding else [])
+
+
+class EncodingTest(ServerTestCase):
+    """
+    Tests for compressed responses
+    """
+    handler = EncodingHandler
+
+    def run_check(self, args):
+        return super().run_check(['-H', self.host] + args)
+
+    def test_encodings(self):
+        for path in ('gzip', 'deflate', 'raw-deflate', 'identity'):
+            for options in ([], ['--stream'], ['--max-body-size', '200000']):
+                code, mock_print = self.run_check(['-p', path, '-q', 'status,ok', '-E', 'padding'] + options)
+                self.assertEqual(code, 0, (path, options, mock_print.call_args))
+            # Several paths over one connection
+            code, mock_print = self.run_check(['-p', 'a:' + path, '-p', 'b:identity', '-q', 'a:status,ok', 'b:status,ok'])
+            self.assertEqual(code, 0, (path, mock_print.call_args))
+        self.assertEqual(EncodingHandler.accept_encoding, 'gzip, deflate')
+
+    def test_encoding_debug(self):
+        code, mock_print = self.run_check(['-p', 'gzip', '-d', '-q', 'status,ok'])
+        self.assertEqual(code, 0)
+        size = len(EncodingHandler.encodings['/gzip'][1])
+        mock_print.assert_any_call('body: %d bytes (%d bytes gzip) received' % (len(DOCUMENT), size))
+
+    def test_decompressed_size_limit(self):
+        for options in ([], ['--stream']):
+            code, mock_print = self.run_check(['-p', 'gzip', '--max-body-size', '50000', '-E', 'padding'] + options)
+            self.assertEqual(code, 3)
+            self.assertIn('Response body exceeds 50000 bytes', mock_print.call_args[0][0])
+
+    def test_max_decompressed_size(self):
+        for options in ([], ['--stream']):
+            code, mock_print = self.run_check(['-p', 'gzip', '--max-decompressed-size', '50000', '-E', 'padding'] + options)
+            self.assertEqual(code, 3)
+            self.assertIn('decompressed body exceeds 50000 bytes', mock_print.call_args[0][0])
+            code, mock_print = self.run_check(['-p', 'gzip', '--max-decompressed-size', '0', '-E', 'padding'] + options)
+            self.assertEqual(code, 0, mock_print.call_args)
+
+    def test_invalid_encoding(self):
+        for options in ([], ['--stream'], ['--max-body-size', '50000']):
+            code, mock_print = self.run_check(['-p', 'broken', '-q', 'status,ok'] + options)
+            self.assertEqual(code, 3)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+
+import tempfile
+import time
+import sys
+
+sys.path.append('..')
+
+from check_http_json import *
+from .helpers import JsonHandler, ServerTestCase
+
+
+class SlowJsonHandler(JsonHandler):
+    delay = 0.3
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        self.send_body(('{"status": "%s"}' % self.server.status).encode())
+
+
+def host_failure(code, message):
+    nagios = NagiosHelper()
+    nagios.append_message(code, message)
+    return CheckAbort(nagios)
+
+
+class HostsTest(ServerTestCase):
+    """
+    Tests for multi-host checks
+    """
+    handler = None
+
+    def quorum(self, documents, *args):
+        args = parseArgs(['-H', 'a,b,c', '-q', 'status,ok', '-m', 'load'] + list(args))
+        return check_quorum(args, args, HostDocuments(documents))
+
+    def test_quorum(self):
+        documents = [('a', {'status': 'ok', 'load': 1}),
+                     ('b', {'status': 'fail', 'load': 2}),
+                     ('c', host_failure(CRITICAL_CODE, ' URLError[refused]'))]
+
+        nagios = self.quorum(documents)
+        self.assertEqual(nagios.getCode(), CRITICAL_CODE)
+        self.assertTrue("'hosts_ok'=1;;;0;3 " in nagios.performance_data)
+        self.assertTrue("'a:load'=1 " in nagios.performance_data)
+        self.assertTrue(nagios.critical_message.startswith(' 2 of 3 hosts not OK (1 WARNING, 1 CRITICAL, 0 UNKNOWN).'))
+        self.assertTrue('[b] Key status mismatch. ok != fail' in nagios.critical_message)
+        self.assertTrue('[c] URLError[refused]' in nagios.critical_message)
+
+        self.assertEqual(self.quorum(documents, '--quorum-critical', '1').getCode(), WARNING_CODE)
+        nagios = self.quorum(documents, '--quorum-critical', '1', '--quorum-warning', '2')
+        self.assertEqual(nagios.getCode(), OK_CODE)
+        # The hosts that are not OK are reported within the quorum as well
+        self.assertTrue('Status OK. 2 of 3 hosts not OK (1 WARNING, 1 CRITICAL, 0 UNKNOWN).' in nagios.getMessage())
+        self.assertTrue('[c] URLError[refused]' in nagios.getMessage())
+
+        nagios = self.quorum(documents[:1])
+        self.assertTrue('Status OK. |' in nagios.getMessage())
+
+    def test_quorum_unknown(self):
+        documents = [('a', {'status': 'ok'}), ('b', host_failure(UNKNOWN_CODE, ' timeout'))]
+        self.assertEqual(self.quorum(documents).getCode(), UNKNOWN_CODE)
+
+    def test_read_hosts(self):
+        with tempfile.NamedTemporaryFile('w') as hosts:
+            hosts.write('# cluster\nnode2\n\nnode3:8098 # last\n')
+            hosts.flush()
+            args = parseArgs(['-H', 'node1, node2', '--hosts-file', hosts.name])
+            self.assertEqual(read_hosts(args), ['node1', 'node2', 'node2', 'node3:8098'])
+
+            args = parseArgs(['--hosts-file', hosts.name])
+            self.assertEqual(read_hosts(args), ['node2', 'node3:8098'])
+
+    def test_main_with_hosts(self):
+        servers = []
+        for status in ('ok', 'ok', 'fail'):
+            server = self.start_server(SlowJsonHandler)
+            server.status = status
+            servers.append(server)
+        hosts = ','.join('127.0.0.1:%d' % server.server_address[1] for server in servers)
+
+        start = time.monotonic()
+        code, mock_print = self.run_check(['-H', hosts, '-q', 'status,ok', '--quorum-critical', '1'])
+        duration = time.monotonic() - start
+
+        self.assertEqual(code, WARNING_CODE)
+        self.assertLess(duration, 3 * SlowJsonHandler.delay)
+        self.assertTrue('1 of 3 hosts not OK' in str(mock_print.call_args))
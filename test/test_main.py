@@ -5,6 +5,7 @@ import unittest
 import unittest.mock as mock
 import sys
 import os
+import tempfile
 
 sys.path.append('..')
 
@@ -15,6 +16,7 @@ class MockResponse():
     def __init__(self, status_code=200, content='{"foo": "bar"}'):
         self.status_code = status_code
         self.content = content
+        self.headers = {}
 
     def read(self):
         return self.content
@@ -142,3 +144,101 @@ class MainTest(unittest.TestCase):
 
         self.assertTrue('timeout' in str(mock_print.call_args))
         self.assertEqual(test.exception.code, 3)
+
+    @mock.patch('builtins.print')
+    @mock.patch('urllib.request.urlopen')
+    def test_main_with_batch(self, mock_request, mock_print):
+        mock_request.return_value = MockResponse(content='{"status": "ok", "queue": {"depth": 50}}')
+
+        with tempfile.NamedTemporaryFile('w', suffix='.batch') as batch:
+            batch.write('# service rules\n')
+            batch.write('health -q status,ok\n')
+            batch.write('queue -w queue.depth,10 -m "queue.depth>depth"\n')
+            batch.write('broken --no-such-rule\n')
+            batch.flush()
+
+            with self.assertRaises(SystemExit) as test:
+                main(['-H', 'localhost', '--batch', batch.name])
+
+        mock_request.assert_called_once()
+        self.assertEqual(test.exception.code, 3)
+        self.assertEqual(mock_print.call_args_list[0], mock.call('health: OK: Status OK.'))
+        self.assertEqual(mock_print.call_args_list[1], mock.call(
+            "queue: WARNING: 'depth'=50  Status WARNING. Value (50) for key queue.depth was outside the range 0:10.|'depth'=50"))
+        self.assertEqual(mock_print.call_args_list[2], mock.call(
+            'broken: UNKNOWN: Status UNKNOWN. Invalid rule arguments --no-such-rule: unrecognized arguments: --no-such-rule'))
+
+    @mock.patch('builtins.print')
+    @mock.patch('urllib.request.urlopen')
+    def test_main_with_invalid_batch(self, mock_request, mock_print):
+        with tempfile.NamedTemporaryFile('w', suffix='.batch') as batch:
+            batch.write('# no rule sets\n')
+            batch.flush()
+            for args, message in (
+                    ([], 'No rule set in batch file %s.' % batch.name),
+                    (['-q', 'status,ok', '-f', '_'], '-q, -f only apply to the rule sets of the batch file with --batch.')):
+                with self.assertRaises(SystemExit) as test:
+                    main(['-H', 'localhost', '--batch', batch.name] + args)
+                self.assertEqual(test.exception.code, 3)
+                mock_print.assert_called_with('UNKNOWN: Status UNKNOWN. %s' % message)
+
+            batch.write('depth -w depth,x\n')
+            batch.flush()
+            mock_request.return_value = MockResponse(content='{"depth": 5}')
+            with mock.patch('sys.stderr') as mock_stderr, self.assertRaises(SystemExit) as test:
+                main(['-H', 'localhost', '--batch', batch.name])
+            mock_stderr.write.assert_not_called()
+            mock_print.assert_called_with('depth: UNKNOWN: Status UNKNOWN. Invalid rule -w depth,x: invalid range x')
+
+    @mock.patch('builtins.print')
+    @mock.patch('urllib.request.urlopen')
+    def test_main_with_request_options_in_batch(self, mock_request, mock_print):
+        mock_request.return_value = MockResponse(content='{"status": "ok"}')
+        with tempfile.NamedTemporaryFile('w', suffix='.batch') as batch:
+            batch.write('host -H otherhost -p /zzz -q status,ok\ntimeout -t 1 -q status,ok\nhelp -h\nok -q status,ok\n')
+            batch.flush()
+            with mock.patch('sys.stdout') as mock_stdout, self.assertRaises(SystemExit) as test:
+                main(['-H', 'localhost', '--batch', batch.name])
+
+        mock_stdout.write.assert_not_called()
+        self.assertEqual(test.exception.code, 3)
+        output = [call[0][0] for call in mock_print.call_args_list]
+        self.assertEqual(output[0], 'host: UNKNOWN: Status UNKNOWN. Invalid rule arguments -H otherhost -p /zzz -q status,ok: '
+                                    'unrecognized arguments: -H otherhost -p /zzz')
+        self.assertTrue(output[1].startswith('timeout: UNKNOWN: Status UNKNOWN. Invalid rule arguments'))
+        self.assertEqual(output[2], 'help: UNKNOWN: Status UNKNOWN. Invalid rule arguments -h: unrecognized arguments: -h')
+        self.assertEqual(output[3], 'ok: OK: Status OK.')
+
+    @mock.patch('builtins.print')
+    def test_main_with_missing_batch(self, mock_print):
+        with self.assertRaises(SystemExit) as test:
+            main(['-H', 'localhost', '--batch', '/nonexistent.batch'])
+
+        self.assertTrue('Could not read batch file' in str(mock_print.call_args))
+        self.assertEqual(test.exception.code, 3)
+
+    @mock.patch('builtins.print')
+    @mock.patch('urllib.request.urlopen')
+    def test_main_with_invalid_rule(self, mock_request, mock_print):
+        with self.assertRaises(SystemExit) as test:
+            main(['-H', 'localhost', '-q', 'status,ok', '-w', 'load,10:x'])
+
+        mock_request.assert_not_called()
+        self.assertEqual(test.exception.code, 3)
+        mock_print.assert_called_once_with('UNKNOWN: Status UNKNOWN. Invalid rule -w load,10:x: invalid range 10:x')
+
+    @mock.patch('builtins.print')
+    @mock.patch('urllib.request.urlopen')
+    def test_main_with_max_output_length(self, mock_request, mock_print):
+        content = '{"items": [%s]}' % ','.join('{"state": "failed", "load": %d}' % i for i in range(1000))
+        mock_request.return_value = MockResponse(content=content)
+
+        with self.assertRaises(SystemExit) as test:
+            main(['-H', 'localhost', '-Q', 'items(*).state,ok', '-m', 'items(*).load', '--max-output-length', '4096'])
+
+        self.assertEqual(test.exception.code, 2)
+        output = mock_print.call_args[0][0]
+        self.assertLessEqual(len(output), 4096)
+        self.assertTrue(output.startswith('CRITICAL: Status CRITICAL. 1000 keys failed, first 5: '
+                                          'Key items(0).state mismatch. ok != failed Key items(1).state'))
+        self.assertRegex(output.split('|')[1], r"^('items\(\d+\)\.load'=\d+ )+'items\(\d+\)\.load'=\d+$")
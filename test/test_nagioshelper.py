@@ -55,3 +55,48 @@ class NagiosHelperTest(unittest.TestCase):
         helper = NagiosHelper()
         helper.append_message(1, 'exa|mple')
         self.assertEqual('WARNING: Status WARNING. exa mple', helper.getMessage())
+
+    def test_getmessage_rule_failures(self):
+
+        helper = NagiosHelper()
+        helper.append_message(WARNING_CODE, [RuleFailure(WARNING_CODE, 'a', 'a', 1, 'Key a mis|match.')])
+        helper.append_message(CRITICAL_CODE, [])
+        self.assertEqual(1, helper.getCode())
+        self.assertEqual(' Key a mis match.', helper.warning_message)
+        self.assertEqual('WARNING: Status WARNING. Key a mis match.', helper.getMessage())
+
+    def test_getmessage_max_length(self):
+
+        helper = NagiosHelper()
+        helper.append_message(WARNING_CODE, " Could not reach b.")
+        helper.append_message(WARNING_CODE, [RuleFailure(WARNING_CODE, 'w%d' % i, 'w%d' % i, i, 'Key w%d failed.' % i) for i in range(10)])
+        helper.append_message(CRITICAL_CODE, [RuleFailure(CRITICAL_CODE, 'c%d' % i, 'c%d' % i, i, 'Key c%d failed.' % i) for i in range(410)])
+        helper.performance_data = ''.join("'key %d'=%d;1;2 " % (i, i) for i in range(1000))
+        self.assertGreater(len(helper.getMessage()), 8192)
+
+        output = helper.getMessage(max_length=200)
+        self.assertLessEqual(len(output), 200)
+        message, performance_data = output.split('|')
+        self.assertEqual(message, 'CRITICAL: Status CRITICAL. Could not reach b. 420 keys failed, first 5: '
+                                  'Key c0 failed. Key c1 failed. Key c2 failed. Key c3 failed. Key c4 failed.')
+        # Only complete performance data values are kept
+        self.assertEqual(performance_data, "'key 0'=0;1;2 'key 1'=1;1;2 'key 2'=2;1;2")
+
+        # Without room for the performance data the message is cut
+        output = helper.getMessage(max_length=60)
+        self.assertEqual(len(output), 60)
+        self.assertEqual(output, 'CRITICAL: Status CRITICAL. Could not reach b. 420 keys fa...')
+
+    def test_getmessage_max_length_fits(self):
+
+        helper = NagiosHelper()
+        helper.append_message(WARNING_CODE, " Key a mismatch.")
+        helper.performance_data = "'a'=1 "
+        self.assertEqual(helper.getMessage(max_length=100), helper.getMessage())
+        # The copy of the performance data in front of the status is dropped first
+        self.assertEqual(helper.getMessage(max_length=50), "WARNING: Status WARNING. Key a mismatch.|'a'=1")
+
+    def test_perf_label(self):
+
+        self.assertEqual(perfLabel('a b'), "'a b'")
+        self.assertEqual(perfLabel("it's=1|2"), "'it''s_1 2'")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+
+import os
+import select
+import tempfile
+import unittest.mock as mock
+import sys
+
+sys.path.append('..')
+
+from check_http_json import *
+from .helpers import JsonHandler, ServerTestCase
+
+
+class DocumentHandler(JsonHandler):
+    document = b'{"status": "ok", "queue": {"depth": 50}}'
+
+
+class PassiveTest(ServerTestCase):
+    """
+    Tests for the passive check results
+    """
+    handler = DocumentHandler
+
+    def setUp(self):
+        super().setUp()
+        self.port = self.server.server_address[1]
+        self.directory = tempfile.TemporaryDirectory()
+        self.spool = self.directory.name
+        self.batch = os.path.join(self.spool, 'services.batch')
+        with open(self.batch, 'w', encoding='utf-8') as batch:
+            batch.write('health -q status,ok\n')
+            batch.write('queue -w queue.depth,10\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_results(self):
+        """
+        The results of the check result files with an .ok file
+        """
+        results = []
+        for name in sorted(os.listdir(self.spool)):
+            if name.startswith('c') and len(name) == 7:
+                self.assertTrue(os.path.exists(os.path.join(self.spool, name + '.ok')))
+                with open(os.path.join(self.spool, name), encoding='utf-8') as result_file:
+                    blocks = result_file.read().split('### Nagios Service Check Result ###\n')
+                self.assertTrue(blocks[0].startswith('### Passive Check Result File ###\nfile_time='))
+                for block in blocks[1:]:
+                    fields = dict(line.split('=', 1) for line in block.splitlines() if '=' in line)
+                    results.append((fields['host_name'], fields['service_description'],
+                                    int(fields['return_code']), fields['output']))
+        self.assertFalse([name for name in os.listdir(self.spool) if name.endswith('.tmp')])
+        return results
+
+    def test_checkresults_batch(self):
+        code, mock_print = self.run_check(['-H', '127.0.0.1:%d' % self.port, '--batch', self.batch,
+                                           '--checkresults-dir', self.spool])
+        self.assertEqual(code, 1)
+        self.assertEqual(mock_print.call_count, 2)
+        self.assertEqual(self.read_results(), [
+            ('127.0.0.1', 'health', 0, 'OK: Status OK.'),
+            ('127.0.0.1', 'queue', 1, 'WARNING: Status WARNING. Value (50) for key queue.depth was outside the range 0:10.')])
+
+    def test_checkresults_hosts(self):
+        hosts = '127.0.0.1:%d,localhost:%d' % (self.port, self.port)
+        code, _ = self.run_check(['-H', hosts, '-q', 'status,ok', '--passive-service', 'health',
+                                  '--checkresults-dir', self.spool])
+        self.assertEqual(code, 0)
+        self.assertEqual(sorted(self.read_results()), [
+            ('127.0.0.1', 'health', 0, 'OK: Status OK.'), ('localhost', 'health', 0, 'OK: Status OK.')])
+
+    def test_command_file(self):
+        command_file = os.path.join(self.spool, 'nagios.cmd')
+        open(command_file, 'w', encoding='utf-8').close()
+        code, _ = self.run_check(['-H', 'localhost:%d' % self.port, '--batch', self.batch,
+                                  '--passive-host', 'web1', '--command-file', command_file])
+        self.assertEqual(code, 1)
+        with open(command_file, encoding='utf-8') as commands:
+            lines = [line.split(' ', 1)[1] for line in commands.read().splitlines()]
+        self.assertEqual(lines, [
+            'PROCESS_SERVICE_CHECK_RESULT;web1;health;0;OK: Status OK.',
+            'PROCESS_SERVICE_CHECK_RESULT;web1;queue;1;WARNING: Status WARNING. '
+            'Value (50) for key queue.depth was outside the range 0:10.'])
+
+    def test_unreachable_host(self):
+        code, _ = self.run_check(['-H', '127.0.0.1:1', '--batch', self.batch, '--checkresults-dir', self.spool])
+        self.assertEqual(code, 3)
+        results = self.read_results()
+        self.assertEqual([result[:3] for result in results], [('127.0.0.1', 'health', 3), ('127.0.0.1', 'queue', 3)])
+        self.assertTrue(results[0][3].startswith('UNKNOWN: Status UNKNOWN. URLError'))
+
+    def test_invalid_options(self):
+        code, mock_print = self.run_check(['-H', 'localhost', '-q', 'status,ok', '--checkresults-dir', self.spool])
+        self.assertEqual(code, 3)
+        self.assertIn('--passive-service is required', mock_print.call_args[0][0])
+
+        code, mock_print = self.run_check(['-H', 'a,b', '--batch', self.batch, '--passive-host', 'web1',
+                                           '--checkresults-dir', self.spool])
+        self.assertEqual(code, 3)
+        self.assertIn('--passive-host only applies to a single host', mock_print.call_args[0][0])
+        self.assertEqual(self.read_results(), [])
+
+    def test_command_pipe(self):
+        pipe = os.path.join(self.spool, 'nagios.cmd')
+        os.mkfifo(pipe)
+        args = ['-H', 'localhost:%d' % self.port, '-q', 'status,ok', '--passive-service', 'health', '--command-file', pipe]
+
+        # No process reads the pipe
+        code, mock_print = self.run_check(args)
+        self.assertEqual(code, 3)
+        self.assertIn('Could not submit passive results', mock_print.call_args[0][0])
+
+        reader = os.open(pipe, os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            code, _ = self.run_check(args)
+            received = os.read(reader, 65536)
+        finally:
+            os.close(reader)
+        self.assertEqual(code, 0)
+        self.assertTrue(received.endswith(b'] PROCESS_SERVICE_CHECK_RESULT;localhost;health;0;OK: Status OK.\n'))
+
+    def test_command_batches(self):
+        args = parseArgs(['-H', 'localhost', '--command-file', os.path.join(self.spool, 'nagios.cmd')])
+        open(args.command_file, 'w', encoding='utf-8').close()
+        passive = PassiveResults(args, ['service%d' % index for index in range(200)])
+        passive.hosts = ['localhost']
+        nagios = NagiosHelper()
+        nagios.append_message(CRITICAL_CODE, ' Key status mismatch. ok != failed\nsecond line')
+        passive.addAll(nagios)
+
+        with mock.patch('os.write', wraps=os.write) as mock_write:
+            passive.submit()
+
+        # Every write holds whole lines and is not split by other writers
+        for call in mock_write.call_args_list:
+            self.assertLessEqual(len(call[0][1]), select.PIPE_BUF)
+            self.assertTrue(call[0][1].endswith(b'\n'))
+        self.assertGreater(mock_write.call_count, 1)
+        with open(args.command_file, encoding='utf-8') as commands:
+            lines = commands.read().splitlines()
+        self.assertEqual(len(lines), 200)
+        self.assertTrue(lines[199].endswith(';localhost;service199;2;CRITICAL: Status CRITICAL. '
+                                            'Key status mismatch. ok != failed\\nsecond line'))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+
+import os
+import unittest.mock as mock
+import urllib.parse
+import urllib.request
+import sys
+
+sys.path.append('..')
+
+from check_http_json import JsonHelper, NamespacedDocuments, main, parseArgs, split_paths
+from .helpers import JsonHandler, ServerTestCase
+
+
+class PathsHandler(JsonHandler):
+    documents = {
+        '/stats': b'{"queue": {"depth": 50}}',
+        '/api/health': b'{"status": "ok"}',
+    }
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        PathsHandler.connections += 1
+
+    def do_GET(self):
+        if self.path in self.documents:
+            self.send_body(self.documents[self.path])
+        else:
+            self.send_body(b'not found', 404, content_type='text/plain')
+
+
+class ProxyHandler(PathsHandler):
+    proxied = []
+
+    def do_GET(self):
+        ProxyHandler.proxied.append(self.path)
+        self.path = urllib.parse.urlsplit(self.path).path
+        super().do_GET()
+
+
+class PathsTest(ServerTestCase):
+    """
+    Tests for checking several paths
+    """
+    handler = PathsHandler
+
+    def setUp(self):
+        PathsHandler.connections = 0
+        super().setUp()
+
+    def test_split_paths(self):
+        self.assertEqual(split_paths(['stats', 'api/health', 'h:api/health?x=1', 'api/v1/']),
+                         [('stats', 'stats'), ('health', 'api/health'), ('h', 'api/health?x=1'), ('v1', 'api/v1/')])
+
+    def test_namespaced_key(self):
+        helper = JsonHelper(NamespacedDocuments(stats={'queue': [1, 2]}), '.', ':')
+        self.assertEqual(helper.get('stats:queue(1)'), 2)
+        self.assertEqual(list(helper.expandKey('stats:queue(*)')), [(1, 'stats:queue(0)'), (2, 'stats:queue(1)')])
+        self.assertEqual(helper.get('health:queue'), (None, 'not_found'))
+
+    @mock.patch('builtins.print')
+    def test_main_with_paths(self, mock_print):
+        args = ['-H', self.host, '-p', 'stats', '-p', 'api/health',
+                '-q', 'health:status,ok', '-w', 'stats:queue.depth,10']
+
+        with self.assertRaises(SystemExit) as test:
+            main(args)
+
+        self.assertEqual(test.exception.code, 1)
+        self.assertEqual(PathsHandler.connections, 1)
+        mock_print.assert_called_once_with(
+            'WARNING: Status WARNING. Value (50) for key stats:queue.depth was outside the range 0:10.')
+
+    @mock.patch('builtins.print')
+    def test_main_with_missing_path(self, mock_print):
+        args = ['-H', self.host, '-p', 'stats', '-p', 'missing', '-e', 'stats:queue']
+
+        with self.assertRaises(SystemExit) as test:
+            main(args)
+
+        self.assertEqual(test.exception.code, 3)
+        self.assertTrue('HTTPError[404]' in str(mock_print.call_args))
+
+    @mock.patch('builtins.print')
+    def test_main_with_paths_without_namespace(self, mock_print):
+        args = ['-H', self.host, '-p', 'stats', '-p', 'api/health', '-q', 'health:status,ok', '-w', 'queue.depth,10']
+
+        with self.assertRaises(SystemExit) as test:
+            main(args)
+
+        self.assertEqual(test.exception.code, 3)
+        self.assertEqual(PathsHandler.connections, 0)
+        mock_print.assert_called_once_with('UNKNOWN: Status UNKNOWN. Invalid rule key queue.depth does not start '
+                                           'with the name of one of the documents health, stats (name:key)')
+
+    def test_duplicate_path_names(self):
+        with mock.patch('sys.stderr') as mock_stderr, self.assertRaises(SystemExit) as test:
+            parseArgs(['-H', self.host, '-p', 'v1/stats', '-p', 'v2/stats'])
+
+        self.assertEqual(test.exception.code, 2)
+        self.assertIn('the document name stats is given more than once',
+                      ''.join(call[0][0] for call in mock_stderr.write.call_args_list))
+        parseArgs(['-H', self.host, '-p', 'v1:v1/stats', '-p', 'v2/stats'])
+
+    def test_main_with_paths_and_request_options(self):
+        for option in (['--retries', '1'], ['--hedge-after', '100'], ['--stream'], ['--cache-ttl', '10']):
+            code, mock_print = self.run_check(['-H', self.host, '-p', 'stats', '-p', 'api/health',
+                                               '-q', 'health:status,ok'] + option)
+
+            self.assertEqual(code, 3)
+            mock_print.assert_called_once_with(
+                'UNKNOWN: Status UNKNOWN. %s does not apply to multiple paths.' % option[0])
+        self.assertEqual(PathsHandler.connections, 0)
+
+    def test_main_with_paths_through_proxy(self):
+        ProxyHandler.proxied = []
+        proxy = self.start_server(ProxyHandler)
+        environ = {'http_proxy': 'http://127.0.0.1:%d' % proxy.server_address[1], 'no_proxy': ''}
+
+        # urlopen keeps the proxies of its first call in its global opener
+        urllib.request.install_opener(None)
+        self.addCleanup(urllib.request.install_opener, None)
+        with mock.patch.dict(os.environ, environ):
+            code, mock_print = self.run_check(['-H', self.host, '-p', 'stats', '-p', 'api/health',
+                                               '-q', 'health:status,ok', '-w', 'stats:queue.depth,100'])
+
+        self.assertEqual(code, 0)
+        self.assertEqual(ProxyHandler.proxied, ['http://%s/stats' % self.host, 'http://%s/api/health' % self.host])
+        mock_print.assert_called_once_with('OK: Status OK.')
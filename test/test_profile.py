@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+
+import json
+import os
+import pstats
+import tempfile
+import sys
+
+sys.path.append('..')
+
+from check_http_json import JsonRuleProcessor, Profile, parseArgs
+from .helpers import JsonHandler, ServerTestCase
+
+
+DOCUMENT = json.dumps({'status': 'ok', 'depth': 5, 'items': [{'value': 1}, {'value': 2}]}).encode()
+
+
+class DocumentHandler(JsonHandler):
+    document = DOCUMENT
+
+
+class ProfileTest(ServerTestCase):
+    """
+    Tests for --profile and --profile-file
+    """
+    handler = DocumentHandler
+
+    def run_check(self, args):
+        return super().run_check(['-H', self.host] + args)
+
+    def test_profile(self):
+        code, mock_print = self.run_check(['-q', 'status,ok', '-w', 'depth,10', '-m', 'depth', 'items(*).value',
+                                              '--profile'])
+        self.assertEqual(code, 0)
+        # The result line is unchanged, the profile goes to stderr
+        self.assertEqual(mock_print.call_args_list[0][0][0], "OK: 'depth'=5 'items(0).value'=1 'items(1).value'=2  Status OK. |'depth'=5 'items(0).value'=1 'items(1).value'=2")
+        report = mock_print.call_args_list[1]
+        self.assertEqual(report[1], {'file': sys.stderr})
+        lines = report[0][0].splitlines()
+        phases = [line.split()[1] for line in lines[1:7]]
+        self.assertEqual(phases, ['arguments', 'setup', 'fetch', 'evaluate', 'output', 'total'])
+        self.assertIn('profile: slowest 4 of 4 rules', report[0][0])
+        for rule in ('-q status,ok', '-w depth,10', '-m depth', '-m items(*).value'):
+            self.assertIn('profile: %s ' % rule, report[0][0])
+        self.assertIn('profile: firstbyte', report[0][0])
+
+    def test_profile_top(self):
+        _, mock_print = self.run_check(['-e', 'status', 'depth', '-m', 'depth', '--profile', '--profile-top', '1'])
+        report = mock_print.call_args_list[1][0][0]
+        self.assertIn('profile: slowest 1 of 3 rules', report)
+        self.assertEqual(len([line for line in report.splitlines() if line.startswith('profile: -')]), 1)
+
+    def test_profile_abort(self):
+        # The test server does not answer POST requests with JSON
+        code, mock_print = self.run_check(['-X', 'POST', '-D', '{}', '--profile'])
+        self.assertEqual(code, 3)
+        self.assertIn('profile: abort', mock_print.call_args_list[1][0][0])
+
+    def test_profile_batch(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.batch') as batch:
+            batch.write('health -q status,ok\ndepth -w depth,10\n')
+            batch.flush()
+            code, mock_print = self.run_check(['--batch', batch.name, '--profile'])
+        self.assertEqual(code, 0)
+        report = mock_print.call_args_list[-1][0][0]
+        self.assertIn('profile: evaluate and output', report)
+        self.assertIn('profile: -q status,ok', report)
+        self.assertIn('profile: -w depth,10', report)
+
+    def test_profile_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'check.prof')
+            code, mock_print = self.run_check(['-q', 'status,ok', '--profile-file', path])
+            self.assertEqual(code, 0)
+            self.assertEqual(mock_print.call_count, 1)
+            stats = pstats.Stats(path)
+        self.assertTrue(any(function[2] == 'check' for function in stats.stats))
+
+    def test_rule_timing(self):
+        rules = parseArgs(['-H', 'localhost', '-q', 'status,ok', 'depth,5', '-c', 'depth,1'])
+        rules.profiler = Profile(Profile.now(), 10)
+        processor = JsonRuleProcessor(json.loads(DOCUMENT), rules, metric_prefix='host:')
+        self.assertEqual(processor.checkWarning(), '')
+        self.assertEqual(processor.checkCritical(), ' Value (5) for key depth was outside the range 0:1.')
+        self.assertEqual([rule[0] for rule in rules.profiler.rules],
+                         ['host:-q status,ok', 'host:-q depth,5', 'host:-c depth,1'])
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+
+import threading
+import time
+import unittest.mock as mock
+import urllib.error
+import sys
+
+sys.path.append('..')
+
+from check_http_json import *
+from .helpers import JsonHandler, ServerTestCase
+
+
+class SlowHandler(JsonHandler):
+    """
+    Delays the responses to the first slow requests by the delay of the server
+    """
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+            number = self.server.requests
+        if number <= self.server.slow:
+            time.sleep(self.server.delay)
+        self.send_body(b'{"status": "ok", "request": %d}' % number)
+
+
+class RetryTest(ServerTestCase):
+    """
+    Tests for the retries and hedged requests
+    """
+    handler = SlowHandler
+
+    def setUp(self):
+        super().setUp()
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self.server.slow = 1
+        self.server.delay = 1
+
+    def test_hedge(self):
+        start = time.monotonic()
+        code, mock_print = self.run_check(['-H', self.host, '-q', 'request,2', '--hedge-after', '100', '-d'])
+        self.assertEqual(code, 0)
+        self.assertLess(time.monotonic() - start, self.server.delay)
+        output = '\n'.join(str(call[0][0]) for call in mock_print.call_args_list)
+        self.assertIn('request: no response headers after 100ms, sending attempt 2', output)
+        self.assertIn('request: attempt 2 received the response headers after', output)
+
+    def test_hedge_silent_after_check(self):
+        with mock.patch('builtins.print') as mock_print:
+            with self.assertRaises(SystemExit):
+                main(['-H', self.host, '-q', 'request,2', '--hedge-after', '100', '-d'])
+            calls = mock_print.call_count
+            # The slow first attempt ends after the check
+            time.sleep(self.server.delay + 0.2)
+        self.assertEqual(mock_print.call_count, calls)
+
+    def test_hedge_timing(self):
+        code, mock_print = self.run_check(['-H', self.host, '-q', 'request,2', '--hedge-after', '100',
+                                           '--timing', '-d'])
+        self.assertEqual(code, 0)
+        output = '\n'.join(str(call[0][0]) for call in mock_print.call_args_list)
+        self.assertRegex(output, r'attempt 2 received the response headers after [0-9.]+s \(connect [0-9.]+s, ')
+        self.assertIn("'time_connect'=", output)
+
+    def test_hedge_first_response(self):
+        self.server.delay = 0
+        code, mock_print = self.run_check(['-H', self.host, '-q', 'request,1', '--hedge-after', '1000', '-d'])
+        self.assertEqual(code, 0)
+        self.assertEqual(self.server.requests, 1)
+        output = '\n'.join(str(call[0][0]) for call in mock_print.call_args_list)
+        self.assertNotIn('attempt 2', output)
+
+    def test_hedge_timeout(self):
+        self.server.slow = 2
+        self.server.delay = 3
+        code, mock_print = self.run_check(['-H', self.host, '-q', 'status,ok', '--hedge-after', '100', '-t', '1'])
+        self.assertEqual(code, 3)
+        self.assertIn('socket timeout after 1 seconds', mock_print.call_args[0][0])
+
+    def test_retries(self):
+        self.server.delay = 0
+        urlopen = urllib.request.urlopen
+        failures = [urllib.error.URLError(ConnectionRefusedError(111, 'Connection refused'))] * 2
+
+        def refuse_twice(*args, **kwargs):
+            if failures:
+                raise failures.pop()
+            return urlopen(*args, **kwargs)
+
+        with mock.patch('urllib.request.urlopen', side_effect=refuse_twice) as mock_urlopen:
+            code, mock_print = self.run_check(['-H', self.host, '-q', 'status,ok', '--retries', '2', '-d'])
+        self.assertEqual(code, 0)
+        self.assertEqual(mock_urlopen.call_count, 3)
+        output = '\n'.join(str(call[0][0]) for call in mock_print.call_args_list)
+        self.assertIn('request: attempt 2 failed after', output)
+        self.assertIn('request: retry 2 of 2 in', output)
+        self.assertIn('request: attempt 3 received the response headers after', output)
+
+    def test_retries_exhausted(self):
+        start = time.monotonic()
+        code, mock_print = self.run_check(['-H', '127.0.0.1:1', '-q', 'status,ok', '--retries', '3', '-d'])
+        self.assertEqual(code, 3)
+        self.assertLess(time.monotonic() - start, 2)
+        output = '\n'.join(str(call[0][0]) for call in mock_print.call_args_list)
+        self.assertEqual(output.count('failed after'), 4)
+        self.assertIn('URLError', mock_print.call_args[0][0])
+
+    def test_retries_within_timeout(self):
+        with mock.patch('check_http_json.RETRY_BACKOFF', 10):
+            with mock.patch('random.uniform', side_effect=lambda low, high: high):
+                code, _ = self.run_check(['-H', '127.0.0.1:1', '-q', 'status,ok', '--retries', '3', '-t', '1'])
+        self.assertEqual(code, 3)
+
+    def test_no_hedge_for_post(self):
+        args = parseArgs(['-H', self.host, '--hedge-after', '10', '-X', 'POST'])
+        with mock.patch('check_http_json.attempt_urlopen', return_value='response') as mock_attempt:
+            self.assertEqual(hedged_urlopen(args, 'http://%s/' % self.host, None, time.monotonic() + 1, iter([1])),
+                             'response')
+        self.assertEqual(mock_attempt.call_count, 1)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+
+import json
+import os
+import tempfile
+import unittest.mock as mock
+import sys
+
+sys.path.append('..')
+
+from check_http_json import CheckState, parseArgs
+from .helpers import JsonHandler, ServerTestCase
+
+
+class ETagHandler(JsonHandler):
+    etag = '"1"'
+    requests = []
+
+    def do_GET(self):
+        ETagHandler.requests.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_body(b'', 304, [('ETag', self.etag)])
+            return
+        self.send_body(json.dumps(self.document).encode(), headers=[('ETag', self.etag)])
+
+
+class StateTest(ServerTestCase):
+    """
+    Tests for --state-file
+    """
+    handler = ETagHandler
+
+    def setUp(self):
+        ETagHandler.requests = []
+        ETagHandler.etag = '"1"'
+        ETagHandler.document = {'status': 'ok', 'depth': 50, 'updated': '2000-01-01T00:00:00+00:00'}
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self.directory.name, 'check.state')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_check(self, args):
+        code, mock_print = super().run_check(['-H', self.host, '--state-file', self.state_file] + args)
+        return code, mock_print.call_args[0][0]
+
+    def test_not_modified(self):
+        args = ['-w', 'depth,10', '-m', 'depth']
+        code, output = self.run_check(args)
+        self.assertEqual(code, 1)
+        self.assertIn('Value (50) for key depth was outside the range 0:10.', output)
+
+        with mock.patch('check_http_json.JsonRuleProcessor') as processor:
+            self.assertEqual(self.run_check(args), (code, output))
+            processor.assert_not_called()
+        self.assertEqual(ETagHandler.requests, [None, '"1"'])
+
+        # Modified
+        ETagHandler.etag = '"2"'
+        ETagHandler.document = {'status': 'ok', 'depth': 5}
+        code, output = self.run_check(args)
+        self.assertEqual(code, 0)
+        self.assertTrue(output.endswith("|'depth'=5"))
+        self.assertEqual(ETagHandler.requests, [None, '"1"', '"1"'])
+
+    def test_not_modified_time_rules(self):
+        args = ['-q', 'status,ok', '--key_time', 'updated,30d']
+        code, output = self.run_check(args)
+        self.assertEqual(code, 1)
+        self.assertIn('older than now-30d', output)
+
+        with open(self.state_file, encoding='utf-8') as state_file:
+            self.assertEqual(json.load(state_file)['times'], {'updated': '2000-01-01T00:00:00+00:00'})
+
+        code, output = self.run_check(['-q', 'status,ok', '--key_time', 'updated,100000d'])
+        self.assertEqual(ETagHandler.requests[-1], None)
+        self.assertEqual(code, 0)
+
+        # Only the time relative rules are applied again
+        with mock.patch('check_http_json.apply_rules') as apply_rules:
+            code, output = self.run_check(['-q', 'status,ok', '--key_time', 'updated,100000d'])
+            apply_rules.assert_not_called()
+        self.assertEqual(ETagHandler.requests[-1], '"1"')
+        self.assertEqual(code, 0)
+
+    def test_state_file_unusable(self):
+        self.state_file = os.path.join(self.directory.name, 'missing', 'check.state')
+        code, output = self.run_check(['-w', 'depth,10'])
+        self.assertEqual(code, 1)
+        self.assertIn('Value (50) for key depth was outside the range 0:10.', output)
+
+        self.state_file = os.path.join(self.directory.name, 'check.state')
+        with open(self.state_file, 'w', encoding='utf-8') as state_file:
+            json.dump(['not', 'a', 'state'], state_file)
+        self.assertEqual(self.run_check(['-w', 'depth,10']), (code, output))
+        with open(self.state_file, encoding='utf-8') as state_file:
+            self.assertEqual(json.load(state_file)['validators'], {'ETag': '"1"'})
+
+    def test_state_key(self):
+        key = CheckState.checkKey(parseArgs(['-H', 'localhost', '-q', 'a,b']))
+        self.assertEqual(key, CheckState.checkKey(parseArgs(['-H', 'localhost', '-q', 'a,b', '-d'])))
+        self.assertNotEqual(key, CheckState.checkKey(parseArgs(['-H', 'localhost', '-q', 'a,c'])))
+
+    def test_state_file_multiple_hosts(self):
+        code, output = self.run_check(['-H', '%s,%s' % (self.host, self.host)])
+        self.assertEqual(code, 3)
+        self.assertIn('--state-file', output)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+
+import io
+import json
+import unittest
+import unittest.mock as mock
+import sys
+
+sys.path.append('..')
+
+from check_http_json import JsonStreamParser, JsonHelper, _compileKey, main
+from .helpers import MockResponse
+
+
+DOCUMENT = {
+    "status": "ok",
+    "name": "node \"1\"",
+    "items": [{"id": i, "state": "ok" if i % 3 else "down", "tags": ["a", "b"]} for i in range(20)],
+    "nested": {"a": {"b": [1, 2, {"c": 3}]}},
+    "empty": {},
+}
+
+
+def parse(document, keys, chunk_size=7):
+    body = document if isinstance(document, bytes) else json.dumps(document).encode()
+    stream = io.BytesIO(body)
+    parser = JsonStreamParser(stream, {_compileKey(key, '.') for key in keys}, chunk_size=chunk_size)
+    return parser, parser.parse()
+
+
+class StreamParserTest(unittest.TestCase):
+    """
+    Tests for the JsonStreamParser
+    """
+
+    def assertSameValues(self, keys):
+        _, data = parse(DOCUMENT, keys)
+        full = JsonHelper(DOCUMENT, '.', ':')
+        streamed = JsonHelper(data, '.', ':')
+        for key in keys:
+            self.assertEqual(list(full.expandKey(key)), list(streamed.expandKey(key)))
+
+    def test_stream_values(self):
+        self.assertSameValues(['status', 'name', 'nested.a.b(2).c', 'empty', 'missing'])
+        self.assertSameValues(['items(*).state', 'items(3).id', 'items(3)', 'nested.a.b(*)'])
+        self.assertSameValues(['(0)', 'status.missing', 'items.missing', 'nested'])
+        self.assertSameValues(['items(?state!=ok).id', 'items(?id>15).tags(*)', 'items(?state)(0)'])
+
+    def test_stream_drops_other_values(self):
+        _, data = parse(DOCUMENT, ['items(*).state'])
+        self.assertEqual(list(data), ['items'])
+        self.assertEqual(data['items'][1], {'state': 'ok'})
+        self.assertTrue(data)
+
+        _, data = parse({"other": 1}, ['missing'])
+        self.assertEqual(data, {})
+        self.assertTrue(data)
+
+        _, data = parse({}, ['missing'])
+        self.assertFalse(data)
+
+    def test_stream_stops_early(self):
+        document = {"status": "ok", "items": [{"id": i} for i in range(10000)]}
+        parser, data = parse(document, ['status'], chunk_size=1024)
+        self.assertEqual(data, {'status': 'ok'})
+        self.assertTrue(parser.stopped)
+        self.assertEqual(parser.size, 1024)
+
+        parser, data = parse(document, ['items(*).id'], chunk_size=1024)
+        self.assertEqual(len(data['items']), 10000)
+        self.assertEqual(parser.size, len(json.dumps(document)))
+
+    def test_stream_unicode_and_escapes(self):
+        document = {"kéy": "vaïue \\ \"x\"", "a\"b": [1]}
+        for chunk_size in (1, 2, 3, 65536):
+            body = json.dumps(document, ensure_ascii=False).encode()
+            _, data = parse(body, ['kéy', 'a"b(0)'], chunk_size)
+            self.assertEqual(data, document)
+
+    def test_stream_invalid(self):
+        for body in (b'', b'{"status" "ok"}', b'{"a" 1, "status": "ok"}', b'{"status": tru}', b'[1, 2'):
+            with self.assertRaises(ValueError):
+                parse(body, ['status'])
+
+
+class StreamMainTest(unittest.TestCase):
+    """
+    Tests for --stream
+    """
+
+    @mock.patch('builtins.print')
+    @mock.patch('urllib.request.urlopen')
+    def test_main_with_stream(self, mock_request, mock_print):
+        mock_request.return_value = MockResponse(json.dumps(DOCUMENT).encode())
+        args = ['-H', 'localhost', '--stream', '-q', 'status,ok', '-E', 'items(*).state>state']
+
+        with self.assertRaises(SystemExit) as test:
+            main(args)
+
+        self.assertEqual(test.exception.code, 0)
+        mock_print.assert_called_once_with('OK: Status OK.')
+
+        mock_request.return_value = MockResponse(json.dumps(DOCUMENT).encode())
+        args = ['-H', 'localhost', '--stream', '-Q', 'items(*).state,ok']
+
+        with self.assertRaises(SystemExit) as test:
+            main(args)
+
+        self.assertEqual(test.exception.code, 2)
+
+        mock_request.return_value = MockResponse(json.dumps(DOCUMENT).encode())
+        args = ['-H', 'localhost', '--stream', '-m', 'max(items(*).id)', 'count(items(*).tags(*))']
+
+        with self.assertRaises(SystemExit) as test:
+            main(args)
+
+        self.assertEqual(test.exception.code, 0)
+        self.assertTrue(mock_print.call_args[0][0].endswith("|'max(items(*).id)'=19 'count(items(*).tags(*))'=40"))
+
+    @mock.patch('builtins.print')
+    @mock.patch('urllib.request.urlopen')
+    def test_main_with_stream_error(self, mock_request, mock_print):
+        mock_request.return_value = MockResponse(b'{"status": ')
+        args = ['-H', 'localhost', '--stream', '-q', 'status,ok']
+
+        with self.assertRaises(SystemExit) as test:
+            main(args)
+
+        self.assertEqual(test.exception.code, 3)
+
+    @mock.patch('builtins.print')
+    @mock.patch('urllib.request.urlopen')
+    def test_main_with_stream_and_cache(self, mock_request, mock_print):
+        args = ['-H', 'localhost', '--stream', '--cache-ttl', '10', '-q', 'status,ok']
+
+        with self.assertRaises(SystemExit) as test:
+            main(args)
+
+        self.assertEqual(test.exception.code, 3)
+        mock_request.assert_not_called()
+        mock_print.assert_called_once_with(
+            'UNKNOWN: Status UNKNOWN. --stream does not apply to cached responses (--cache-ttl).')
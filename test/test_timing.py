@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+
+import json
+import os
+import re
+import ssl
+import sys
+
+sys.path.append('..')
+
+from .helpers import JsonHandler, ServerTestCase
+
+
+TLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tls')
+DOCUMENT = json.dumps({'status': 'ok', 'depth': 5}).encode()
+
+
+class DocumentHandler(JsonHandler):
+    document = DOCUMENT
+
+
+def performance_data(output):
+    return dict(re.findall(r"'(\w+)'=([\d.]+)", output.split('|', 1)[1]))
+
+
+class TimingTest(ServerTestCase):
+    """
+    Tests for --timing
+    """
+    handler = DocumentHandler
+
+    def run_check(self, args):
+        code, mock_print = super().run_check(args)
+        return code, mock_print.call_args[0][0]
+
+    def test_timing(self):
+        for options in ([], ['--stream']):
+            code, output = self.run_check(['-H', self.host, '-q', 'status,ok', '-m', 'depth', '--timing'] + options)
+            self.assertEqual(code, 0, output)
+            data = performance_data(output)
+            self.assertEqual(data['depth'], '5')
+            self.assertEqual(data['size'], str(len(DOCUMENT)))
+            self.assertEqual(data['time_tls'], '0.000000')
+            self.assertGreater(float(data['time_connect']), 0)
+            self.assertGreater(float(data['time_firstbyte']), 0)
+            phases = sum(float(data['time_' + phase]) for phase in ('connect', 'firstbyte', 'download', 'parse', 'eval'))
+            self.assertLessEqual(phases, float(data['time']))
+
+    def test_timing_tls(self):
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(os.path.join(TLS, 'cert.pem'), os.path.join(TLS, 'key.pem'))
+        host = '127.0.0.1:%d' % self.start_server(DocumentHandler, context).server_address[1]
+        code, output = self.run_check(['-H', host, '-s', '-k', '-q', 'status,ok', '--timing'])
+        self.assertEqual(code, 0, output)
+        self.assertGreater(float(performance_data(output)['time_tls']), 0)
+
+    def test_timing_thresholds(self):
+        code, output = self.run_check(['-H', self.host, '--timing', '--timing-warning', '0.000001'])
+        self.assertEqual(code, 1)
+        self.assertIn('for key time was outside the range 0:0.000001', output)
+        self.assertIn("'time'=", output)
+        self.assertIn(";0.000001;;0 ", output)
+
+        code, output = self.run_check(['-H', self.host, '--timing', '--timing-warning', '60', '--timing-critical', '@0:60'])
+        self.assertEqual(code, 2)
+
+        code, output = self.run_check(['-H', self.host, '--timing', '--timing-warning', 'abc'])
+        self.assertEqual(code, 3)
+        self.assertEqual(output, 'UNKNOWN: Status UNKNOWN. Invalid threshold --timing-warning abc: invalid range abc')
+
+    def test_timing_multiple_hosts(self):
+        code, output = self.run_check(['-H', '%s,%s' % (self.host, self.host), '--timing'])
+        self.assertEqual(code, 3)
+        self.assertIn('--timing only applies to a single host and path without --batch.', output)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+
+import socket
+import ssl
+import threading
+import unittest
+import unittest.mock as mock
+import sys
+
+sys.path.append('..')
+
+from check_http_json import parseArgs, prepare_context
+
+
+class TLSTest(unittest.TestCase):
+    """
+    Tests for the TLS context
+    """
+
+    def setUp(self):
+        self.server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.server_context.load_cert_chain('test/tls/cert.pem', 'test/tls/key.pem')
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.close()
+
+    def serve(self):
+        try:
+            while True:
+                conn, _ = self.server.accept()
+                with self.server_context.wrap_socket(conn, server_side=True) as tls:
+                    tls.recv(1)
+                    tls.sendall(b'y')
+        except OSError:
+            pass
+
+    def connect(self, context):
+        sock = socket.create_connection(self.server.getsockname())
+        with context.wrap_socket(sock, server_hostname='localhost') as tls:
+            tls.sendall(b'x')
+            tls.recv(1)
+            return tls.session_reused
+
+    def test_context_reused(self):
+        args = parseArgs(['-H', 'localhost', '--ssl', '-k'])
+        context = prepare_context(args)
+        self.assertIs(context, prepare_context(args))
+        self.assertIsNot(context, prepare_context(parseArgs(['-H', 'localhost', '--ssl'])))
+
+    def test_session_resumed(self):
+        context = prepare_context(parseArgs(['-H', 'localhost', '--ssl', '-k', '-d']))
+
+        with mock.patch('builtins.print') as mock_print:
+            self.assertFalse(self.connect(context))
+            self.assertTrue(self.connect(context))
+
+        self.assertTrue(' full in ' in str(mock_print.call_args_list[0]))
+        self.assertTrue(' resumed in ' in str(mock_print.call_args_list[1]))